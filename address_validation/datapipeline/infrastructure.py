@@ -83,6 +83,11 @@ class DataPipeline(Construct):
         self.producer_glue_job_script = f"s3://{self.cdk_asset_bucket_name}/{self.runtime_asset_path}/_lambda/{self.producer_glue_job_name}.py"
         self.address_val_glue_job_name = "validate-address-smarty"
         self.address_val_glue_job_script = f"s3://{self.cdk_asset_bucket_name}/{self.runtime_asset_path}/_glue/{self.address_val_glue_job_name}.py"
+        self.spark_val_glue_job_name = "validate-address-spark"
+        self.spark_val_glue_job_script = f"s3://{self.cdk_asset_bucket_name}/{self.runtime_asset_path}/_glue/{self.spark_val_glue_job_name}.py"
+        # shared runtime modules in _lambda/util passed to the python shell glue jobs with --extra-files
+        self.glue_util_modules = ["utils.py", "s3_csv_reader.py", "result_builder.py", "output_writer.py", "result_cache.py", "runtime_cache.py", "address_dedup.py", "address_template.py", "rate_limiter.py", "providers.py", "hedging.py", "change_detection.py", "spark_validation.py"]
+        self.glue_extra_files = ",".join(f"s3://{self.cdk_asset_bucket_name}/{self.runtime_asset_path}/_lambda/util/{module}" for module in self.glue_util_modules)
         # update run time as needed
         self.lambda_runtime = _lambda.Runtime.PYTHON_3_9
         print(f"Stack is in account:{self.account} and region:{self.region}")
@@ -96,8 +101,35 @@ class DataPipeline(Construct):
         self.ssm_awsloc_param_name = f"{self.parameter_prefix}awslocation"
         self.ssm_producer_param_name = f"{self.parameter_prefix}msg-producer"
         self.awsloc_place_index_name = f"{self.project_prefix}-place-index"
+        # maps the address fields used by the validators to the columns of the input file
+        self.schema_map = {
+            "address_line1": "address1",
+            "address_line2": "address2",
+            "city": "city",
+            "state": "state_code",
+            "zip_code": "zip_code",
+            "country": "country"
+        }
         self.glue_crawler_path = f"s3://{self.data_bucket_name}/{self.dataset_path_prefix}/"
         self.databrew_output_path = f"{self.dataset_path_prefix}/{self.dataset_file_name}-normalized"
+        # staging folder for message batches sent to SQS as claim check pointers
+        self.claim_check_folder = "staging"
+        self.claim_check_prefix = f"{self.dataset_path_prefix}/{self.claim_check_folder}"
+        # producer progress of each input file, lets a timed out or retried producer resume
+        self.checkpoint_folder = "checkpoints"
+        self.checkpoint_prefix = f"{self.dataset_path_prefix}/{self.checkpoint_folder}"
+        # source_id and address hash manifest of the last successful validation run of each input
+        self.manifest_folder = "manifests"
+        self.manifest_prefix = f"{self.dataset_path_prefix}/{self.manifest_folder}"
+        # hive partitioned dataset of the validation output, its partitions are registered by the validators
+        self.validated_folder = f"{self.dataset_file_name}-validated".replace(".", "-")
+        self.validated_prefix = f"{self.dataset_path_prefix}/{self.validated_folder}"
+        self.validated_table_name = f"{self.glue_table_name}_validated".replace("-", "_")
+        self.validated_partition_keys = {"run_date": "string", "o_valid": "int", "o_state_code": "string"}
+        # validation results reused across runs, keyed by the provider and the normalized address
+        self.result_cache_table_name = f"{self.parameter_prefix}result-cache"
+        self.result_cache_ttl_days = 30
+        self.producer_lambda_function_name = "ProduceAddressValidationBatch"
         self.databrew_recipe_name = "normalize-address-databrew-recipe"
         self.databrew_recipe_path = f"{self.runtime_asset_path}/databrew/{self.databrew_recipe_file_name}"
         # to use in role policies
@@ -130,8 +162,9 @@ class DataPipeline(Construct):
 
         ## use alternative lambda based architecture instead of glue
         # create sqs queues. Since the queue arn is referred in the role, creating that first
-        # self.address_val_sqs_queue = self.add_sqs_queue("address-val-sqs-queue")
+        # messages that failed max_receive_count times move to the dead-letter queue instead of being retried forever
         # self.address_val_dlq = self.add_sqs_queue("address-val-dlq")
+        # self.address_val_sqs_queue = self.add_sqs_queue("address-val-sqs-queue", self.address_val_dlq)
         # self.producer_dlq = self.add_sqs_queue("producer-dlq")
 
         # builds a single role for the application
@@ -144,6 +177,7 @@ class DataPipeline(Construct):
         self.add_databrew_job()
         self.add_glue_jobs()
         self.add_crawler()
+        self.add_result_cache_table()
 
         # ssm parameters used by glue job and lambda functions
         self.add_ssm_parameters()
@@ -222,6 +256,17 @@ class DataPipeline(Construct):
 
         if self.data_bucket_exist_flag.lower() == "n":
             self.data_bucket = self.get_s3_bucket(self.data_bucket_name)
+            # claim check batches are only needed until the validators consume them
+            self.data_bucket.add_lifecycle_rule(
+                id="expire-claim-check-staging",
+                prefix=f"{self.claim_check_prefix}/",
+                expiration=Duration.days(7)
+            )
+            self.data_bucket.add_lifecycle_rule(
+                id="expire-producer-checkpoints",
+                prefix=f"{self.checkpoint_prefix}/",
+                expiration=Duration.days(30)
+            )
         else:
             self.data_bucket = s3.Bucket.from_bucket_name(self, f"{self.data_bucket_prefix}-bucket", self.data_bucket_name)
 
@@ -357,6 +402,30 @@ class DataPipeline(Construct):
             ]
         )
         
+        # the producer lambda invokes itself to continue a file it could not finish before its timeout
+        self.lambda_invoke_policy_statement = iam.PolicyStatement(
+            sid=f"{self.project_prefix}LambdaInvoke",
+            actions=[
+                "lambda:InvokeFunction"
+                ],
+            resources=[
+                f"arn:aws:lambda:{self.region}:{self.account}:function:{self.producer_lambda_function_name}"
+            ]
+        )
+        
+        self.dynamodb_policy_statement = iam.PolicyStatement(
+            sid=f"{self.project_prefix}ResultCacheAccess",
+            actions=[
+                "dynamodb:BatchGetItem",
+                "dynamodb:BatchWriteItem",
+                "dynamodb:GetItem",
+                "dynamodb:PutItem"
+                ],
+            resources=[
+                f"arn:aws:dynamodb:{self.region}:{self.account}:table/{self.result_cache_table_name}"
+            ]
+        )
+        
         inline_policy_doc = iam.PolicyDocument(statements=[
             self.s3_policy_statement,
             self.kms_policy_statement,
@@ -364,7 +433,9 @@ class DataPipeline(Construct):
             self.loggroup_policy_statement,
             self.secrets_policy_statement,
             # self.sqs_policy_statement,
-            self.awsloc_policy_statement])
+            self.awsloc_policy_statement,
+            self.lambda_invoke_policy_statement,
+            self.dynamodb_policy_statement])
     
         self.role = iam.Role(
             self,
@@ -473,7 +544,17 @@ class DataPipeline(Construct):
             "--bucket": self.data_bucket.bucket_name,
             "--key": self.databrew_output_path,
             "--limit_rows": "100000000",
-            "--extra-files": f"s3://{self.cdk_asset_bucket.bucket_name}/{self.runtime_asset_path}/_lambda/util/utils.py"
+            "--send_concurrency": "4",
+            "--send_queue_depth": "8",
+            "--range_concurrency": "4",
+            "--range_size_mb": "128",
+            "--file_concurrency": "4",
+            "--claim_check_prefix": self.claim_check_prefix,
+            "--claim_check_rows": "5000",
+            "--message_layout": "columnar",
+            "--message_compression": "gzip",
+            "--schema_map": json.dumps(self.schema_map),
+            "--extra-files": self.glue_extra_files
         }
         
         glue_job = glue.CfnJob(
@@ -511,7 +592,7 @@ class DataPipeline(Construct):
             "--bucket": self.data_bucket.bucket_name,
             "--key": self.databrew_output_path,
             "--limit_rows": "100000000",
-            "--extra-files": f"s3://{self.cdk_asset_bucket.bucket_name}/{self.runtime_asset_path}/_lambda/util/utils.py",
+            "--extra-files": self.glue_extra_files,
             "--additional-python-modules":"smartystreets-python-sdk==4.11.16"
         }
         
@@ -532,6 +613,53 @@ class DataPipeline(Construct):
         )
 
         CfnOutput(self, "Smarty Address Validation Glue Job", value=glue_job.name)
+
+    def add_spark_validate_job(self) -> None:
+        """
+        Creates the glue spark job that validates the normalized records on its executors
+        """
+        # https://docs.aws.amazon.com/glue/latest/dg/aws-glue-programming-etl-glue-arguments.html
+        arguments = {
+            "--job-language":	"python",
+            "--TempDir":	f"s3://{self.glue_asset_bucket.bucket_name}/temporary/",
+            "--enable-metrics":	"true",
+            "--enable-continuous-cloudwatch-log":	"true",
+            "--enable-spark-ui":	"true",
+            "--spark-event-logs-path":	f"s3://{self.glue_asset_bucket.bucket_name}/sparkHistoryLogs/",
+            "--enable-glue-datacatalog":	"true",
+            "--enable-job-insights":	"true",
+            "--ssm_parameter": self.ssm_smarty_param_name,
+            "--delimiter": ",",
+            "--encoding": "utf-8",
+            "--bucket": self.data_bucket.bucket_name,
+            "--key": self.databrew_output_path,
+            # partitions of the records, 0 runs two tasks per executor core. the rate_limit_per_second
+            # of the configuration is split across the tasks running at the same time
+            "--partitions": "0",
+            "--extra-py-files": self.glue_extra_files,
+            # the awswrangler of requirements-frozen.txt, its pandas and pyarrow ranges hold the glue 4.0 versions so they are not upgraded
+            "--additional-python-modules":"smartystreets-python-sdk==4.11.16,awswrangler==3.0.0"
+        }
+
+        # fixed workers rather than auto scaling, so the share of the rate limit of each task holds
+        glue_job = glue.CfnJob(
+            self,
+            "Spark Validation Glue Job",
+            name=self.spark_val_glue_job_name,
+            role=self.role.role_arn,
+            worker_type="G.1X",
+            number_of_workers=10,
+            command=glue.CfnJob.JobCommandProperty(
+                name=f"glueetl",
+                python_version="3",
+                script_location=self.spark_val_glue_job_script,
+            ),
+            # mapInPandas needs spark 3 with a recent pyarrow
+            glue_version="4.0",
+            default_arguments=arguments,
+        )
+
+        CfnOutput(self, "Spark Address Validation Glue Job", value=glue_job.name)
     
     def add_glue_jobs(self) -> None:
         """
@@ -540,6 +668,7 @@ class DataPipeline(Construct):
         self.add_normalize_glue_job()
         # self.add_produce_messages_job()
         self.add_smarty_validate_job()
+        self.add_spark_validate_job()
 
 # deploy all runtime to S3 #
     def add_scripts(self):
@@ -571,6 +700,7 @@ class DataPipeline(Construct):
         )
         # Retain the database when deleting
         glue_database.apply_removal_policy(policy=RemovalPolicy.DESTROY)
+        self.add_validated_table(glue_database)
 
         self.audit_policy = glue.CfnCrawler.SchemaChangePolicyProperty(update_behavior='UPDATE_IN_DATABASE', delete_behavior='LOG')
         
@@ -581,7 +711,7 @@ class DataPipeline(Construct):
             targets=glue.CfnCrawler.TargetsProperty(
                 s3_targets= [glue.CfnCrawler.S3TargetProperty(
                     path=self.glue_crawler_path,
-                    exclusions= ["glue-scripts/**"],
+                    exclusions= ["glue-scripts/**", f"{self.claim_check_folder}/**", f"{self.checkpoint_folder}/**", f"{self.manifest_folder}/**", f"{self.validated_folder}/**"],
                     sample_size=100
                 )]
             ),
@@ -593,6 +723,46 @@ class DataPipeline(Construct):
         )
         CfnOutput(self, "Glue_Crawler_Name", value=self.glue_crawler.name)
 
+    def add_validated_table(self, glue_database) -> None:
+        """
+        Creates the partitioned catalog table of the validation output
+        the partition columns are not stored in the parquet files
+        """
+        columns = {
+            "i_input_msg_id": "string",
+            "i_batch_index": "bigint",
+            "i_input_id": "string",
+            "i_full_addr_txt": "string",
+            "o_street_address1": "string",
+            "o_street_address2": "string",
+            "o_city": "string",
+            "o_full_postal_code": "string",
+            "o_country": "string",
+            "o_external_addr_id": "string",
+            "o_provider": "string"
+        }
+        validated_table = glue.CfnTable(self, f"{self.project_prefix}-validated-table",
+            catalog_id=self.account,
+            database_name=self.glue_database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=self.validated_table_name,
+                table_type="EXTERNAL_TABLE",
+                parameters={"classification": "parquet", "EXTERNAL": "TRUE"},
+                partition_keys=[glue.CfnTable.ColumnProperty(name=name, type=type) for name, type in self.validated_partition_keys.items()],
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    location=f"s3://{self.data_bucket_name}/{self.validated_prefix}/",
+                    columns=[glue.CfnTable.ColumnProperty(name=name, type=type) for name, type in columns.items()],
+                    input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                    output_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+                    )
+                )
+            )
+        )
+        validated_table.node.add_dependency(glue_database)
+        CfnOutput(self, "Validated_Table_Name", value=self.validated_table_name)
+
 # Step Function to managed the job flow #
     def add_workflow(self):
 
@@ -795,8 +965,7 @@ class DataPipeline(Construct):
                     )
                 ),
                 overwrite=True,
-                compression_format="GZIP",
-                max_output_files=1
+                compression_format="GZIP"
             )]
         )
         self.databrew_job.add_dependency(self.cfn_dataset)
@@ -811,11 +980,30 @@ class DataPipeline(Construct):
             alias_name=f"alias/{self.kms_key_alias}"
             )
         CfnOutput(self, "KMS arn used", value=self.kms_key.key_arn)
+# Result cache #
+    def add_result_cache_table(self) -> None:
+        """
+        Creates the DynamoDB table of the validation result cache, items expire with the expires_at TTL attribute
+        """
+        self.result_cache_table = dynamodb.Table(
+            self,
+            "ResultCacheTable",
+            table_name=self.result_cache_table_name,
+            partition_key=dynamodb.Attribute(name="cache_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            encryption=dynamodb.TableEncryption.CUSTOMER_MANAGED,
+            encryption_key=self.kms_key,
+            removal_policy=RemovalPolicy.DESTROY
+        )
+        CfnOutput(self, "Result_Cache_Table", value=self.result_cache_table.table_name)
+
 # SSM parameters #
     def add_ssm_parameters(self) -> None:
         """
         Creates the SSM parameters
         """
+        schema_map = self.schema_map
         # CHANGE THE LIMIT ROWS AS PER NEED
         producer_param_value = {
             "chunk_size": 100,
@@ -825,7 +1013,32 @@ class DataPipeline(Construct):
             "cli_profile": "Default",
             # enable this for lambda based architecture
             # "sqs_queue": self.address_val_sqs_queue.queue_url,
-            "batch_mode": "chunk_size"
+            "batch_mode": "chunk_size",
+            # number of threads that build and send messages and the number of chunks buffered for them
+            "send_concurrency": 4,
+            "send_queue_depth": 8,
+            # files are split in newline aligned byte ranges of range_size_mb read by range_concurrency threads
+            # set range_concurrency to 1 to read the file as one stream in row order
+            "range_concurrency": 4,
+            "range_size_mb": 128,
+            # number of files of a prefix key produced at the same time
+            "file_concurrency": 1,
+            # batches are staged here and sent as pointer messages in batch_mode claim_check
+            # or when a chunk_size message is greater than 256kb
+            "claim_check_prefix": self.claim_check_prefix,
+            "claim_check_rows": 5000,
+            # the lambda producer checkpoints its progress every checkpoint_rows rows and hands the rest of the
+            # file over to a new invocation when less than stop_margin_seconds of its timeout is left,
+            # resumable runs read the file as one ordered stream
+            "checkpoint_prefix": self.checkpoint_prefix,
+            "checkpoint_rows": 50000,
+            "stop_margin_seconds": 60,
+            # versioned message envelope, layout columnar|records and compression none|gzip|zstd
+            # remove message_layout to send the plain json list of rows
+            "message_layout": "columnar",
+            "message_compression": "gzip",
+            # only source_id and the schema map columns are sent to the validators
+            "schema_map": schema_map
         }
         self.ssm_producer_param = ssm.StringParameter(
             self,
@@ -833,21 +1046,52 @@ class DataPipeline(Construct):
             parameter_name=self.ssm_producer_param_name,
             string_value=json.dumps(producer_param_value),
         )
-        schema_map = {
-                        "address_line1": "address1",
-                        "address_line2": "address2",
-                        "city": "city",
-                        "state": "state_code",
-                        "zip_code": "zip_code",
-                        "country": "country"
-                    }
         smarty_param_value = {
+                # validation provider of util/providers.py used by the glue jobs
+                "provider": "smarty",
                 "license_key": "us-core-cloud",
                 "url": "https://us-street.api.smartystreets.com/street-address",
                 "secret_name":self.AddressValidation_api_secret.secret_name,
                 "region_name": self.region,
                 "s3_bucket": self.data_bucket_name,
-                "s3_key": f"{self.dataset_path_prefix}/{self.dataset_file_name}-validated",
+                "s3_key": self.validated_prefix,
+                # number of 100 address batches validated and written at the same time by the lambda
+                "batch_concurrency": 4,
+                # sdk or async_http, the asyncio engine with pooled keep-alive connections
+                "engine": "sdk",
+                "http_timeout_seconds": 10,
+                # ceiling of the adaptive rate limiter in lookups per second for each lambda container,
+                # set it to the licence limit divided by the lambda concurrency. remove it to disable the limiter
+                "rate_limit_per_second": 1000,
+                "max_throttle_retries": 5,
+                "max_transient_retries": 3,
+                # results are coalesced in to parquet files of output_file_size_mb with row groups of output_row_group_rows,
+                # a file is also uploaded once it has been open output_max_buffer_seconds(long glue runs)
+                "output_file_size_mb": 128,
+                "output_row_group_rows": 100000,
+                "output_max_buffer_seconds": 900,
+                # hive partitions of the output registered in the catalog table, the rows of a file are sorted by output_sort_by
+                # so athena can skip row groups on postal code filters. sorted files are buffered in memory until they roll,
+                # output_max_buffered_rows bounds the rows buffered across the partitions
+                "output_partition_cols": list(self.validated_partition_keys),
+                "output_sort_by": "o_full_postal_code",
+                "output_max_buffered_rows": 1000000,
+                "output_database": self.glue_database_name,
+                "output_table": self.validated_table_name,
+                # addresses validated in the last cache_ttl_days are not sent to smarty again
+                "cache_table": self.result_cache_table_name,
+                "cache_ttl_days": self.result_cache_ttl_days,
+                # identical addresses are sent once per message, invocation also shares them between messages
+                # but a failed batch then fails the messages waiting on its addresses
+                "dedup_scope": "message",
+                # optional hedging, a "hedge" key like {"provider": "awslocation", "place_index": "venice-address-validation",
+                # "lookup_concurrency": 16, "percentile": 95, "failure_threshold": 5, "reset_seconds": 60} sends the batches
+                # slower than the percentile to aws location too, and all of them while smarty keeps failing.
+                # {"provider": "primary"} sends the slow batches to smarty again on another connection
+                # the glue job keeps a manifest of the source_id, address hash and output of each row under manifest_prefix,
+                # rows unchanged since the last successful run carry their output forward and are not sent to smarty.
+                # remove it to validate every row of each run
+                "manifest_prefix": self.manifest_prefix,
                 "schema_map": schema_map
                 }
         self.ssm_smarty_param = ssm.StringParameter(
@@ -857,10 +1101,28 @@ class DataPipeline(Construct):
             string_value=json.dumps(smarty_param_value)
         )
         awsloc_param_value = {
+            "provider": "awslocation",
             "region_name": self.region,
             "s3_bucket": self.data_bucket_name,
-            "s3_key": f"{self.dataset_path_prefix}/{self.dataset_file_name}-validated",
+            "s3_key": self.validated_prefix,
             "place_index": "venice-address-validation",
+            # ceiling of the adaptive rate limiter in searches per second for each lambda container
+            "rate_limit_per_second": 50,
+            # searches of a message sent at the same time over a client with as many pooled connections
+            "lookup_concurrency": 16,
+            "max_throttle_retries": 5,
+            "max_transient_retries": 3,
+            # results of an invocation are coalesced in to parquet files of output_file_size_mb
+            "output_file_size_mb": 128,
+            "output_row_group_rows": 100000,
+            "output_partition_cols": list(self.validated_partition_keys),
+            "output_sort_by": "o_full_postal_code",
+            "output_database": self.glue_database_name,
+            "output_table": self.validated_table_name,
+            "cache_table": self.result_cache_table_name,
+            "cache_ttl_days": self.result_cache_ttl_days,
+            # messages are searched one after the other, so they share the searches of the invocation
+            "dedup_scope": "invocation",
             "schema_map": schema_map
             }
 
@@ -918,9 +1180,9 @@ class DataPipeline(Construct):
         self.wrangler_layer =_lambda.LayerVersion.from_layer_version_attributes(self, "AWSSDKPandas-Python39-Arm64",
            layer_version_arn=f"arn:aws:lambda:{self.region}:336392948345:layer:AWSSDKPandas-Python39-Arm64:8")
     
-    def add_sqs_queue(self, queue_name: str) -> None:
+    def add_sqs_queue(self, queue_name: str, dead_letter_queue: sqs.IQueue=None, max_receive_count: int=5) -> None:
         """
-        Creates the sample SQS queue
+        Creates the sample SQS queue, with a redrive policy to dead_letter_queue when one is given
         """
         sqs_queue = sqs.Queue(
             self,
@@ -929,6 +1191,7 @@ class DataPipeline(Construct):
             encryption=sqs.QueueEncryption.KMS,
             encryption_master_key=self.kms_key,
             visibility_timeout=Duration.seconds(900),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=max_receive_count, queue=dead_letter_queue) if dead_letter_queue else None,
         )
         # Deny non SSL traffic
         sqs_queue.add_to_resource_policy(self.get_deny_non_ssl_policy(sqs_queue.queue_arn))
@@ -944,7 +1207,7 @@ class DataPipeline(Construct):
         self.producer_lambda = _lambda.Function(
             self, 
             "ProduceAddressValidationBatch-lambda",
-            function_name="ProduceAddressValidationBatch",
+            function_name=self.producer_lambda_function_name,
             runtime=self.lambda_runtime,
             handler="produce_addr_val_batch_msgs.lambda_handler",
             # code=_lambda.Code.from_bucket(bucket=self.cdk_asset_bucket, key=f"{self.lambda_script_bucket_key}/{self.lambda_script}"),
@@ -980,7 +1243,7 @@ class DataPipeline(Construct):
             role=self.role,
             environment={"SSM_PARAMETER": self.ssm_smarty_param_name},
         )
-        self.smarty_lambda.add_event_source(event_sources.SqsEventSource(self.address_val_sqs_queue, batch_size=10))
+        self.smarty_lambda.add_event_source(event_sources.SqsEventSource(self.address_val_sqs_queue, batch_size=10, report_batch_item_failures=True))
         CfnOutput(self, "Smarty_Lambda_Function", value=self.smarty_lambda.function_arn)
 
     def add_awsloc_lambda_function(self) -> None:
@@ -1004,7 +1267,7 @@ class DataPipeline(Construct):
             role=self.role,
             environment={"SSM_PARAMETER": self.ssm_awsloc_param_name},
         )
-        self.awsloc_lambda.add_event_source(event_sources.SqsEventSource(self.address_val_sqs_queue, batch_size=10))
+        self.awsloc_lambda.add_event_source(event_sources.SqsEventSource(self.address_val_sqs_queue, batch_size=10, report_batch_item_failures=True))
         CfnOutput(self, "AWSLocation_Lambda_Function", value=self.awsloc_lambda.function_arn)
 # Aws location place index # 
     def add_awsloc_place_index(self) -> None:
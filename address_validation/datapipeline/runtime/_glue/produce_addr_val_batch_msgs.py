@@ -4,11 +4,17 @@ Uses awswrangler python module to read S3 data files
 """
 import boto3
 import json
-import awswrangler as wr
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from functools import partial
+import pandas as pd
 import logging
 from botocore.exceptions import ClientError
-# from util import utils # use this to run as lambda function
-import utils # use this only for glue jobs
+# from util import utils, s3_csv_reader, address_template # use this to run as lambda function
+import utils, s3_csv_reader, address_template # use this only for glue jobs
 import os
 import sys
 from awsglue.utils import getResolvedOptions # use this only for glue jobs
@@ -18,19 +24,46 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
-# reads S3 file in csv format using awswrangler
-# takes four inputs : bucket, key, chunk_size, delimiter, encoding, limit_rows
-# uses na_values=['null', 'none']
-def read_s3_file_chunked(bucket, key, chunk_size=100, delimiter=",", encoding="utf-8", limit_rows=1000, cli_profile=None) -> iter:
-    session = boto3.session.Session(profile_name=cli_profile)
-    df = wr.s3.read_csv(path=f"s3://{bucket}/{key}",
-                        chunksize=chunk_size,
-                        delimiter=delimiter,
-                        encoding=encoding,
-                        nrows=limit_rows,
-                        na_values=['null', 'none'],
-                        boto3_session=session)
-    return df
+# SendMessageBatch limits: at most 10 entries and 256KB for the whole request
+SQS_MAX_BATCH_ENTRIES = 10
+SQS_MAX_PAYLOAD_SIZE = 262144
+# max number of times the failed entries of a batch are retried
+SQS_SEND_MAX_RETRIES = 3
+# max_size messages are a json list of rows, "[" + rows joined with "," + "]"
+MSG_ROW_SEPARATOR = ","
+MSG_ROW_SEPARATOR_SIZE = len(MSG_ROW_SEPARATOR)
+MSG_EMPTY_BODY_SIZE = len("[]")
+# share of the max message size an envelope max_size message aims for
+ENVELOPE_TARGET_FILL = 0.9
+# number of rows written to each claim check object
+DEFAULT_CLAIM_CHECK_ROWS = 5000
+# number of threads building and sending messages and the number of chunks read ahead of them
+DEFAULT_SEND_CONCURRENCY = 4
+DEFAULT_SEND_QUEUE_DEPTH = 8
+# input files are read as one stream unless range_concurrency is greater than 1
+DEFAULT_RANGE_CONCURRENCY = 1
+DEFAULT_RANGE_SIZE_MB = 128
+# number of files of a prefix produced at the same time, each by its own process
+DEFAULT_FILE_CONCURRENCY = 1
+# resumable runs checkpoint every checkpoint_rows rows and start no new segment when less than
+# stop_margin_seconds of the lambda timeout is left, which leaves time to drain the senders
+DEFAULT_CHECKPOINT_ROWS = 50000
+DEFAULT_STOP_MARGIN_SECONDS = 60
+
+# reads S3 file in csv format using the pyarrow streaming reader
+# takes inputs : bucket, key, chunk_size, delimiter, encoding, limit_rows, columns
+# only the projected columns are read, as strings. columns None reads all the columns
+# with range_concurrency greater than 1 the file is split in newline aligned byte ranges of range_size_mb
+# read in parallel, the order of rows across ranges is not kept
+def read_s3_file_chunked(bucket, key, chunk_size=100, delimiter=",", encoding="utf-8", limit_rows=1000, cli_profile=None, columns=None, dictionary_columns=None, range_concurrency=DEFAULT_RANGE_CONCURRENCY, range_size_mb=DEFAULT_RANGE_SIZE_MB) -> iter:
+    if range_concurrency > 1:
+        return s3_csv_reader.read_s3_file_parallel(bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile, columns, dictionary_columns,
+                                                   range_concurrency, range_size_mb * 1024 * 1024)
+    return s3_csv_reader.read_s3_file_projected(bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile, columns, dictionary_columns)
+
+# reads one byte range planned by lambda_handler_plan, used when each range is produced by a separate invocation
+def read_s3_range_chunked(byte_range, chunk_size=100, delimiter=",", encoding="utf-8", limit_rows=None, cli_profile=None, columns=None, dictionary_columns=None) -> iter:
+    return s3_csv_reader.read_s3_range_projected(byte_range, chunk_size, delimiter, encoding, limit_rows, cli_profile, columns, dictionary_columns)
 
 def send_message(queue, message_body, message_attributes=None):
     """
@@ -56,100 +89,670 @@ def send_message(queue, message_body, message_attributes=None):
     else:
         return response
 
-# sends the batch message list to SQS
-def send_msg_list_to_sqs(msg_list: list, sqs_queue_url:str):
-    sqs = boto3.resource('sqs')
-    queue = sqs.Queue(sqs_queue_url)
+# groups the message bodies in to lists that fit in a single SendMessageBatch request
+def build_send_batches(msg_list: list, max_entries: int=SQS_MAX_BATCH_ENTRIES, max_payload_size: int=SQS_MAX_PAYLOAD_SIZE) -> list:
+    """
+    Groups message bodies in to batches of at most max_entries messages whose total utf-8 size stays under max_payload_size
+    """
+    batches = []
+    batch = []
+    batch_size = 0
     for msg in msg_list:
-        response = send_message(queue, msg)
-        logger.info("**Response from SQS**")
-        logger.info(response)
+        msg_size = len(msg.encode("utf-8"))
+        if msg_size > max_payload_size:
+            raise ValueError(f"message of {msg_size} bytes exceeds the SQS limit of {max_payload_size} bytes")
+        if batch and (len(batch) == max_entries or batch_size + msg_size > max_payload_size):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(msg)
+        batch_size += msg_size
+    if batch:
+        batches.append(batch)
+    return batches
 
-def read_and_produce_df_chunk(df_iterator: iter, sqs_queue_url:str):
+def send_message_batch(queue, message_bodies: list, max_retries: int=SQS_SEND_MAX_RETRIES) -> list:
+    """
+    Send up to 10 messages to an Amazon SQS queue with a single SendMessageBatch call.
 
-    sqs = boto3.resource('sqs')
-    queue = sqs.Queue(sqs_queue_url)
-    for index, df_chunk in enumerate(df_iterator):
-        logger.info(f"processing chunk {index}")
-        logger.info(f"chunk row count: {len(df_chunk.index)}")
+    :param queue: The queue that receives the messages.
+    :param message_bodies: The body texts of the messages.
+    :param max_retries: Number of times the failed entries are retried with backoff.
+    :return: The entries that could not be sent. Each entry has the Id(index in
+             message_bodies), Code, Message and SenderFault returned by SQS.
+    """
+    pending = {str(i): body for i, body in enumerate(message_bodies)}
+    failed = []
+    retryable = []
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            # exponential backoff before retrying the failed entries
+            time.sleep(0.1 * 2 ** attempt)
+        entries = [{"Id": msg_id, "MessageBody": body} for msg_id, body in pending.items()]
+        try:
+            response = queue.send_messages(Entries=entries)
+        except ClientError as error:
+            # the whole request failed, e.g. throttling. retry all the pending entries
+            logger.warning(f"SendMessageBatch failed on attempt {attempt}: {error}")
+            if attempt == max_retries:
+                logger.exception("Send message batch failed")
+                raise error
+            continue
 
-        if (df_chunk.empty):
-            logger.info("***************")
-            logger.error("Empty dataframe detected. Exiting")
-            logger.info("***************")
-            exit(2)
-        
+        for entry in response.get("Successful", []):
+            pending.pop(entry["Id"], None)
+        retryable = []
+        for entry in response.get("Failed", []):
+            # sender faults (invalid message body etc.) would fail again on retry
+            if entry.get("SenderFault"):
+                failed.append(entry)
+                pending.pop(entry["Id"], None)
+            else:
+                retryable.append(entry)
+        if not pending:
+            break
+        logger.warning(f"{len(pending)} entries failed on attempt {attempt}, retrying")
+
+    # entries still pending ran out of retries
+    if pending:
+        failed.extend(retryable)
+    for entry in failed:
+        logger.error(f"Send message failed for entry {entry['Id']}: {entry.get('Code')} {entry.get('Message')}")
+    return failed
+
+# sends the batch message list to SQS in groups of up to 10 messages
+def send_msg_list_to_sqs(msg_list: list, sqs_queue_url:str, queue=None) -> dict:
+    """
+    Sends the message bodies with SendMessageBatch and returns the count of sent
+    messages and the list of failed entries
+    """
+    if queue is None:
+        sqs = boto3.resource('sqs')
+        queue = sqs.Queue(sqs_queue_url)
+    result = {"sent": 0, "failed": []}
+    for batch in build_send_batches(msg_list):
+        failed = send_message_batch(queue, batch)
+        result["sent"] += len(batch) - len(failed)
+        result["failed"].extend(failed)
+        logger.info(f"**Sent batch of {len(batch) - len(failed)}/{len(batch)} messages to SQS**")
+    return result
+
+# adds the result of a send_msg_list_to_sqs call to the running totals
+def add_send_result(totals: dict, result: dict) -> dict:
+    totals["sent"] += result["sent"]
+    totals["failed"].extend(result["failed"])
+    return totals
+
+# checks the chunk read from the file, the producer exits on an empty chunk
+def check_df_chunk(index: int, df_chunk) -> None:
+    logger.info(f"processing chunk {index}")
+    logger.info(f"chunk row count: {len(df_chunk.index)}")
+
+    if (df_chunk.empty):
+        logger.info("***************")
+        logger.error("Empty dataframe detected. Exiting")
+        logger.info("***************")
+        exit(2)
+
+# builds the message body of the rows, a versioned envelope if envelope is set else the json list of rows
+def build_message_body(df, envelope: dict=None) -> str:
+    if envelope:
+        return utils.encode_message_envelope(df, envelope["layout"], envelope["compression"])
+    return json.dumps(df.to_dict("records"))
+
+class ChunkSizeBatcher:
+    """
+    batch_mode chunk_size: every dataframe chunk becomes one message
+    If claim_check is set, a chunk greater than 256kb is staged in S3 with the producer's boto3_session and sent as a pointer message
+    """
+    # every chunk is a message right away, no row is held back
+    pending_rows = 0
+
+    def __init__(self, claim_check: dict=None, envelope: dict=None, boto3_session=None):
+        self.claim_check = claim_check
+        self.envelope = envelope
+        self.boto3_session = (boto3_session or boto3.session.Session()) if claim_check else None
+
+    def add(self, df_chunk) -> list:
+        msg_batch = build_message_body(df_chunk, self.envelope)
         # calculate the total message size 
-        total_msg_size = len(json.dumps(df_chunk.to_dict("records")))
+        total_msg_size = len(msg_batch.encode("utf-8"))
         logger.info(f"total_msg_size after adding the current chunk: {total_msg_size}")
         
-        if (total_msg_size > 256000):
+        if (total_msg_size > SQS_MAX_PAYLOAD_SIZE):
+            if self.claim_check:
+                logger.info("Size greater than 256kb. Sending the chunk as a claim check")
+                return [utils.write_claim_check_batch(df_chunk, self.claim_check["bucket"], self.claim_check["prefix"], self.boto3_session)]
             logger.info("***************")
             logger.info("Size greater than 256kb. Exiting")
             logger.info("***************")
             exit(2)
-        
-        msg_batch = json.dumps(df_chunk.to_dict("records"))
-        # send the message
-        send_message(queue, msg_batch)
-        logger.info("**Send message**")
-        #logger.info(msg_batch)
-
-def read_and_produce_max_size(df_iterator: iter, sqs_queue_url:str):
-
-    total_msg_size = 0
-    msg_list = []
-    msg_count = 0
-    sqs = boto3.resource('sqs')
-    queue = sqs.Queue(sqs_queue_url)
-    for index, df_chunk in enumerate(df_iterator):
-        logger.info(f"processing chunk {index}")
-        logger.info(f"chunk row count: {len(df_chunk.index)}")
-
-        if (df_chunk.empty):
+        return [msg_batch]
+
+    def flush(self) -> list:
+        return []
+
+class MaxSizeBatcher:
+    """
+    batch_mode max_size: packs rows in to messages as close to max_msg_size bytes as possible
+    """
+    def __init__(self, max_msg_size: int=SQS_MAX_PAYLOAD_SIZE):
+        self.max_msg_size = max_msg_size
+        self.rows = []
+        self.msg_size = MSG_EMPTY_BODY_SIZE
+
+    # rows added but not in a message yet
+    @property
+    def pending_rows(self) -> int:
+        return len(self.rows)
+
+    def add(self, df_chunk) -> list:
+        ready = []
+        for record in df_chunk.to_dict("records"):
+            row = json.dumps(record)
+            row_size = len(row.encode("utf-8"))
+            if MSG_EMPTY_BODY_SIZE + row_size > self.max_msg_size:
+                logger.info("***************")
+                logger.info(f"Row of {row_size} bytes is greater than the max message size. Exiting")
+                logger.info("***************")
+                exit(2)
+            # every row after the first one is preceded by a separator
+            added_size = row_size + MSG_ROW_SEPARATOR_SIZE if self.rows else row_size
+            if self.msg_size + added_size > self.max_msg_size:
+                ready.append(self.build_message())
+                added_size = row_size
+            self.rows.append(row)
+            self.msg_size += added_size
+        return ready
+
+    def build_message(self) -> str:
+        msg_batch = "[" + MSG_ROW_SEPARATOR.join(self.rows) + "]"
+        logger.info(f"total rows in this send {len(self.rows)}")
+        logger.info(f"total message size in this send {self.msg_size}")
+        self.rows = []
+        self.msg_size = MSG_EMPTY_BODY_SIZE
+        return msg_batch
+
+    def flush(self) -> list:
+        # rows has the remaining messages
+        if not self.rows:
+            return []
+        return [self.build_message()]
+
+class EnvelopeMaxSizeBatcher:
+    """
+    batch_mode max_size with a message envelope: rows are accumulated until the encoded envelope is expected to reach max_msg_size
+    """
+    def __init__(self, envelope: dict, max_msg_size: int=SQS_MAX_PAYLOAD_SIZE):
+        self.envelope = envelope
+        self.max_msg_size = max_msg_size
+        # start with the uncompressed json estimate, one encoded byte per in memory byte
+        self.ratio = 1.0
+        self.df_list = []
+        self.mem_size = 0
+
+    @property
+    def pending_rows(self) -> int:
+        return sum(len(df.index) for df in self.df_list)
+
+    def add(self, df_chunk) -> list:
+        ready = []
+        self.df_list.append(df_chunk)
+        self.mem_size += int(df_chunk.memory_usage(deep=True, index=False).sum())
+        if self.mem_size * self.ratio >= self.max_msg_size * ENVELOPE_TARGET_FILL:
+            ready.extend(self.build_messages())
+        return ready
+
+    def encode(self, df) -> list:
+        msg_batch = build_message_body(df, self.envelope)
+        msg_size = len(msg_batch.encode("utf-8"))
+        if msg_size <= self.max_msg_size:
+            logger.info(f"total rows in this send {len(df.index)}")
+            logger.info(f"total message size in this send {msg_size}")
+            return [msg_batch]
+        if len(df.index) == 1:
             logger.info("***************")
-            logger.error("Empty dataframe detected. Exiting")
+            logger.info(f"Row of {msg_size} bytes is greater than the max message size. Exiting")
             logger.info("***************")
             exit(2)
-        
-        # calculate the total message size when we add the current chunk to the message list
-        prev_msg_size = total_msg_size
-        total_msg_size += len(json.dumps(df_chunk.to_dict("records")))
-        logger.info(f"total_msg_size after adding the current chunk: {total_msg_size}")
-        
-        # increment the message count
-        prev_msg_count = msg_count
-        msg_count += 1
-
-        # if the size of the message with the new addition is greater than or equal to 256000 bytes send the message without appending
-        # else append the current row to the message list
-        if total_msg_size >= 256000:
-            logger.info("**total_msg_size > 256000**")
-            # build the message body
-            msg_batch = json.dumps(msg_list)
-            # send the message
-            send_message(queue, msg_batch)
-            logger.info("**Sent message**")
-            #logger.info(msg_batch)
-            logger.info(f"total chunks in this send {prev_msg_count}")
-            logger.info(f"total message size in this send {prev_msg_size}")
-            msg_list = []
-            total_msg_size = 0
-            msg_count = 0
-
-        else:
-            logger.info("adding to msg_list")
-            msg_list.extend(df_chunk.to_dict("records"))
-
-    # when the loop exits msg_list has the remaining messages
-    # build the message body
-    msg_batch = json.dumps(msg_list)
-    # send the message
-    send_message(queue, msg_batch)
-    logger.info("**Final Message Sent**")
-    #logger.info(msg_batch)
-    logger.info(f"total chunks in this send {msg_count}")
-    logger.info(f"total message size in this send {total_msg_size}")
+        half = len(df.index) // 2
+        return self.encode(df.iloc[:half]) + self.encode(df.iloc[half:])
+
+    def build_messages(self) -> list:
+        df = pd.concat(self.df_list, ignore_index=True)
+        messages = self.encode(df)
+        encoded_size = sum(len(msg.encode("utf-8")) for msg in messages)
+        self.ratio = encoded_size / max(self.mem_size, 1)
+        self.df_list = []
+        self.mem_size = 0
+        return messages
+
+    def flush(self) -> list:
+        if not self.df_list:
+            return []
+        return self.build_messages()
+
+class ClaimCheckBatcher:
+    """
+    batch_mode claim_check: chunks are accumulated up to claim_check rows, written as a
+    parquet object under the staging prefix with the producer's boto3_session and only a pointer message is sent to SQS
+    """
+    def __init__(self, claim_check: dict, boto3_session=None):
+        self.bucket = claim_check["bucket"]
+        self.prefix = claim_check["prefix"]
+        self.rows = int(claim_check.get("rows", DEFAULT_CLAIM_CHECK_ROWS))
+        self.boto3_session = boto3_session or boto3.session.Session()
+        self.df_list = []
+        self.row_count = 0
+
+    @property
+    def pending_rows(self) -> int:
+        return self.row_count
+
+    def add(self, df_chunk) -> list:
+        ready = []
+        self.df_list.append(df_chunk)
+        self.row_count += len(df_chunk.index)
+        while self.row_count >= self.rows:
+            df = pd.concat(self.df_list, ignore_index=True)
+            ready.append(utils.write_claim_check_batch(df.iloc[:self.rows], self.bucket, self.prefix, self.boto3_session))
+            self.df_list = [df.iloc[self.rows:]]
+            self.row_count = len(self.df_list[0].index)
+        return ready
+
+    def flush(self) -> list:
+        if self.row_count == 0:
+            return []
+        df = pd.concat(self.df_list, ignore_index=True)
+        self.df_list = []
+        self.row_count = 0
+        return [utils.write_claim_check_batch(df, self.bucket, self.prefix, self.boto3_session)]
+
+class SendProgress:
+    """
+    Rows of an ordered input sent to SQS, rows_done stops at the first chunk with a row not sent
+    """
+    def __init__(self, rows_done: int=0, on_progress=None):
+        self.rows_done = rows_done
+        self.on_progress = on_progress
+        self.chunk_rows = {}
+        self.sent_chunks = set()
+        self.failed_chunks = set()
+        self.next_chunk = 0
+        # first chunk not sent yet
+        self.done_chunk = 0
+        self.messages_sent = 0
+        self.messages_failed = 0
+        self.lock = threading.Lock()
+
+    @property
+    def failed(self) -> bool:
+        return self.messages_failed > 0
+
+    # number of the chunk read, in input order
+    def add_chunk(self, rows: int) -> int:
+        with self.lock:
+            chunk = self.next_chunk
+            self.chunk_rows[chunk] = rows
+            self.next_chunk += 1
+            return chunk
+
+    def on_sent(self, finished: list, touched: list, sent: int, failed: int) -> None:
+        """
+        Records a send group, finished are the chunks whose last rows were in it and touched all the chunks it had rows of
+        """
+        with self.lock:
+            self.messages_sent += sent
+            self.messages_failed += failed
+            if failed:
+                self.failed_chunks.update(touched)
+                return
+            self.sent_chunks.update(chunk for chunk in finished if chunk not in self.failed_chunks)
+            moved = False
+            while self.done_chunk in self.sent_chunks:
+                self.sent_chunks.remove(self.done_chunk)
+                self.rows_done += self.chunk_rows.pop(self.done_chunk)
+                self.done_chunk += 1
+                moved = True
+            if moved and self.on_progress is not None:
+                self.on_progress(self.rows_done, self.messages_sent)
+
+# chunks of a worker whose rows left its batcher, chunks is a deque of [chunk, rows not sent yet]
+def take_sent_chunks(chunks: deque, pending_rows: int) -> tuple:
+    """
+    Returns the chunks finished by the rows sent and all the chunks the rows sent belong to
+    """
+    rows = sum(chunk_rows for _, chunk_rows in chunks) - pending_rows
+    finished, touched = [], []
+    while rows > 0 and chunks:
+        taken = min(chunks[0][1], rows)
+        chunks[0][1] -= taken
+        rows -= taken
+        touched.append(chunks[0][0])
+        if chunks[0][1] == 0:
+            finished.append(chunks.popleft()[0])
+    return finished, touched
+
+# put that blocks while the chunk queue is full, gives up if all the workers have stopped
+def put_with_backpressure(chunk_queue: queue.Queue, item, workers: list) -> None:
+    while True:
+        try:
+            chunk_queue.put(item, timeout=1)
+            return
+        except queue.Full:
+            if all(worker.done() for worker in workers):
+                raise RuntimeError("all producer workers stopped before the input was consumed")
+
+def produce_with_pipeline(df_iterator: iter, sqs_queue_url: str, batcher_factory, concurrency: int=DEFAULT_SEND_CONCURRENCY, queue_depth: int=DEFAULT_SEND_QUEUE_DEPTH, columns: list=None,
+                          progress: SendProgress=None) -> dict:
+    """
+    Bounded producer/consumer pipeline, concurrency worker threads send the chunks of a queue of queue_depth chunks
+    """
+    chunk_queue = queue.Queue(maxsize=queue_depth)
+    totals = {"sent": 0, "failed": []}
+    totals_lock = threading.Lock()
+
+    def worker() -> None:
+        # boto3 resources are not thread safe, every worker builds its own
+        sqs_queue = boto3.session.Session().resource('sqs').Queue(sqs_queue_url)
+        batcher = batcher_factory()
+        send_list = []
+        chunks = deque()
+
+        def send() -> None:
+            result = send_msg_list_to_sqs(send_list, sqs_queue_url, sqs_queue)
+            with totals_lock:
+                add_send_result(totals, result)
+            if progress is not None:
+                finished, touched = take_sent_chunks(chunks, batcher.pending_rows)
+                progress.on_sent(finished, touched, result["sent"], len(result["failed"]))
+
+        while True:
+            item = chunk_queue.get()
+            if item is None:
+                break
+            chunk, df_chunk = item
+            chunks.append([chunk, len(df_chunk.index)])
+            send_list.extend(batcher.add(df_chunk))
+            if len(send_list) >= SQS_MAX_BATCH_ENTRIES:
+                send()
+                send_list = []
+        send_list.extend(batcher.flush())
+        if send_list:
+            send()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        workers = [executor.submit(worker) for _ in range(concurrency)]
+        try:
+            for index, df_chunk in enumerate(df_iterator):
+                check_df_chunk(index, df_chunk)
+                if columns:
+                    df_chunk = df_chunk[[column for column in columns if column in df_chunk.columns]]
+                chunk = progress.add_chunk(len(df_chunk.index)) if progress is not None else index
+                put_with_backpressure(chunk_queue, (chunk, df_chunk), workers)
+        finally:
+            # one end marker per worker, workers flush their remaining messages when they see it
+            for _ in workers:
+                if not all(worker.done() for worker in workers):
+                    put_with_backpressure(chunk_queue, None, workers)
+        for worker_future in workers:
+            # re-raises the error of a failed worker
+            worker_future.result()
+    return totals
+
+def read_and_produce_df_chunk(df_iterator: iter, sqs_queue_url:str, concurrency: int=DEFAULT_SEND_CONCURRENCY, queue_depth: int=DEFAULT_SEND_QUEUE_DEPTH, claim_check: dict=None, envelope: dict=None, columns: list=None,
+                              progress: SendProgress=None, boto3_session=None) -> dict:
+    return produce_with_pipeline(df_iterator, sqs_queue_url, partial(ChunkSizeBatcher, claim_check, envelope, boto3_session), concurrency, queue_depth, columns, progress)
+
+def read_and_produce_max_size(df_iterator: iter, sqs_queue_url:str, concurrency: int=DEFAULT_SEND_CONCURRENCY, queue_depth: int=DEFAULT_SEND_QUEUE_DEPTH, envelope: dict=None, columns: list=None,
+                              progress: SendProgress=None) -> dict:
+    batcher_factory = partial(EnvelopeMaxSizeBatcher, envelope) if envelope else MaxSizeBatcher
+    return produce_with_pipeline(df_iterator, sqs_queue_url, batcher_factory, concurrency, queue_depth, columns, progress)
+
+def read_and_produce_claim_check(df_iterator: iter, sqs_queue_url:str, claim_check: dict, concurrency: int=DEFAULT_SEND_CONCURRENCY, queue_depth: int=DEFAULT_SEND_QUEUE_DEPTH, columns: list=None,
+                                 progress: SendProgress=None, boto3_session=None) -> dict:
+    return produce_with_pipeline(df_iterator, sqs_queue_url, partial(ClaimCheckBatcher, claim_check, boto3_session), concurrency, queue_depth, columns, progress)
+
+# runs the producer for the batch mode, returns None if the batch mode is not valid
+# claim check batches are staged with boto3_session, the session of the producer's cli_profile
+def produce_batch_mode(df_iterator: iter, sqs_queue_url: str, batch_mode: str, concurrency: int, queue_depth: int, claim_check: dict=None, envelope: dict=None, columns: list=None,
+                       progress: SendProgress=None, boto3_session=None) -> dict:
+    if batch_mode == "chunk_size":
+        return read_and_produce_df_chunk(df_iterator, sqs_queue_url, concurrency, queue_depth, claim_check, envelope, columns, progress, boto3_session)
+    elif batch_mode == "max_size":
+        return read_and_produce_max_size(df_iterator, sqs_queue_url, concurrency, queue_depth, envelope, columns, progress)
+    elif batch_mode == "claim_check" and claim_check:
+        return read_and_produce_claim_check(df_iterator, sqs_queue_url, claim_check, concurrency, queue_depth, columns, progress, boto3_session)
+    return None
+
+# builds the message envelope settings, the envelope is used when a message_layout is configured
+def get_envelope_config(config: dict) -> dict:
+    if not config.get("message_layout"):
+        return None
+    return {
+        "layout": config["message_layout"],
+        "compression": config.get("message_compression") or "none"
+    }
+
+# schema map of the producer configuration, None if not configured
+def get_schema_map(config: dict) -> dict:
+    schema_map = config.get("schema_map")
+    # glue job and step function arguments are strings
+    if isinstance(schema_map, str):
+        schema_map = json.loads(schema_map)
+    return schema_map or None
+
+# columns read by the producer, source_id and the schema map columns. None reads all the columns
+def get_message_columns(config: dict) -> list:
+    schema_map = get_schema_map(config)
+    if not schema_map:
+        return None
+    return utils.get_projected_columns(schema_map)
+
+# columns shipped by the producer, source_id and the address text of the schema map columns. None sends all the columns
+def get_send_columns(config: dict) -> list:
+    if not get_schema_map(config):
+        return None
+    return ["source_id", address_template.ADDRESS_TEXT_COLUMN]
+
+# adds the address text column to the chunks, formatted column wise once instead of per row by each validator
+def add_address_texts(df_iterator: iter, config: dict) -> iter:
+    schema_map = get_schema_map(config)
+    for df_chunk in df_iterator:
+        yield address_template.add_address_text(df_chunk, schema_map) if schema_map else df_chunk
+
+# columns read as dictionary encoded strings
+def get_dictionary_columns(config: dict) -> list:
+    schema_map = get_schema_map(config)
+    if not schema_map:
+        return None
+    return s3_csv_reader.get_dictionary_columns(schema_map)
+
+# builds the claim check settings, claim check is enabled when a staging prefix is configured
+def get_claim_check_config(config: dict, default_bucket: str) -> dict:
+    if not config.get("claim_check_prefix"):
+        return None
+    return {
+        "bucket": config.get("claim_check_bucket") or default_bucket,
+        "prefix": config["claim_check_prefix"],
+        "rows": int(config.get("claim_check_rows", DEFAULT_CLAIM_CHECK_ROWS))
+    }
+
+# reads the input of a producer run, the byte range of the config if given, else the whole bucket/key
+def read_input_chunks(config: dict, bucket: str, key: str, chunk_size: int, delimiter: str, encoding: str, limit_rows: int, cli_profile: str, columns: list) -> iter:
+    dictionary_columns = get_dictionary_columns(config)
+    byte_range = config.get("byte_range")
+    if byte_range:
+        if isinstance(byte_range, str):
+            byte_range = json.loads(byte_range)
+        # the row limit can not be split across separate invocations, each range is read whole
+        return read_s3_range_chunked(byte_range, chunk_size, delimiter, encoding, None, cli_profile, columns, dictionary_columns)
+    range_concurrency = int(config.get("range_concurrency", DEFAULT_RANGE_CONCURRENCY))
+    range_size_mb = int(config.get("range_size_mb", DEFAULT_RANGE_SIZE_MB))
+    return read_s3_file_chunked(bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile, columns, dictionary_columns, range_concurrency, range_size_mb)
+
+# reads one s3 object, a prefix or a byte range of the config and sends its messages
+# returns the send totals, None if the batch mode is not valid
+def produce_s3_object(config: dict, bucket: str, key: str, cli_profile: str=None) -> dict:
+    chunk_size = int(config['chunk_size'])
+    delimiter = config['delimiter']
+    encoding = config['encoding']
+    limit_rows = int(config['limit_rows'])
+    sqs_queue = config['sqs_queue']
+    batch_mode = config["batch_mode"]
+    send_concurrency = int(config.get("send_concurrency", DEFAULT_SEND_CONCURRENCY))
+    send_queue_depth = int(config.get("send_queue_depth", DEFAULT_SEND_QUEUE_DEPTH))
+    claim_check = get_claim_check_config(config, bucket)
+    envelope = get_envelope_config(config)
+    columns = get_message_columns(config)
+    df_chunk = add_address_texts(read_input_chunks(config, bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile, columns), config)
+    return produce_batch_mode(df_chunk, sqs_queue, batch_mode, send_concurrency, send_queue_depth, claim_check, envelope, get_send_columns(config),
+                              boto3_session=boto3.session.Session(profile_name=cli_profile))
+
+# process pools need shared memory that the lambda runtime does not have, lambda runs files on threads
+def is_lambda_runtime() -> bool:
+    return "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+
+# produces every csv object under the key prefix, file_concurrency files at a time
+def produce_s3_prefix(config: dict, bucket: str, key: str, cli_profile: str=None) -> dict:
+    """
+    Runs one produce_s3_object per object of the prefix on a process pool and returns the aggregated send totals
+    """
+    file_concurrency = int(config.get("file_concurrency", DEFAULT_FILE_CONCURRENCY))
+    if file_concurrency <= 1 or config.get("byte_range"):
+        return produce_s3_object(config, bucket, key, cli_profile)
+    object_keys = s3_csv_reader.list_s3_csv_objects(bucket, key, boto3.session.Session(profile_name=cli_profile))
+    if len(object_keys) <= 1:
+        return produce_s3_object(config, bucket, key, cli_profile)
+
+    executor_class = ThreadPoolExecutor if is_lambda_runtime() else ProcessPoolExecutor
+    logger.info(f"**Producing {len(object_keys)} files of s3://{bucket}/{key} with {file_concurrency} workers**")
+    totals = {"sent": 0, "failed": []}
+    invalid_batch_mode = False
+    with executor_class(max_workers=min(file_concurrency, len(object_keys))) as executor:
+        futures = {executor.submit(produce_s3_object, config, bucket, object_key, cli_profile): object_key for object_key in object_keys}
+        for files_done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            if result is None:
+                invalid_batch_mode = True
+                continue
+            add_send_result(totals, result)
+            logger.info(f"file {files_done}/{len(object_keys)} s3://{bucket}/{futures[future]}: sent {result['sent']}, failed {len(result['failed'])}")
+    if invalid_batch_mode:
+        return None
+    return totals
+
+# skip the rows already sent by a previous run
+def skip_rows(df_iterator: iter, rows: int) -> iter:
+    for df_chunk in df_iterator:
+        if rows >= len(df_chunk.index):
+            rows -= len(df_chunk.index)
+            continue
+        if rows:
+            df_chunk = df_chunk.iloc[rows:].reset_index(drop=True)
+            rows = 0
+        yield df_chunk
+
+# chunks of the iterator until max_rows rows are taken or should_stop returns True
+def take_rows(df_iterator: iter, max_rows: int, progress: dict, should_stop) -> iter:
+    """
+    Adds the rows taken to progress["rows"] and sets progress["exhausted"] at the end of df_iterator
+    """
+    taken = 0
+    while taken < max_rows and not should_stop():
+        df_chunk = next(df_iterator, None)
+        if df_chunk is None:
+            progress["exhausted"] = True
+            return
+        taken += len(df_chunk.index)
+        progress["rows"] += len(df_chunk.index)
+        yield df_chunk
+
+# produces the input in checkpointed segments so a timed out, retried or continued run resumes where the last one stopped
+def produce_resumable(config: dict, bucket: str, key: str, cli_profile: str, context) -> dict:
+    """
+    Sends the input from its checkpoint, the rows sent are checkpointed as their send groups succeed
+    Returns the send totals of this run with done False if rows are left, None if the batch mode is not valid
+    """
+    session = boto3.session.Session(profile_name=cli_profile)
+    checkpoint_uri = utils.get_checkpoint_uri(config.get("checkpoint_bucket") or bucket, config["checkpoint_prefix"], f"{bucket}/{key}")
+    version = utils.get_s3_input_version(bucket, key, session)
+    checkpoint = utils.read_checkpoint(checkpoint_uri, session)
+    if not checkpoint or checkpoint.get("version") != version:
+        checkpoint = {"bucket": bucket, "key": key, "version": version, "rows_done": 0, "messages_sent": 0, "messages_failed": 0, "done": False}
+    totals = {"sent": 0, "failed": [], "done": checkpoint["done"], "checkpoint": checkpoint}
+    if checkpoint["done"]:
+        logger.info(f"**s3://{bucket}/{key} was already produced with {checkpoint['messages_sent']} messages, skipping**")
+        return totals
+    if checkpoint["rows_done"]:
+        logger.info(f"**resuming s3://{bucket}/{key} after {checkpoint['rows_done']} rows**")
+
+    chunk_size = int(config['chunk_size'])
+    limit_rows = int(config['limit_rows'])
+    sqs_queue = config['sqs_queue']
+    batch_mode = config["batch_mode"]
+    send_concurrency = int(config.get("send_concurrency", DEFAULT_SEND_CONCURRENCY))
+    send_queue_depth = int(config.get("send_queue_depth", DEFAULT_SEND_QUEUE_DEPTH))
+    checkpoint_rows = int(config.get("checkpoint_rows", DEFAULT_CHECKPOINT_ROWS))
+    stop_margin_ms = int(config.get("stop_margin_seconds", DEFAULT_STOP_MARGIN_SECONDS)) * 1000
+    claim_check = get_claim_check_config(config, bucket)
+    envelope = get_envelope_config(config)
+    columns = get_message_columns(config)
+    df_chunk = read_s3_file_chunked(bucket, key, chunk_size, config['delimiter'], config['encoding'], limit_rows, cli_profile, columns, get_dictionary_columns(config))
+    df_chunk = add_address_texts(skip_rows(df_chunk, checkpoint["rows_done"]), config)
+
+    messages_sent = checkpoint["messages_sent"]
+
+    def save_checkpoint(rows_done: int, run_messages_sent: int) -> None:
+        checkpoint["rows_done"] = rows_done
+        checkpoint["messages_sent"] = messages_sent + run_messages_sent
+        utils.write_checkpoint(checkpoint_uri, checkpoint, session)
+        logger.info(f"checkpoint s3://{bucket}/{key}: {checkpoint['rows_done']} rows, {checkpoint['messages_sent']} messages sent")
+
+    send_progress = SendProgress(checkpoint["rows_done"], save_checkpoint)
+
+    def should_stop() -> bool:
+        return send_progress.failed or context.get_remaining_time_in_millis() < stop_margin_ms
+
+    progress = {"rows": 0, "exhausted": False}
+    while not progress["exhausted"] and not should_stop():
+        progress["rows"] = 0
+        segment = take_rows(df_chunk, checkpoint_rows, progress, should_stop)
+        segment_totals = produce_batch_mode(segment, sqs_queue, batch_mode, send_concurrency, send_queue_depth, claim_check, envelope, get_send_columns(config), send_progress,
+                                            session)
+        if segment_totals is None:
+            return None
+        add_send_result(totals, segment_totals)
+    checkpoint["rows_done"] = send_progress.rows_done
+    checkpoint["messages_sent"] = messages_sent + send_progress.messages_sent
+    checkpoint["messages_failed"] += send_progress.messages_failed
+    checkpoint["done"] = progress["exhausted"] and not send_progress.failed
+    utils.write_checkpoint(checkpoint_uri, checkpoint, session)
+    totals["done"] = checkpoint["done"]
+    return totals
+
+# resumable runs need the lambda context for the remaining time and a checkpoint prefix
+def produce_input(config: dict, bucket: str, key: str, cli_profile: str, context) -> dict:
+    if context is not None and config.get("checkpoint_prefix") and not config.get("byte_range"):
+        return produce_resumable(config, bucket, key, cli_profile, context)
+    return produce_s3_prefix(config, bucket, key, cli_profile)
+
+# hands the rest of the input over to a new asynchronous invocation of this function
+def invoke_continuation(event: dict, context, cli_profile: str=None) -> None:
+    session = boto3.session.Session(profile_name=cli_profile)
+    session.client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(event).encode("utf-8")
+    )
+    logger.info(f"**Not done before the timeout, continuing in a new invocation of {context.invoked_function_arn}**")
+
+# logs the outcome of a producer run and exits if any message could not be sent
+def report_send_result(totals: dict):
+    logger.info(f"**Messages sent to SQS: {totals['sent']}, failed: {len(totals['failed'])}**")
+    if totals["failed"]:
+        logger.error("**Error some messages could not be sent to SQS**")
+        exit(4)
 
 # if the input is an s3 object create event then extract the file information from the event and process
 def lambda_handler(event, context):
@@ -165,22 +768,17 @@ def lambda_handler(event, context):
         cli_profile = None
         
     config_json = utils.get_app_configuration(ssm_parameter,cli_profile=cli_profile)
-    chunk_size = config_json['chunk_size']
-    delimiter = config_json['delimiter']
-    encoding = config_json['encoding']
-    limit_rows = config_json['limit_rows']
     cli_profile = config_json['cli_profile']
-    sqs_queue = config_json['sqs_queue']
-    batch_mode = config_json["batch_mode"]
-    df_chunk = read_s3_file_chunked(bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile)
     
-    if batch_mode == "chunk_size":
-        read_and_produce_df_chunk(df_chunk, sqs_queue)
-    elif batch_mode == "max_size":
-        read_and_produce_max_size(df_chunk, sqs_queue)
-    else:
-        logger.error("**Error invalid batch_mode. Valid values chunk_size|max_size**")
+    totals = produce_input(config_json, bucket, key, cli_profile, context)
+    if totals is None:
+        logger.error("**Error invalid batch_mode. Valid values chunk_size|max_size|claim_check(needs claim_check_prefix)**")
         exit(3)
+    # with failed messages the run exits and the lambda retry resumes from the checkpoint, so only a run without
+    # failures hands over to a new invocation. both would start from the same checkpoint
+    report_send_result(totals)
+    if not totals.get("done", True):
+        invoke_continuation(event, context, cli_profile)
 
 # lambda handler that reads amazon step function input and calls the read_and_produce_df_chunk function
 # rename this to lambda_handler to use it as a step function triggered lambda and give payload input json 
@@ -193,20 +791,27 @@ def lambda_handler_sfn(event, context):
         cli_profile = None
     bucket = event['bucket']
     key = event['key']
-    chunk_size = int(event['chunk_size'])
-    delimiter = event['delimiter']
-    encoding = event['encoding']
-    limit_rows = int(event['limit_rows'])
-    sqs_queue = event['sqs_queue']
-    batch_mode = event["batch_mode"]
-    df_chunk = read_s3_file_chunked(bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile)
     
-    if batch_mode == "chunk_size":
-        read_and_produce_df_chunk(df_chunk, sqs_queue)
-    elif batch_mode == "max_size":
-        read_and_produce_max_size(df_chunk, sqs_queue)
-    else:
-        logger.info("**Error invalid batch_mode. Valid values chunk_size|max_size**")
+    totals = produce_input(event, bucket, key, cli_profile, context)
+    if totals is None:
+        logger.info("**Error invalid batch_mode. Valid values chunk_size|max_size|claim_check(needs claim_check_prefix)**")
+        return
+    report_send_result(totals)
+    # with done False a step function choice state invokes the handler again with the continuation
+    # as input, the new run resumes from the checkpoint
+    return {"done": totals.get("done", True), "sent": totals["sent"], "continuation": event}
+
+# lambda handler that plans the input file as byte ranges, takes the same input as lambda_handler_sfn
+# returns one lambda_handler_sfn input per byte range, to fan out with a step function map state
+def lambda_handler_plan(event, context):
+    try:
+        cli_profile = os.environ['CLI_PROFILE']
+    except(KeyError):
+        cli_profile = None
+    session = boto3.session.Session(profile_name=cli_profile)
+    range_size_mb = int(event.get("range_size_mb", DEFAULT_RANGE_SIZE_MB))
+    ranges = s3_csv_reader.plan_s3_csv_ranges(event['bucket'], event['key'], range_size_mb * 1024 * 1024, event['delimiter'], event['encoding'], session)
+    return {"ranges": [dict(event, byte_range=byte_range) for byte_range in ranges]}
     
 # use this for local testing through cli or shell execution
 if __name__ == "__main__":
@@ -219,7 +824,17 @@ if __name__ == "__main__":
                                 'encoding',
                                 'limit_rows',
                                 'sqs_queue',
-                                'batch_mode'])
+                                'batch_mode',
+                                'send_concurrency',
+                                'send_queue_depth',
+                                'range_concurrency',
+                                'range_size_mb',
+                                'file_concurrency',
+                                'claim_check_prefix',
+                                'claim_check_rows',
+                                'message_layout',
+                                'message_compression',
+                                'schema_map'])
     print(args)
     lambda_handler_sfn(args, None)
     # lambda_handler(get_sample_sfn_input_config(), None)
@@ -2,18 +2,22 @@
 AWS glue python shell code that reads S3 data files and generates SQS messages in batches of 10 max
 Uses awswrangler python module to read S3 data files
 """
-import boto3
-import json
-import awswrangler as wr
 import logging
 from botocore.exceptions import ClientError
 import utils
+import s3_csv_reader
+import output_writer
+import result_cache
+import runtime_cache
+import address_dedup
+import address_template
+import providers
+import hedging
+import change_detection
 import os
 import sys
 from awsglue.utils import getResolvedOptions
-from smartystreets_python_sdk import StaticCredentials, exceptions, Batch, ClientBuilder
 from smartystreets_python_sdk.us_street import Lookup as StreetLookup
-import pandas as pd
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -23,24 +27,17 @@ formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-# reads S3 file in csv format using awswrangler
-# takes four inputs : bucket, key, chunk_size, delimiter, encoding, limit_rows
-# uses na_values=['null', 'none']
-def read_s3_file_chunked(bucket, key, chunk_size=100, delimiter=",", encoding="utf-8", limit_rows=1000, cli_profile=None) -> iter:
-    session = boto3.session.Session(profile_name=cli_profile)
-    df = wr.s3.read_csv(path=f"s3://{bucket}/{key}",
-                        chunksize=chunk_size,
-                        delimiter=delimiter,
-                        encoding=encoding,
-                        nrows=limit_rows,
-                        na_values=['null', 'none'],
-                        boto3_session=session)
-    return df
+# reads S3 file in csv format using the pyarrow streaming reader
+# takes inputs : bucket, key, chunk_size, delimiter, encoding, limit_rows, columns
+# only the projected columns are read, as strings. columns None reads all the columns
+def read_s3_file_chunked(bucket, key, chunk_size=100, delimiter=",", encoding="utf-8", limit_rows=1000, cli_profile=None, columns=None, dictionary_columns=None) -> iter:
+    return s3_csv_reader.read_s3_file_projected(bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile, columns, dictionary_columns)
 
-def read_and_validate_in_chunks(df_iterator: iter, config: dict, client) -> None:
+def read_and_validate_in_chunks(df_iterator: iter, config: dict, provider: providers.ValidationProvider, writer: output_writer.RollingParquetWriter, cache=None,
+                                dedup: address_dedup.AddressDeduplicator=None, detector: change_detection.ChangeDetector=None) -> None:
     """
     This function reads the data frame iterator and iterates over them
-    Each chuck is converted to a dict and sent to the smarty module
+    Each chuck is converted to a dict and validated by the provider, in batches of its max batch size
     """
     for index, df_chunk in enumerate(df_iterator):
         logger.info(f"processing chunk {index}")
@@ -52,12 +49,26 @@ def read_and_validate_in_chunks(df_iterator: iter, config: dict, client) -> None
             logger.info("***************")
             exit(2)
         
+        # the address texts of the chunk are formatted column wise
+        df_chunk = address_template.add_address_text(df_chunk, config["schema_map"])
+        if detector is not None:
+            df_chunk, carried = detector.split(df_chunk)
+            writer.write(carried)
+            logger.info(f"{carried.num_rows} unchanged rows carried forward, {len(df_chunk.index)} rows to validate")
+            if df_chunk.empty:
+                continue
+        logger.info(f"chunk {index} size in memory: {df_chunk.memory_usage(deep=True).sum()} bytes")
         msg_batch = df_chunk.to_dict("records")
-        # calculate the total message size 
-        total_msg_size = len(json.dumps(msg_batch))
-        logger.info(f"total_msg_size after adding the current chunk: {total_msg_size}")
         # send the message
-        run_smarty_street_addr_lookup_batch(client, config, msg_batch, index)
+        # with a deduplicator each address is sent once per chunk(the chunk index), or once per job with dedup_scope invocation
+        # the rows validated are recorded in the manifest of the run as they are written
+        chunk_writer = writer if detector is None else change_detection.RecordingWriter(writer, detector)
+        try:
+            providers.validate_message_batch(provider, config, msg_batch, index, chunk_writer, cache, dedup)
+        except providers.ProviderError as err:
+            # a chunk the provider failed is logged and the job goes on with the next one
+            logger.error(f"Validation failed for chunk {index}: {err}")
+            continue
         logger.info(f"Validation complete for chunk {index}")
         #logger.info(msg_batch)
 
@@ -82,89 +93,6 @@ def print_debug_info(lookup: StreetLookup):
         logger.info("DMA:             {}".format(candidate.components.dma_code))
         logger.info("Latitude:        {}".format(candidate.metadata.latitude))
 
-# take smarty lookup object as input and write the input and output to s3 in parquet format
-# this assumes US address format
-def write_smarty_lookup_to_s3(batch: Batch, bucket: str, key: str):
-    # write the input and output to s3 in json format
-    logger.info("building pandas dataframe from the smarty lookup object")
-    df = pd.DataFrame()
-    invalid_addresses = 0
-    for i, lookup in enumerate(batch):
-        # logger.debug(vars(lookup))
-        input = {
-            "i_batch_index": i,
-            "i_input_id": lookup.input_id,
-            "i_full_addr_txt": lookup.street
-        }
-        candidates = lookup.result
-        
-        if len(candidates) == 0:
-            logger.warning("Address {} is invalid.\n".format(i))
-            # just append the valid flag
-            input["o_valid"] = 0
-            df_dictionary = pd.DataFrame([input])
-            df = pd.concat([df,df_dictionary], ignore_index=True)
-            invalid_addresses += 1
-            continue
-        # logger.debug(vars(candidates[0]))
-        output = {
-            "o_street_address1": f"{candidates[0].components.primary_number} {candidates[0].components.street_name} {candidates[0].components.street_suffix}",
-            "o_street_address2": f"{candidates[0].components.secondary_number} {candidates[0].components.secondary_designator} {candidates[0].components.extra_secondary_designator} {candidates[0].components.extra_secondary_number}",
-            "o_city": candidates[0].components.city_name,
-            "o_state_code": candidates[0].components.state_abbreviation,
-            "o_full_postal_code": f"{candidates[0].components.zipcode} {candidates[0].components.plus4_code}",
-            "o_country": "USA",
-            "o_external_addr_id": candidates[0].delivery_point_barcode,
-            "o_valid": 1
-        }
-
-        inp_out = {**input, **output}
-        # logger.info(inp_out)
-        df_dictionary = pd.DataFrame([inp_out])
-        df = pd.concat([df,df_dictionary], ignore_index=True)
-
-    # logger.info(df.head())
-    s3_uri = f"s3://{bucket}/{key}".replace(".","-")
-    logger.info(f"Writing input and output to {s3_uri}")
-    wr.s3.to_parquet(df, s3_uri)
-    return invalid_addresses
-
-# function to run smarty street address lookup
-def run_smarty_street_addr_lookup_batch(client: ClientBuilder, config: dict, message_batch: list, list_index: int):
-    
-    # build the client and batch object
-
-    batch = Batch()
-
-    # Documentation for input fields can be found at:
-    # https://smartystreets.com/docs/street-api#input-fields
-
-    
-    # add input street addresses
-    # concat the components to create the fuill text as the validation services can split in to components
-    # batch.add(StreetLookup("123 Main St", "San Francisco", "CA", "94105"))
-    # [logger.info(message['address1'], message['city'], message['state_code'], message['zip_code']) for message in message_batch]
-    # [batch.add(StreetLookup(street=message['address1'], city=message['city'], state=message['state_code'], zipcode=str(message['zip_code']),input_id=str(message['source_id']))) for message in message_batch]
-
-    [batch.add(StreetLookup(street=utils.get_address_data_string(message, config["schema_map"]),input_id=str(message['source_id']))) for message in message_batch]
-
-    # run the batch
-    batch_size = len(batch)
-    logger.info(batch_size)
-    assert batch_size <= 100
-
-    try:
-        client.send_batch(batch)
-    except exceptions.SmartyException as err:
-        logger.error(err)
-        return
-    
-    # print_debug_info(lookup)
-    output_key = f"{config['s3_key']}/result-{list_index}.parquet"
-    invalid_addresses = write_smarty_lookup_to_s3(batch, config['s3_bucket'], output_key)
-
-    logger.info(f"Total/Invalid addresses in this batch:{batch_size}/{invalid_addresses}")
-
 # main function that reads amazon step function input and calls the read_and_produce_df_chunk function
 def main(config):
     # use named profile for local testing, in lamda env this will be(and has to be) None
@@ -180,15 +108,37 @@ def main(config):
     limit_rows = int(config['limit_rows'])
     ssm_parameter = config['ssm_parameter']
 
-    smarty_config = utils.add_secrets_to_config(utils.get_app_configuration(ssm_parameter,cli_profile=cli_profile),cli_profile=cli_profile)
+    smarty_config = runtime_cache.add_secrets_to_config(runtime_cache.get_app_configuration(ssm_parameter,cli_profile=cli_profile),cli_profile=cli_profile)
 
-    # build smarty client
-    credentials = StaticCredentials(smarty_config['secrets']['auth_id'], smarty_config['secrets']['auth_token'])
-    client = ClientBuilder(credentials).with_licenses([smarty_config['license_key']]).build_us_street_api_client()
+    # smarty provider, its clients are built by the threads that send the batches
+    # with hedge settings the slow batches are sent to the hedge provider as well
+    provider = hedging.build_provider(smarty_config, cli_profile)
     
-    df_iterator = read_s3_file_chunked(bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile)
-
-    read_and_validate_in_chunks(df_iterator, smarty_config, client)
+    # validation only needs source_id and the schema map columns
+    columns = utils.get_projected_columns(smarty_config["schema_map"])
+    dictionary_columns = s3_csv_reader.get_dictionary_columns(smarty_config["schema_map"])
+    df_iterator = read_s3_file_chunked(bucket, key, chunk_size, delimiter, encoding, limit_rows, cli_profile, columns, dictionary_columns)
+
+    boto3_session = runtime_cache.get_boto3_session(cli_profile)
+    # only the addresses not in the result cache are sent to smarty
+    cache = result_cache.build_result_cache(smarty_config, boto3_session)
+    # each address is sent once per chunk, or once per job with dedup_scope invocation
+    dedup = address_dedup.build_deduplicator(smarty_config)
+    # with a manifest_prefix only the rows inserted or changed since the last successful run are sent to smarty
+    detector, manifest_uri = change_detection.build_change_detector(smarty_config, bucket, key, provider.name, boto3_session)
+    # the buffered rows are uploaded when the job ends, or fails part way
+    with output_writer.build_output_writer(smarty_config, boto3_session) as writer:
+        read_and_validate_in_chunks(df_iterator, smarty_config, provider, writer, cache, dedup, detector)
+    output_writer.register_output_partitions(writer, smarty_config)
+    # the manifest is replaced once all the output files of the run are uploaded
+    if detector is not None and writer.upload_error is None:
+        change_detection.write_manifest(manifest_uri, detector.to_table(), provider.name, boto3_session)
+        logger.info(f"change detection of the run: {detector.get_metrics()}")
+    if cache is not None:
+        logger.info(f"result cache of the run: {cache.get_metrics()}")
+    logger.info(f"address deduplication of the run: {dedup.get_metrics()}")
+    if isinstance(provider, hedging.HedgedProvider):
+        logger.info(f"hedging of the run: {provider.get_metrics()}")
 
 # use this for local testing through cli or shell execution
 if __name__ == "__main__":
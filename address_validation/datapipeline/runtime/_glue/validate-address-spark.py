@@ -0,0 +1,80 @@
+"""
+AWS glue spark job that validates the normalized address file on the executors
+Writes the hive partitioned validation dataset and adds its partitions to the catalog
+"""
+import sys
+import logging
+from datetime import datetime, timezone
+from awsglue.utils import getResolvedOptions
+from awsglue.context import GlueContext
+from awsglue.job import Job
+from pyspark import TaskContext
+from pyspark.context import SparkContext
+from pyspark.sql import functions as F
+import utils
+import output_writer
+import runtime_cache
+import spark_validation
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+args = getResolvedOptions(sys.argv, ["JOB_NAME", "bucket", "key", "delimiter", "encoding", "partitions", "ssm_parameter"])
+sc = SparkContext()
+glueContext = GlueContext(sc)
+spark = glueContext.spark_session
+job = Job(glueContext)
+job.init(args["JOB_NAME"], args)
+
+# the configuration and its secrets are read once by the driver and shipped to the tasks
+config = runtime_cache.add_secrets_to_config(runtime_cache.get_app_configuration(args["ssm_parameter"]))
+# 0 runs two tasks per executor core
+partitions = int(args["partitions"]) or 2 * sc.defaultParallelism
+concurrent_tasks = spark_validation.get_concurrent_tasks(partitions, sc.defaultParallelism)
+task_config = spark_validation.get_task_config(config, concurrent_tasks)
+logger.info(f"validating in {partitions} partitions, {concurrent_tasks} at a time at {task_config.get('rate_limit_per_second')} lookups per second each")
+
+# validation only needs source_id and the schema map columns, read as strings
+records = spark.read.csv(f"s3://{args['bucket']}/{args['key']}", header=True, sep=args["delimiter"], encoding=args["encoding"])
+records = records.select(*utils.get_projected_columns(config["schema_map"])).repartition(partitions)
+
+# rows of the batches skipped after a provider error
+skipped_rows = sc.accumulator(0)
+
+def validate_partition(frames):
+    context = TaskContext.get()
+    task_id = f"{context.stageId()}-{context.partitionId()}-{context.attemptNumber()}"
+    return spark_validation.validate_frames(frames, task_config, task_id, skipped_rows=skipped_rows)
+
+# the validated rows are kept so writing them and listing their partitions does not call the provider again
+validated = records.mapInPandas(validate_partition, schema=spark_validation.get_spark_schema()).persist()
+# validate every partition before writing, a job with skipped rows fails without output and is not committed
+# retried tasks add their skipped rows again, so the count can be higher than the rows skipped
+validated_rows = validated.count()
+utils.log_emf_metrics({"ValidatedRows": validated_rows, "SkippedRows": skipped_rows.value}, {"Service": config.get("provider", "smarty")})
+if skipped_rows.value:
+    validated.unpersist()
+    raise RuntimeError(f"Validation failed for {skipped_rows.value} rows, see the task logs")
+
+partition_cols = config.get("output_partition_cols", [])
+output_rows = validated
+if output_writer.RUN_DATE_PARTITION in partition_cols:
+    output_rows = validated.withColumn(output_writer.RUN_DATE_PARTITION, F.lit(datetime.now(timezone.utc).strftime("%Y-%m-%d")))
+
+# one file per output partition, its rows sorted by output_sort_by so the parquet statistics can prune
+output = output_rows.repartition(*partition_cols) if partition_cols else output_rows
+sort_by = [col for col in [*partition_cols, config.get("output_sort_by")] if col]
+if sort_by:
+    output = output.sortWithinPartitions(*sort_by)
+output.write.mode("append").partitionBy(*partition_cols).parquet(f"s3://{config['s3_bucket']}/{config['s3_key'].replace('.', '-')}/")
+
+if partition_cols:
+    partition_rows = [row.asDict() for row in output_rows.select(*partition_cols).distinct().collect()]
+    spark_validation.register_dataset_partitions(config, partition_rows, runtime_cache.get_boto3_session())
+validated.unpersist()
+job.commit()
@@ -1,10 +1,6 @@
-import json
-import boto3
-from util import utils
+from util import utils, output_writer, result_cache, runtime_cache, address_dedup, providers
 import os
 import logging
-import awswrangler as wr
-import pandas as pd
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -14,6 +10,16 @@ formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# provider part of the result cache keys
+AWSLOC_CACHE_PROVIDER = providers.AWSLocationProvider.name
+# searches of a message sent at the same time, the connection pool of the client has as many connections
+DEFAULT_LOOKUP_CONCURRENCY = providers.DEFAULT_LOOKUP_CONCURRENCY
+
+# the searches are shared with the glue jobs through the provider interface
+get_awsloc_output = providers.get_awsloc_output
+search_place_index = providers.search_place_index
+get_location_client = providers.get_location_client
+
 # display api putput debug info
 def print_debug_info(lookup):
     candidates = lookup.result
@@ -35,108 +41,17 @@ def print_debug_info(lookup):
         logger.info("DMA:             {}".format(candidate.components.dma_code))
         logger.info("Latitude:        {}".format(candidate.metadata.latitude))
 
-# take the validation response dict list as input and write to s3 in parquet format
-def write_val_output_to_s3(batch: list, bucket: str, key: str, message_id: str):
-    # write the input and output to s3 in json format
-    logger.info("building pandas dataframe from the aws location services response")
-    df = pd.DataFrame()
-    invalid_addresses = 0
-
-    for i, lookup in enumerate(batch):
-        # logger.info(lookup)
-        # we are taking only the selected fields from the input message
-        # modify this as required
-
-        input = {
-            "i_input_msg_id": message_id,
-            "i_batch_index": i,
-            "i_input_id": lookup["source_id"],
-            "i_full_addr_txt": lookup["full_addr_txt"]
-        }
-        
-        candidates = lookup["Results"]
-
-        # with aws loc services if address is accurately identified relevance will be 1
-        # Here we are replicating what a STRICT validation looks like with smarty api
-        if candidates[0]['Relevance'] < 1:
-            logger.warning("Address {} is invalid.\n".format(i))
-            output = { "o_valid": 0 }
-            invalid_addresses += 1
-        # logger.debug(vars(candidates[0]))
-        # the output schema changes with the validation api
-        # below assumes an US address schema and the current venice attribute schema
-        else:
-            try:
-                o_street_address2 = f'{candidates[0]["Place"]["UnitType"]} {candidates[0]["Place"]["UnitNumber"]}'
-            except KeyError:
-                o_street_address2 = None
-
-            try:
-                o_external_addr_id = candidates[0]["PlaceId"]
-            except KeyError:
-                o_external_addr_id = None
-
-            output = {
-                "o_street_address1": f'{candidates[0]["Place"]["AddressNumber"]} {candidates[0]["Place"]["Street"]}',
-                "o_street_address2": o_street_address2,
-                "o_city": candidates[0]["Place"]["Municipality"],
-                "o_state": candidates[0]["Place"]["Region"],
-                "o_full_postal_code": candidates[0]["Place"]["PostalCode"],
-                "o_country": candidates[0]["Place"]["Country"],
-                "o_external_addr_id": o_external_addr_id,
-                "o_valid": 1
-            }
-
-        inp_out = {**input, **output}
-        # logger.info(inp_out)
-        df_dictionary = pd.DataFrame([inp_out])
-        df = pd.concat([df,df_dictionary], ignore_index=True)
-
-    # logger.info(df.head())
-    s3_uri = f"s3://{bucket}/{key}".replace(".","-")
-    logger.info(f"Writing input and output to {s3_uri}")
-    wr.s3.to_parquet(df, s3_uri)
-    return invalid_addresses
-
+# rate limiter of the location calls of this container, None if no rate_limit_per_second is configured
+def get_rate_limiter(config: dict):
+    return providers.get_rate_limiter(AWSLOC_CACHE_PROVIDER, config)
 
 # function to run aws location services address lookup
-def run_awslocation_addr_lookup(config: dict, message_batch: list, msg_id: str, cli_profile: str=None):
-    
-    # build the client
-    session = boto3.session.Session(profile_name=cli_profile)
-    awsloc_client = session.client('location')
-    place_index = config['place_index']
-    # logger.info(awsloc_client.list_place_indexes())
-    batch=[]
-    # add input street addresses
-    # concat the components to create the fuill text as the validation services can split in to components
-    # batch.add(StreetLookup("123 Main St", "San Francisco", "CA", "94105"))
-    # [logger.info(message['address1'], message['city'], message['state_code'], message['zip_code']) for message in message_batch]
-    for message in message_batch:
-        # logger.info(message)
-        # addr_txt = f"{message['address1']} {message['city']} {message['state_code']} {message['zip_code']}"
-        message["full_addr_txt"] = utils.get_address_data_string(message, config["schema_map"])
-        # logger.info(addr_txt)
-        try:
-            response = awsloc_client.search_place_index_for_text(
-                IndexName=place_index,
-                MaxResults=1,
-                Text=message["full_addr_txt"]
-            )
-        except Exception as e:
-            logger.error(e)
-            return
-        inp_out = {**message, **response}
-        batch.append(inp_out)
-        # logger.info(json.dumps(inp_out, indent=4, sort_keys=True))
-    # print_debug_info(lookup)
-    output_key = f"{config['s3_key']}-{msg_id}-result"
-    batch_size = len(batch)
-    logger.info(f"Total addresses in this batch:{batch_size}")
-
-    invalid_addresses = write_val_output_to_s3(batch, config['s3_bucket'], output_key, msg_id)
-
-    logger.info(f"Total/Invalid addresses in this batch:{batch_size}/{invalid_addresses}")
+# the searches of the addresses not in the cache run lookup_concurrency at a time on the client of the container
+def run_awslocation_addr_lookup(config: dict, message_batch: list, msg_id: str, writer: output_writer.RollingParquetWriter, cli_profile: str=None, cache=None,
+                                dedup: address_dedup.AddressDeduplicator=None):
+    provider = providers.AWSLocationProvider(config, cli_profile, get_location_client)
+    # a failed search fails the message, the addresses found are cached so its retry only searches the failed ones
+    providers.validate_message_batch(provider, config, message_batch, msg_id, writer, cache, dedup)
 
 
 # lambda handler that reads amazon step function input and calls the read_and_produce_df_chunk function
@@ -152,17 +67,50 @@ def lambda_handler(event, context):
     except(KeyError):
         cli_profile = None
 
-    config = utils.get_app_configuration(ssm_parameter,cli_profile=cli_profile)
+    # configuration is cached by the container and refreshed in the background before it expires
+    config = runtime_cache.get_app_configuration(ssm_parameter,cli_profile=cli_profile)
 
     # logger.info(config_json)
 
     # iterate over event['records'] extract data
     
-    msg_id = event['Records'][0]['messageId']
+    # the results of all the messages are coalesced in to parquet files of output_file_size_mb
+    boto3_session = runtime_cache.get_boto3_session(cli_profile)
+    writer = output_writer.build_output_writer(config, boto3_session)
+    cache = result_cache.build_result_cache(config, boto3_session)
+    # each address is searched once per message, or once per invocation with dedup_scope invocation
+    dedup = address_dedup.build_deduplicator(config)
+    # each message succeeds or fails on its own, only the failed ones are retried by SQS
+    failed_msg_ids = set()
     for record in event['Records']:
+        msg_id = record['messageId']
         # logger.info(record['body'])
-        message_batch = json.loads(record['body'])
-        run_awslocation_addr_lookup(config, message_batch, msg_id, cli_profile)
+        try:
+            # the body is either the rows or a claim check pointer to the rows staged in S3
+            message_batch = utils.read_message_batch(record['body'])
+            run_awslocation_addr_lookup(config, message_batch, msg_id, writer, cli_profile, cache, dedup)
+        except Exception as err:
+            logger.error(f"Error validating message {msg_id}: {err}")
+            failed_msg_ids.add(msg_id)
+
+    try:
+        writer.close()
+    except Exception as err:
+        logger.error(f"Error writing the output files: {err}")
+    if writer.upload_error is not None:
+        # rows of succeeded messages may have been lost with a file, so every message is retried
+        # and the files already uploaded are deleted so the retry does not write their rows twice
+        output_writer.delete_output_files(writer)
+        failed_msg_ids = {record['messageId'] for record in event['Records']}
+    output_writer.register_output_partitions(writer, config)
+
+    limiter = get_rate_limiter(config)
+    if limiter is not None:
+        utils.log_emf_metrics(limiter.get_metrics(), {"Service": "awslocation"}, {"RateLimitWaitSeconds": "Seconds"})
+    if cache is not None:
+        utils.log_emf_metrics(cache.get_metrics(), {"Service": "awslocation"}, {"CacheHitRate": "Percent"})
+    utils.log_emf_metrics(dedup.get_metrics(), {"Service": "awslocation"}, {"DedupSavedRatio": "Percent"})
+    return utils.build_batch_item_failures(event['Records'], failed_msg_ids)
 
     # for custom api calls if validation service does not have an python SDK
     # config_json = utils.get_sample_configuration()
@@ -1,11 +1,10 @@
 import json
-from smartystreets_python_sdk import StaticCredentials, exceptions, Batch, ClientBuilder
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from smartystreets_python_sdk.us_street import Lookup as StreetLookup
-from util import utils
+from util import utils, async_http, output_writer, result_cache, runtime_cache, address_dedup, providers, hedging
 import os
 import logging
-import awswrangler as wr
-import pandas as pd
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -15,6 +14,17 @@ formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# number of batches sent to smarty and written to S3 at the same time
+DEFAULT_BATCH_CONCURRENCY = 4
+# smarty street api limit of lookups per batch
+SMARTY_MAX_BATCH_SIZE = providers.SMARTY_MAX_BATCH_SIZE
+# provider part of the result cache keys
+SMARTY_CACHE_PROVIDER = providers.SmartyProvider.name
+
+# the smarty calls are shared with the glue jobs through the provider interface
+get_smarty_output = providers.get_smarty_output
+send_smarty_batch = providers.send_smarty_batch
+
 # display api putput debug info
 def print_debug_info(lookup: StreetLookup):
     candidates = lookup.result
@@ -36,90 +46,47 @@ def print_debug_info(lookup: StreetLookup):
         logger.info("DMA:             {}".format(candidate.components.dma_code))
         logger.info("Latitude:        {}".format(candidate.metadata.latitude))
 
-# take smarty lookup object as input and write the input and output to s3 in parquet format
-# this assumes US address format
-def write_smarty_lookup_to_s3(batch: Batch, bucket: str, key: str, message_id: str):
-    # write the input and output to s3 in json format
-    logger.info("building pandas dataframe from the smarty lookup object")
-    df = pd.DataFrame()
-    invalid_addresses = 0
-    for i, lookup in enumerate(batch):
-        # logger.debug(vars(lookup))
-        input = {
-            "i_input_msg_id": message_id,
-            "i_batch_index": i,
-            "i_input_id": lookup.input_id,
-            "i_full_addr_txt": lookup.street
-        }
-        candidates = lookup.result
-        
-        if len(candidates) == 0:
-            logger.warning("Address {} is invalid.\n".format(i))
-            # just append the valid flag
-            input["o_valid"] = 0
-            df_dictionary = pd.DataFrame([input])
-            df = pd.concat([df,df_dictionary], ignore_index=True)
-            invalid_addresses += 1
-            continue
-        # logger.debug(vars(candidates[0]))
-        output = {
-            "o_street_address1": f"{candidates[0].components.primary_number} {candidates[0].components.street_name} {candidates[0].components.street_suffix}",
-            "o_street_address2": f"{candidates[0].components.secondary_number} {candidates[0].components.secondary_designator} {candidates[0].components.extra_secondary_designator} {candidates[0].components.extra_secondary_number}",
-            "o_city": candidates[0].components.city_name,
-            "o_state_code": candidates[0].components.state_abbreviation,
-            "o_full_postal_code": f"{candidates[0].components.zipcode} {candidates[0].components.plus4_code}",
-            "o_country": "USA",
-            "o_external_addr_id": candidates[0].delivery_point_barcode,
-            "o_valid": 1
-        }
-
-        inp_out = {**input, **output}
-        # logger.info(inp_out)
-        df_dictionary = pd.DataFrame([inp_out])
-        df = pd.concat([df,df_dictionary], ignore_index=True)
-
-    # logger.info(df.head())
-    s3_uri = f"s3://{bucket}/{key}".replace(".","-")
-    logger.info(f"Writing input and output to {s3_uri}")
-    wr.s3.to_parquet(df, s3_uri)
-    return invalid_addresses
-
-
-# function to run smarty street address lookup
-def run_smarty_street_addr_lookup_batch(client: ClientBuilder, config: dict, message_batch: list, list_index: int, msg_id: str):
-    
-    # build the client and batch object
-
-    batch = Batch()
-
-    # Documentation for input fields can be found at:
-    # https://smartystreets.com/docs/street-api#input-fields
-
-    
-    # add input street addresses
-    # concat the components to create the fuill text as the validation services can split in to components
-    # batch.add(StreetLookup("123 Main St", "San Francisco", "CA", "94105"))
-    # [logger.info(message['address1'], message['city'], message['state_code'], message['zip_code']) for message in message_batch]
-    # [batch.add(StreetLookup(street=message['address1'], city=message['city'], state=message['state_code'], zipcode=str(message['zip_code']),input_id=str(message['source_id']))) for message in message_batch]
-    [batch.add(StreetLookup(street=utils.get_address_data_string(message, config["schema_map"]),input_id=str(message['source_id']))) for message in message_batch]
-
-    # run the batch
-    batch_size = len(batch)
-    logger.info(batch_size)
-    assert batch_size <= 100
-
-    try:
-        client.send_batch(batch)
-    except exceptions.SmartyException as err:
-        logger.error(err)
-        return
-    
-    # print_debug_info(lookup)
-    output_key = f"{config['s3_key']}-{msg_id}-{list_index}-smarty-result"
-    invalid_addresses = write_smarty_lookup_to_s3(batch, config['s3_bucket'], output_key, msg_id)
-
-    logger.info(f"Total/Invalid addresses in this batch:{batch_size}/{invalid_addresses}")
-
+# rate limiter of the smarty calls of this container, None if no rate_limit_per_second(lookups) is configured
+def get_rate_limiter(config: dict):
+    return providers.get_rate_limiter(SMARTY_CACHE_PROVIDER, config)
+
+# thread pool of the batches, kept for the next invocations of a warm container
+def get_batch_executor(concurrency: int) -> ThreadPoolExecutor:
+    return runtime_cache.runtime_cache.get(("batch_executor", concurrency), lambda: ThreadPoolExecutor(max_workers=concurrency))
+
+# smarty provider of the container, its clients and hedging state carry over to the next invocations
+# engine sdk sends with the smarty sdk, async_http with the asyncio engine. it is built again when the configuration changed
+def get_smarty_provider(config: dict, cli_profile: str=None) -> providers.ValidationProvider:
+    def build_provider():
+        if config.get("engine") == "async_http":
+            provider = async_http.AsyncHTTPSmartyProvider(config, cli_profile)
+        else:
+            provider = providers.SmartyProvider(config, cli_profile)
+        # with hedge settings the slow batches are sent to the hedge provider as well
+        return hedging.build_hedged_provider(config, provider, cli_profile) if config.get("hedge") else provider
+    settings = json.dumps({key: value for key, value in config.items() if key != "secrets"}, sort_keys=True, default=str)
+    return runtime_cache.runtime_cache.get(("smarty_provider", settings, cli_profile), build_provider)
+
+# run the batches with a provider on the pool of batch threads, each batch is validated and added to the output writer
+def run_provider_batches(provider: providers.ValidationProvider, config: dict, batches: list, writer: output_writer.RollingParquetWriter,
+                         concurrency: int=DEFAULT_BATCH_CONCURRENCY, cache=None, dedup=None) -> list:
+    """
+    batches is a list of (msg_id, list_index, message_batch)
+    A failed batch does not stop the others, returns the (msg_id, list_index) of the failed batches
+    """
+    failed = []
+    executor = get_batch_executor(concurrency)
+    futures = {
+        executor.submit(providers.validate_message_batch, provider, config, message_batch, msg_id, writer, cache, dedup): (msg_id, list_index)
+        for msg_id, list_index, message_batch in batches
+    }
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as err:
+            logger.error(f"Error in batch {futures[future]}: {err}")
+            failed.append(futures[future])
+    return failed
 
 # lambda handler that reads amazon step function input and calls the read_and_produce_df_chunk function
 def lambda_handler(event, context):
@@ -134,25 +101,64 @@ def lambda_handler(event, context):
     except(KeyError):
         cli_profile = None
 
-    config = utils.add_secrets_to_config(utils.get_app_configuration(ssm_parameter,cli_profile=cli_profile),cli_profile=cli_profile)
+    # configuration and secrets are cached by the container and refreshed in the background before they expire
+    config = runtime_cache.add_secrets_to_config(runtime_cache.get_app_configuration(ssm_parameter,cli_profile=cli_profile),cli_profile=cli_profile)
 
     # logger.info(config_json)
-    # build smarty client
-    credentials = StaticCredentials(config['secrets']['auth_id'], config['secrets']['auth_token'])
-    client = ClientBuilder(credentials).with_licenses([config['license_key']]).build_us_street_api_client()
+    batch_concurrency = int(config.get("batch_concurrency", DEFAULT_BATCH_CONCURRENCY))
 
     # iterate over event['records'] extract data
     # split in to batches of 100 (smarty street limit)
-    # call the run_smarty_street_addr_lookup_batch function
+    # the batches of all the records run on the thread pool, each thread builds its own smarty client
     
-    msg_id = event['Records'][0]['messageId']
+    batches = []
+    failed_msg_ids = set()
     for record in event['Records']:
-        msg_batch = json.loads(record['body'])
+        msg_id = record['messageId']
+        try:
+            # the body is either the rows or a claim check pointer to the rows staged in S3
+            msg_batch = utils.read_message_batch(record['body'])
+        except Exception as err:
+            logger.error(f"Error reading message {msg_id}: {err}")
+            failed_msg_ids.add(msg_id)
+            continue
         # logger.info(msg_batch)
-        batch_list = utils.split_msg_batch_into_batches(msg_batch, 100)
+        batch_list = utils.split_msg_batch_into_batches(msg_batch, SMARTY_MAX_BATCH_SIZE)
         logger.info(f"Processing {len(batch_list)} batches")
-        for i, msg_batch in enumerate(batch_list):
-            run_smarty_street_addr_lookup_batch(client, config, msg_batch, i, msg_id)
+        batches.extend((msg_id, i, msg_batch) for i, msg_batch in enumerate(batch_list))
+
+    # the results of all the batches are coalesced in to parquet files of output_file_size_mb
+    boto3_session = runtime_cache.get_boto3_session(cli_profile)
+    writer = output_writer.build_output_writer(config, boto3_session)
+    # the rows of a message reach the output files once all its batches succeeded
+    message_writer = output_writer.MessageOutputBuffer(writer, Counter(msg_id for msg_id, _, _ in batches))
+    # only the addresses not in the result cache are sent to smarty
+    cache = result_cache.build_result_cache(config, boto3_session)
+    # each address is sent once per message, or once per invocation with dedup_scope invocation
+    dedup = address_dedup.build_deduplicator(config)
+    provider = get_smarty_provider(config, cli_profile)
+    failed = run_provider_batches(provider, config, batches, message_writer, batch_concurrency, cache, dedup)
+    try:
+        writer.close()
+    except Exception as err:
+        logger.error(f"Error writing the output files: {err}")
+    if writer.upload_error is not None:
+        # rows of succeeded batches may have been lost with a file, so every message is retried
+        # and the files already uploaded are deleted so the retry does not write their rows twice
+        output_writer.delete_output_files(writer)
+        failed = [(msg_id, list_index) for msg_id, list_index, _ in batches]
+    output_writer.register_output_partitions(writer, config)
+    limiter = get_rate_limiter(config)
+    if limiter is not None:
+        utils.log_emf_metrics(limiter.get_metrics(), {"Service": "smarty"}, {"RateLimitWaitSeconds": "Seconds"})
+    if cache is not None:
+        utils.log_emf_metrics(cache.get_metrics(), {"Service": "smarty"}, {"CacheHitRate": "Percent"})
+    utils.log_emf_metrics(dedup.get_metrics(), {"Service": "smarty"}, {"DedupSavedRatio": "Percent"})
+    if isinstance(provider, hedging.HedgedProvider):
+        utils.log_emf_metrics(provider.get_metrics(), {"Service": "smarty"}, hedging.METRIC_UNITS)
+    # only the messages with a failed batch are retried by SQS
+    failed_msg_ids.update(msg_id for msg_id, _ in failed)
+    return utils.build_batch_item_failures(event['Records'], failed_msg_ids)
 
     # for custom api calls if validation service does not have an python SDK
     # config_json = utils.get_sample_configuration()
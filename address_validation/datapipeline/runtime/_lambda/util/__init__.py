@@ -0,0 +1,2 @@
+# the lambda runtime imports the util package, glue ships the modules as top level files
+# so the modules import each other from util and fall back to top level imports in glue
@@ -0,0 +1,98 @@
+"""
+Deduplication of the addresses sent to the validation vendor, rows with the same result cache key share one lookup
+"""
+import threading
+import logging
+from concurrent.futures import Future
+
+# set logging
+logger = logging.getLogger()
+
+DEDUP_SCOPES = ("message", "invocation")
+DEFAULT_DEDUP_SCOPE = "message"
+# seconds a batch waits for the lookups of other batches
+DEFAULT_WAIT_SECONDS = 120
+
+class AddressDeduplicator:
+    """
+    Tracks the keys claimed by the batches of a message(scope message) or of the invocation(scope invocation)
+    Failed keys fail their waiters and can be claimed again
+    """
+    def __init__(self, scope: str=DEFAULT_DEDUP_SCOPE, wait_seconds: float=DEFAULT_WAIT_SECONDS):
+        if scope not in DEDUP_SCOPES:
+            raise ValueError(f"dedup scope must be one of {DEDUP_SCOPES}, got {scope}")
+        self.scope = scope
+        self.wait_seconds = wait_seconds
+        self.lookups = {}
+        self.addresses = 0
+        self.lookup_count = 0
+        self.lock = threading.Lock()
+
+    def get_lookup_key(self, key: str, msg_id: str):
+        return key if self.scope == "invocation" else (msg_id, key)
+
+    def claim(self, keys: list, msg_id: str=None) -> list:
+        """
+        Returns the unique keys the caller has to look up, in order, the other keys are looked up by other batches
+        """
+        claimed = []
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                lookup_key = self.get_lookup_key(key, msg_id)
+                if lookup_key not in self.lookups:
+                    self.lookups[lookup_key] = Future()
+                    claimed.append(key)
+            self.addresses += len(keys)
+            self.lookup_count += len(claimed)
+        return claimed
+
+    def resolve(self, results: dict, msg_id: str=None) -> None:
+        """
+        Sets the outputs of claimed keys for the batches waiting on them
+        """
+        with self.lock:
+            futures = [self.lookups.get(self.get_lookup_key(key, msg_id)) for key in results]
+        for future, result in zip(futures, results.values()):
+            if future is not None and not future.done():
+                future.set_result(result)
+
+    def fail(self, keys: list, err: Exception, msg_id: str=None) -> None:
+        """
+        Fails the waiters of claimed keys that could not be looked up, the keys can be claimed again
+        """
+        futures = []
+        with self.lock:
+            for key in keys:
+                lookup_key = self.get_lookup_key(key, msg_id)
+                # keys already resolved keep their output
+                if lookup_key in self.lookups and not self.lookups[lookup_key].done():
+                    futures.append(self.lookups.pop(lookup_key))
+        for future in futures:
+            future.set_exception(err)
+
+    def wait(self, keys: list, msg_id: str=None) -> dict:
+        """
+        Returns the outputs of keys claimed by other batches, raises the error of a failed lookup
+        """
+        with self.lock:
+            futures = {key: self.lookups.get(self.get_lookup_key(key, msg_id)) for key in dict.fromkeys(keys)}
+        missing = [key for key, future in futures.items() if future is None]
+        if missing:
+            raise RuntimeError(f"{len(missing)} addresses failed in the batch that claimed them")
+        return {key: future.result(timeout=self.wait_seconds) for key, future in futures.items()}
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the addresses to look up, the vendor lookups sent and the percent of lookups saved
+        """
+        with self.lock:
+            saved = self.addresses - self.lookup_count
+            return {
+                "DedupAddresses": self.addresses,
+                "DedupLookups": self.lookup_count,
+                "DedupSavedRatio": 100.0 * saved / self.addresses if self.addresses else 0.0
+            }
+
+# deduplicator of an invocation, scope from dedup_scope of the configuration
+def build_deduplicator(config: dict) -> AddressDeduplicator:
+    return AddressDeduplicator(config.get("dedup_scope", DEFAULT_DEDUP_SCOPE), float(config.get("dedup_wait_seconds", DEFAULT_WAIT_SECONDS)))
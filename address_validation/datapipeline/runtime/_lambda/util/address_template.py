@@ -0,0 +1,93 @@
+"""
+Address text of the schema map columns, built for a whole chunk at a time with arrow compute kernels
+"""
+import math
+import threading
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# column of the address text the producer adds to the messages
+ADDRESS_TEXT_COLUMN = "full_addr_txt"
+# whole values that are a null written out as text
+NULL_TEXT_VALUES = ("nan", "none", "null")
+
+# value of a record as text, None for null and NaN values
+def to_text(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value if isinstance(value, str) else str(value)
+
+class AddressTemplate:
+    """
+    Address text template of a schema map, columns missing from the input are left out
+    apply_arrow formats a table or record batch, apply_pandas a DataFrame and apply_records a list of dicts
+    """
+    def __init__(self, schema_map: dict):
+        self.columns = list(schema_map.values())
+
+    # the address texts of text columns of the same length, one arrow string array per column
+    def join(self, arrays: list) -> pa.Array:
+        if not arrays:
+            return None
+        masked = []
+        for array in arrays:
+            array = pc.utf8_trim_whitespace(array)
+            is_null_text = pc.or_(pc.equal(array, ""), pc.is_in(pc.utf8_lower(array), value_set=pa.array(NULL_TEXT_VALUES)))
+            masked.append(pc.if_else(is_null_text, pa.scalar(None, pa.string()), array))
+        # null_handling skip drops trailing all null rows in some arrow versions, nulls are joined as empty
+        # strings and the separators they leave are collapsed
+        text = pc.binary_join_element_wise(*masked, " ", null_handling="replace", null_replacement="")
+        return pc.utf8_trim_whitespace(pc.replace_substring_regex(text, r"\s+", " "))
+
+    def apply_arrow(self, table) -> pa.Array:
+        """
+        Returns the address texts of the rows of an arrow table or record batch
+        """
+        names = set(table.schema.names)
+        arrays = [pc.cast(table.column(column), pa.string()) for column in self.columns if column in names]
+        if not arrays:
+            return pa.array([""] * table.num_rows, pa.string())
+        return self.join(arrays)
+
+    def apply_pandas(self, df) -> list:
+        """
+        Returns the address texts of the rows of a DataFrame, as a list of str
+        """
+        arrays = [pc.cast(pa.array(df[column], from_pandas=True), pa.string()) for column in self.columns if column in df.columns]
+        if not arrays:
+            return [""] * len(df.index)
+        return self.join(arrays).to_pylist()
+
+    def apply_records(self, records: list) -> list:
+        """
+        Returns the address texts of a list of row dicts, values that are not str are formatted with str
+        """
+        columns = [column for column in self.columns if any(column in record for record in records)]
+        if not columns:
+            return [""] * len(records)
+        arrays = [pa.array([to_text(record.get(column)) for record in records], pa.string()) for column in columns]
+        return self.join(arrays).to_pylist()
+
+    def format(self, record: dict) -> str:
+        return self.apply_records([record])[0]
+
+# templates by schema map, built once per container
+templates = {}
+templates_lock = threading.Lock()
+
+def get_address_template(schema_map: dict) -> AddressTemplate:
+    key = tuple(schema_map.items())
+    with templates_lock:
+        if key not in templates:
+            templates[key] = AddressTemplate(schema_map)
+        return templates[key]
+
+# address texts of message rows, the text the producer added or else the text of the schema map columns
+def get_record_texts(records: list, schema_map: dict) -> list:
+    if records and all(ADDRESS_TEXT_COLUMN in record for record in records):
+        return [to_text(record[ADDRESS_TEXT_COLUMN]) or "" for record in records]
+    return get_address_template(schema_map).apply_records(records)
+
+# the DataFrame with the address text column added
+def add_address_text(df, schema_map: dict):
+    return df.assign(**{ADDRESS_TEXT_COLUMN: get_address_template(schema_map).apply_pandas(df)})
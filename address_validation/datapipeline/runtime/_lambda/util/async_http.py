@@ -0,0 +1,123 @@
+"""
+Asyncio http engine for the smarty us street address api
+Fills the smarty sdk Batch objects over one pooled keep-alive httpx client, like client.send_batch does
+"""
+import asyncio
+import json
+import logging
+import threading
+import httpx
+from smartystreets_python_sdk import Batch
+from smartystreets_python_sdk.us_street import Candidate, Lookup as StreetLookup
+from smartystreets_python_sdk.us_street.client import remap_keys
+from util import utils, providers
+
+# set logging
+logger = logging.getLogger()
+
+# number of batches waiting on the api at the same time, also the size of the connection pool
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_TIMEOUT_SECONDS = 10
+# server errors retried like connection errors, throttling (429) is counted apart like the sdk engine does
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+# idle connections are kept open this long for the next batches
+KEEPALIVE_EXPIRY_SECONDS = 30
+
+# keep-alive client with a connection pool sized for the batches in flight
+def build_http_client(max_in_flight: int=DEFAULT_MAX_IN_FLIGHT, timeout: float=DEFAULT_TIMEOUT_SECONDS, transport=None) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=max_in_flight,
+        max_keepalive_connections=max_in_flight,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+    )
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    return httpx.AsyncClient(limits=limits, timeout=timeout, headers=headers, transport=transport)
+
+# json request body of the lookups of a batch, the same fields the smarty sdk sends
+def build_batch_payload(batch: Batch) -> str:
+    return json.dumps(remap_keys(batch.all_lookups))
+
+# adds the candidates of the api response to the result of their lookup
+def assign_candidates(batch: Batch, raw_candidates: list) -> Batch:
+    for raw_candidate in raw_candidates or []:
+        candidate = Candidate(raw_candidate)
+        batch[candidate.input_index].result.append(candidate)
+    return batch
+
+# post one batch, retrying throttling up to max_throttle_retries times and connection and server errors
+# up to max_transient_retries times with backoff
+# with a rate limiter the batch waits for a token per lookup, and throttling slows the limiter down
+async def post_batch(client: httpx.AsyncClient, url: str, batch: Batch, rate_limiter=None,
+                     max_throttle_retries: int=providers.DEFAULT_MAX_THROTTLE_RETRIES,
+                     max_transient_retries: int=providers.DEFAULT_MAX_TRANSIENT_RETRIES) -> Batch:
+    payload = build_batch_payload(batch)
+    throttles = 0
+    transient_errors = 0
+    while True:
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async(len(batch))
+        try:
+            response = await client.post(url, content=payload)
+        except httpx.TransportError as err:
+            transient_errors += 1
+            if transient_errors > max_transient_retries:
+                raise
+            logger.warning(f"retrying batch after connection error: {err}")
+            await asyncio.sleep(providers.TRANSIENT_RETRY_BASE_SECONDS * 2 ** (transient_errors - 1))
+            continue
+        if rate_limiter is not None:
+            if response.status_code == 429:
+                rate_limiter.on_throttle()
+            elif response.is_success:
+                rate_limiter.on_success()
+        if response.status_code == 429 and throttles < max_throttle_retries:
+            throttles += 1
+            logger.warning("batch throttled, retrying")
+            # the limiter already slowed down, without one the batch backs off
+            if rate_limiter is None:
+                await asyncio.sleep(providers.TRANSIENT_RETRY_BASE_SECONDS * 2 ** (throttles - 1))
+            continue
+        if response.status_code in TRANSIENT_STATUS_CODES and transient_errors < max_transient_retries:
+            transient_errors += 1
+            logger.warning(f"retrying batch after status {response.status_code}")
+            await asyncio.sleep(providers.TRANSIENT_RETRY_BASE_SECONDS * 2 ** (transient_errors - 1))
+            continue
+        response.raise_for_status()
+        return assign_candidates(batch, response.json())
+
+class AsyncHTTPSmartyProvider(providers.SmartyProvider):
+    """
+    Smarty us street api through the asyncio engine, the batches of all the threads share one keep-alive client
+    The client runs on an event loop thread of the provider, each call waits for its batch on that loop
+    """
+    def __init__(self, config: dict, cli_profile: str=None, transport=None):
+        super().__init__(config, cli_profile)
+        self.timeout = float(config.get("http_timeout_seconds", DEFAULT_TIMEOUT_SECONDS))
+        self.transport = transport
+        self.client = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    # the client is built on the loop it sends on
+    async def get_http_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = build_http_client(self.max_concurrency, self.timeout, self.transport)
+        return self.client
+
+    async def send(self, url: str, batch: Batch) -> Batch:
+        return await post_batch(await self.get_http_client(), url, batch, self.limiter, self.max_throttle_retries, self.max_transient_retries)
+
+    def validate(self, texts: list) -> list:
+        batch = Batch()
+        for i, text in enumerate(texts):
+            batch.add(StreetLookup(street=text, input_id=str(i)))
+        # the url holds the secrets, so it follows a reloaded secret
+        url = utils.build_address_validation_smarty_url({**self.config, **self.config['secrets']})
+        asyncio.run_coroutine_threadsafe(self.send(url, batch), self.loop).result()
+        return [providers.get_smarty_output(lookup) for lookup in batch]
+
+    def is_auth_error(self, err: Exception) -> bool:
+        return isinstance(err, httpx.HTTPStatusError) and err.response.status_code == 401
+
+    def is_permanent_error(self, err: Exception) -> bool:
+        return isinstance(err, httpx.HTTPStatusError) and err.response.status_code in providers.HTTP_PERMANENT_STATUS_CODES
@@ -0,0 +1,186 @@
+"""
+Change detection between validation runs of the same input
+Only rows whose address hash changed since the manifest of the last successful run are validated
+"""
+import io
+import hashlib
+import logging
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+try:
+    from util import result_builder, result_cache, address_template
+except ImportError:
+    import result_builder
+    import result_cache
+    import address_template
+
+# set logging
+logger = logging.getLogger()
+
+# output columns kept in the manifest, the input id is the source_id
+MANIFEST_OUTPUT_COLUMNS = [name for name in result_builder.RESULT_SCHEMA.names if name != "i_input_id"]
+MANIFEST_SCHEMA = pa.schema(
+    [("source_id", pa.string()), ("addr_hash", pa.int64())] +
+    [result_builder.RESULT_SCHEMA.field(name) for name in MANIFEST_OUTPUT_COLUMNS]
+)
+MANIFEST_COMPRESSION = "zstd"
+
+# s3 uri of the manifest of an input key
+def get_manifest_uri(bucket: str, prefix: str, input_key: str) -> str:
+    key_hash = hashlib.sha256(input_key.encode("utf-8")).hexdigest()[:32]
+    return f"s3://{bucket}/{prefix.strip('/')}/{key_hash}.parquet"
+
+# 64 bit hashes of the normalized address texts, formatting differences do not change the hash
+def get_address_hashes(texts: list) -> list:
+    return [
+        int.from_bytes(hashlib.blake2b(result_cache.normalize_address(text).encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+        for text in texts
+    ]
+
+def read_manifest(manifest_uri: str, provider: str, boto3_session) -> pa.Table:
+    """
+    Returns the manifest table, None when the input has no manifest or it holds the outputs of another provider
+    """
+    bucket, key = manifest_uri[len("s3://"):].split("/", 1)
+    try:
+        body = boto3_session.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            logger.info(f"No manifest at {manifest_uri}, every row is validated")
+            return None
+        raise
+    table = pq.read_table(io.BytesIO(body))
+    manifest_provider = (table.schema.metadata or {}).get(b"provider", b"").decode("utf-8")
+    if manifest_provider != provider:
+        logger.info(f"Manifest at {manifest_uri} holds {manifest_provider} outputs, every row is validated with {provider}")
+        return None
+    missing = set(MANIFEST_SCHEMA.names).difference(table.schema.names)
+    if missing:
+        logger.info(f"Manifest at {manifest_uri} has no {sorted(missing)} columns, every row is validated")
+        return None
+    return table.cast(MANIFEST_SCHEMA)
+
+def write_manifest(manifest_uri: str, table: pa.Table, provider: str, boto3_session) -> None:
+    bucket, key = manifest_uri[len("s3://"):].split("/", 1)
+    sink = io.BytesIO()
+    pq.write_table(table.replace_schema_metadata({"provider": provider}), sink, compression=MANIFEST_COMPRESSION)
+    boto3_session.client("s3").put_object(Bucket=bucket, Key=key, Body=sink.getvalue())
+
+class ChangeDetector:
+    """
+    Splits the chunks of a run in to the rows to validate and the output rows carried forward from the manifest
+    record adds the output of validated rows to the manifest of the run, to_table returns it
+    """
+    def __init__(self, manifest: pa.Table=None, provider: str=None):
+        manifest = manifest if manifest is not None else MANIFEST_SCHEMA.empty_table()
+        # only the outputs of the provider of the manifest are recorded, rows a hedge provider answered are validated again
+        self.provider = provider
+        self.manifest = manifest
+        # row of each source id in the manifest, the last one for repeated ids
+        self.rows = {source_id: i for i, source_id in enumerate(manifest.column("source_id").to_pylist())}
+        self.hashes = manifest.column("addr_hash").to_pylist()
+        # hashes of the rows sent to validation by source id, until their output is recorded
+        self.pending = {}
+        self.parts = []
+        self.seen = set()
+        self.inserted = 0
+        self.changed = 0
+        self.unchanged = 0
+
+    def split(self, df) -> tuple:
+        """
+        Returns the rows of the DataFrame to validate and the output table of the unchanged rows
+        The DataFrame needs the source_id and address text columns of address_template.add_address_text
+        """
+        source_ids = [str(source_id) for source_id in df["source_id"]]
+        hashes = get_address_hashes(df[address_template.ADDRESS_TEXT_COLUMN].tolist())
+        unchanged_rows = []
+        validate = []
+        for source_id, addr_hash in zip(source_ids, hashes):
+            row = self.rows.get(source_id)
+            self.seen.add(source_id)
+            if row is not None and self.hashes[row] == addr_hash:
+                unchanged_rows.append(row)
+                validate.append(False)
+                continue
+            if row is None:
+                self.inserted += 1
+            else:
+                self.changed += 1
+            self.pending[source_id] = addr_hash
+            validate.append(True)
+        self.unchanged += len(unchanged_rows)
+        carried = self.manifest.take(pa.array(unchanged_rows, pa.int64()))
+        self.parts.append(carried)
+        return df[validate], self.to_output_table(carried)
+
+    # output rows of manifest rows, with the input id of their source id
+    def to_output_table(self, manifest_rows: pa.Table) -> pa.Table:
+        columns = {
+            "i_input_id": manifest_rows.column("source_id"),
+            **{name: manifest_rows.column(name) for name in MANIFEST_OUTPUT_COLUMNS}
+        }
+        return pa.Table.from_pydict(columns, schema=result_builder.RESULT_SCHEMA)
+
+    def record(self, table: pa.Table) -> None:
+        """
+        Adds the validated rows of an output table to the manifest of the run
+        """
+        source_ids = pc.cast(table.column("i_input_id"), pa.string()).to_pylist()
+        hashes = [self.pending.get(source_id) for source_id in source_ids]
+        columns = {
+            "source_id": source_ids,
+            "addr_hash": hashes,
+            **{name: table.column(name) for name in MANIFEST_OUTPUT_COLUMNS}
+        }
+        part = pa.Table.from_pydict(columns, schema=MANIFEST_SCHEMA)
+        recorded = pc.is_valid(part.column("addr_hash"))
+        if self.provider is not None:
+            recorded = pc.and_(recorded, pc.fill_null(pc.equal(part.column("o_provider"), self.provider), False))
+        self.parts.append(part.filter(recorded))
+
+    def to_table(self) -> pa.Table:
+        """
+        Returns the manifest of the run, the rows carried forward and the rows validated and recorded
+        """
+        if not self.parts:
+            return MANIFEST_SCHEMA.empty_table()
+        return pa.concat_tables(self.parts)
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the rows inserted, changed, unchanged and deleted since the last run and the share of rows validated
+        """
+        deleted = len(self.rows) - len(self.seen.intersection(self.rows))
+        rows = self.inserted + self.changed + self.unchanged
+        return {
+            "RowsInserted": self.inserted,
+            "RowsChanged": self.changed,
+            "RowsUnchanged": self.unchanged,
+            "RowsDeleted": deleted,
+            "ValidatedRatio": 100.0 * (self.inserted + self.changed) / rows if rows else 0.0
+        }
+
+class RecordingWriter:
+    """
+    Output writer that records the validated rows it writes in the manifest of the run
+    """
+    def __init__(self, writer, detector: ChangeDetector):
+        self.writer = writer
+        self.detector = detector
+
+    def write(self, table: pa.Table) -> None:
+        self.writer.write(table)
+        self.detector.record(table)
+
+# change detector of an input with the manifest of its last run, None without a manifest_prefix in the configuration
+def build_change_detector(config: dict, bucket: str, input_key: str, provider: str, boto3_session) -> tuple:
+    """
+    Returns the change detector and the uri of the manifest, (None, None) when the run validates every row
+    """
+    if not config.get("manifest_prefix"):
+        return None, None
+    manifest_uri = get_manifest_uri(bucket, config["manifest_prefix"], input_key)
+    return ChangeDetector(read_manifest(manifest_uri, provider, boto3_session), provider), manifest_uri
@@ -0,0 +1,271 @@
+"""
+Hedged requests and failover between two validation providers
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+try:
+    from util import providers, runtime_cache
+except ImportError:
+    import providers
+    import runtime_cache
+
+# set logging
+logger = logging.getLogger()
+
+DEFAULT_HEDGE_PERCENTILE = 95
+# primary calls kept for the percentile and the least of them before it is used
+DEFAULT_LATENCY_WINDOW = 200
+DEFAULT_MIN_SAMPLES = 20
+# hedge delay until the primary has enough samples, and the shortest hedge delay
+DEFAULT_HEDGE_DELAY_SECONDS = 1.0
+DEFAULT_MIN_HEDGE_DELAY_SECONDS = 0.1
+# consecutive failed or slow primary calls that open the circuit, and seconds before the primary is tried again
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_SECONDS = 60
+DEFAULT_SLOW_CALL_SECONDS = 10
+
+# value at percentile of the sorted values
+def get_percentile(values: list, percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+class LatencyTracker:
+    """
+    Latencies in seconds of the last window calls
+    """
+    def __init__(self, window: int=DEFAULT_LATENCY_WINDOW, min_samples: int=DEFAULT_MIN_SAMPLES):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    # latency at percentile, default while there are fewer than min_samples calls
+    def get_percentile(self, percentile: float, default: float=None) -> float:
+        with self.lock:
+            samples = list(self.samples)
+        if len(samples) < self.min_samples:
+            return default
+        return get_percentile(samples, percentile)
+
+class CircuitBreaker:
+    """
+    Closed while the primary answers, open after failure_threshold failed calls in a row
+    Once open for reset_seconds one trial call is let through, the circuit closes again when it succeeds
+    """
+    def __init__(self, failure_threshold: int=DEFAULT_FAILURE_THRESHOLD, reset_seconds: float=DEFAULT_RESET_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.opens = 0
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    # whether the next call can go to the primary
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and self.clock() - self.opened_at >= self.reset_seconds:
+                self.trial = True
+                return True
+            return False
+
+    def on_success(self) -> None:
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info("primary provider recovered, closing the circuit")
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def on_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    self.opens += 1
+                    logger.warning(f"primary provider failed {self.failures} times, opening the circuit")
+                self.opened_at = self.clock()
+                self.trial = False
+
+# the call answered every text
+def is_complete(outputs) -> bool:
+    return not isinstance(outputs, Exception) and not any(isinstance(output, Exception) for output in outputs)
+
+class HedgedProvider(providers.ValidationProvider):
+    """
+    Sends each batch to the primary, and to the secondary too once it is slower than hedge_percentile of its recent calls
+    """
+    def __init__(self, primary: providers.ValidationProvider, secondary: providers.ValidationProvider, hedge_percentile: float=DEFAULT_HEDGE_PERCENTILE,
+                 tracker: LatencyTracker=None, breaker: CircuitBreaker=None, default_delay_seconds: float=DEFAULT_HEDGE_DELAY_SECONDS,
+                 min_delay_seconds: float=DEFAULT_MIN_HEDGE_DELAY_SECONDS, slow_call_seconds: float=DEFAULT_SLOW_CALL_SECONDS):
+        self.primary = primary
+        self.secondary = secondary
+        # cache lookups use the keys of the primary, outputs carry the o_provider of the provider that answered
+        self.name = primary.name
+        self.max_batch_size = primary.max_batch_size
+        self.max_concurrency = primary.max_concurrency
+        self.hedge_percentile = hedge_percentile
+        self.tracker = tracker or LatencyTracker()
+        self.breaker = breaker or CircuitBreaker()
+        self.default_delay_seconds = default_delay_seconds
+        self.min_delay_seconds = min_delay_seconds
+        self.slow_call_seconds = slow_call_seconds
+        # latencies of the answers used, to compare with the primary
+        self.served = LatencyTracker()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    # seconds the primary has before the batch is hedged
+    def get_hedge_delay(self) -> float:
+        return max(self.min_delay_seconds, self.tracker.get_percentile(self.hedge_percentile, self.default_delay_seconds))
+
+    # executor of the primary calls, the primary calls of hedged batches can outlive their batch
+    def get_executor(self) -> ThreadPoolExecutor:
+        workers = 2 * self.max_concurrency
+        return runtime_cache.runtime_cache.get(("hedge_executor", workers), lambda: ThreadPoolExecutor(max_workers=workers))
+
+    # executor of the hedges, apart from the primary calls so a hedge does not queue behind the slow calls it works around
+    # at most max_concurrency hedges run at the same time, the others wait for a worker instead of starting more threads
+    def get_hedge_executor(self) -> ThreadPoolExecutor:
+        workers = self.max_concurrency
+        return runtime_cache.runtime_cache.get(("hedge_secondary_executor", workers), lambda: ThreadPoolExecutor(max_workers=workers))
+
+    def call_primary(self, texts: list):
+        start = time.perf_counter()
+        outputs = providers.call_provider(self.primary, texts)
+        seconds = time.perf_counter() - start
+        self.tracker.observe(seconds)
+        if is_complete(outputs) and seconds <= self.slow_call_seconds:
+            self.breaker.on_success()
+        else:
+            self.breaker.on_failure()
+        return outputs, seconds
+
+    def call_secondary(self, texts: list):
+        return providers.validate_texts(self.secondary, texts)
+
+    def validate(self, texts: list) -> list:
+        start = time.perf_counter()
+        with self.lock:
+            self.calls += 1
+        if not self.breaker.allow():
+            with self.lock:
+                self.failovers += 1
+            outputs = self.call_secondary(texts)
+            self.served.observe(time.perf_counter() - start)
+            return outputs
+        primary = self.get_executor().submit(self.call_primary, texts)
+        done, _ = wait([primary], timeout=self.get_hedge_delay())
+        if done and is_complete(primary.result()[0]):
+            self.served.observe(time.perf_counter() - start)
+            return primary.result()[0]
+        # the primary is slow or failed, the first complete answer of the two is used
+        with self.lock:
+            self.hedges += 1
+        secondary = self.get_hedge_executor().submit(self.call_secondary, texts)
+        pending = {primary, secondary}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outputs = future.result()[0] if future is primary else future.result()
+                if not is_complete(outputs):
+                    continue
+                served_seconds = time.perf_counter() - start
+                self.served.observe(served_seconds)
+                if future is secondary:
+                    with self.lock:
+                        self.hedge_wins += 1
+                    primary.add_done_callback(lambda call: self.add_saved_seconds(call.result()[1] - served_seconds))
+                return outputs
+        # neither answered every text, the answer of the primary keeps its per text errors
+        self.served.observe(time.perf_counter() - start)
+        return primary.result()[0]
+
+    def add_saved_seconds(self, seconds: float) -> None:
+        with self.lock:
+            self.saved_seconds += max(0.0, seconds)
+
+    def is_auth_error(self, err: Exception) -> bool:
+        return self.primary.is_auth_error(err) or self.secondary.is_auth_error(err)
+
+    def on_auth_error(self) -> None:
+        self.primary.on_auth_error()
+        if self.secondary is not self.primary:
+            self.secondary.on_auth_error()
+
+    def is_permanent_error(self, err: Exception) -> bool:
+        return self.primary.is_permanent_error(err) or self.secondary.is_permanent_error(err)
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the batches, the hedges sent and won, the failovers of the open circuit and the tail latencies
+        TailLatencySavedSeconds adds up how much later the primary answered the batches the secondary won
+        """
+        with self.lock:
+            return {
+                "HedgeCalls": self.calls,
+                "HedgesSent": self.hedges,
+                "HedgeRate": 100.0 * self.hedges / self.calls if self.calls else 0.0,
+                "HedgeWins": self.hedge_wins,
+                "Failovers": self.failovers,
+                "CircuitOpens": self.breaker.opens,
+                "PrimaryLatencyP99Seconds": get_percentile(list(self.tracker.samples), 99),
+                "ServedLatencyP99Seconds": get_percentile(list(self.served.samples), 99),
+                "TailLatencySavedSeconds": self.saved_seconds
+            }
+
+# units of the hedging metrics for utils.log_emf_metrics
+METRIC_UNITS = {
+    "HedgeRate": "Percent",
+    "PrimaryLatencyP99Seconds": "Seconds",
+    "ServedLatencyP99Seconds": "Seconds",
+    "TailLatencySavedSeconds": "Seconds"
+}
+
+# hedged provider of the hedge settings of the configuration
+def build_hedged_provider(config: dict, primary: providers.ValidationProvider, cli_profile: str=None) -> HedgedProvider:
+    """
+    config["hedge"] holds the settings of the hedge, and with a provider other than primary its configuration
+    like {"provider": "awslocation", "place_index": "...", "percentile": 95, "failure_threshold": 5, "reset_seconds": 60}
+    """
+    hedge = config["hedge"]
+    if hedge.get("provider", "primary") == "primary":
+        secondary = primary
+    else:
+        secondary = providers.build_provider(hedge, cli_profile)
+    return HedgedProvider(
+        primary,
+        secondary,
+        float(hedge.get("percentile", DEFAULT_HEDGE_PERCENTILE)),
+        LatencyTracker(int(hedge.get("latency_window", DEFAULT_LATENCY_WINDOW)), int(hedge.get("min_samples", DEFAULT_MIN_SAMPLES))),
+        CircuitBreaker(int(hedge.get("failure_threshold", DEFAULT_FAILURE_THRESHOLD)), float(hedge.get("reset_seconds", DEFAULT_RESET_SECONDS))),
+        float(hedge.get("default_delay_seconds", DEFAULT_HEDGE_DELAY_SECONDS)),
+        float(hedge.get("min_delay_seconds", DEFAULT_MIN_HEDGE_DELAY_SECONDS)),
+        float(hedge.get("slow_call_seconds", DEFAULT_SLOW_CALL_SECONDS))
+    )
+
+# the provider of the configuration, hedged when the configuration has hedge settings
+def build_provider(config: dict, cli_profile: str=None) -> providers.ValidationProvider:
+    provider = providers.build_provider(config, cli_profile)
+    if not config.get("hedge"):
+        return provider
+    return build_hedged_provider(config, provider, cli_profile)
@@ -0,0 +1,295 @@
+"""
+Rolling parquet writer for the validation output
+Collects the result tables of many batches in to parquet files of about target_file_size_mb, optionally hive partitioned
+"""
+import os
+import tempfile
+import threading
+import time
+import uuid
+import logging
+from datetime import datetime, timezone
+from urllib.parse import quote
+import boto3
+import awswrangler as wr
+import pyarrow as pa
+import pyarrow.parquet as pq
+try:
+    from util import result_builder
+except ImportError:
+    import result_builder
+
+# set logging
+logger = logging.getLogger()
+
+DEFAULT_TARGET_FILE_SIZE_MB = 128
+DEFAULT_ROW_GROUP_ROWS = 100000
+# rows buffered across all the partitions before the largest buffer is written out
+DEFAULT_MAX_BUFFERED_ROWS = 1000000
+DEFAULT_COMPRESSION = "snappy"
+# partition value of null column values, the hive convention athena understands
+NULL_PARTITION_VALUE = "__HIVE_DEFAULT_PARTITION__"
+RUN_DATE_PARTITION = "run_date"
+# keys of a DeleteObjects request
+S3_DELETE_MAX_KEYS = 1000
+
+# value of a partition column as it appears in the catalog
+def get_partition_value(value) -> str:
+    return NULL_PARTITION_VALUE if value is None else str(value)
+
+# hive path of a partition under the prefix, like prefix/run_date=2024-01-01/o_valid=1
+def get_partition_path(prefix: str, partition_cols: list, values: list) -> str:
+    return "/".join([prefix] + [f"{col}={quote(value, safe=' ')}" for col, value in zip(partition_cols, values)])
+
+class PartitionFile:
+    """
+    Buffered rows and the open local file of one partition
+    """
+    def __init__(self, path: str, values: list):
+        self.path = path
+        self.values = values
+        self.pending = []
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self.file = None
+        self.file_index = 0
+        self.file_rows = 0
+        self.opened_at = None
+
+class RollingParquetWriter:
+    """
+    Writes the appended tables to s3://bucket/prefix/[col=value/...]part-{writer_id}-{file_index}.parquet
+    A file is rolled at target_file_size_mb or after max_buffer_seconds, write and close can be called from many threads
+    With sort_by the rows of a file are buffered until it rolls and sorted as a whole, so the row groups do not overlap
+    such a file rolls once its rows take target_file_size_mb in memory, and max_buffered_rows rolls the largest one early
+    """
+    def __init__(self, bucket: str, prefix: str, target_file_size_mb: float=DEFAULT_TARGET_FILE_SIZE_MB, row_group_rows: int=DEFAULT_ROW_GROUP_ROWS,
+                 max_buffer_seconds: float=None, boto3_session=None, schema: pa.Schema=result_builder.RESULT_SCHEMA,
+                 compression: str=DEFAULT_COMPRESSION, writer_id: str=None, clock=time.monotonic, partition_cols: list=None,
+                 partition_values: dict=None, sort_by: str=None, max_buffered_rows: int=DEFAULT_MAX_BUFFERED_ROWS):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.target_file_size = int(target_file_size_mb * 1024 * 1024)
+        self.row_group_rows = row_group_rows
+        self.max_buffer_seconds = max_buffer_seconds
+        self.boto3_session = boto3_session or boto3.session.Session()
+        self.s3_client = self.boto3_session.client("s3")
+        self.schema = schema
+        self.compression = compression
+        self.writer_id = writer_id or uuid.uuid4().hex
+        self.clock = clock
+        self.partition_cols = partition_cols or []
+        self.partition_values = partition_values or {}
+        self.row_partition_cols = [col for col in self.partition_cols if col not in self.partition_values]
+        self.file_schema = pa.schema([field for field in schema if field.name not in self.partition_cols])
+        self.sort_by = sort_by
+        self.max_buffered_rows = max_buffered_rows
+        self.partitions = {}
+        self.written_keys = []
+        # path and values of the partitions with at least one uploaded file
+        self.written_partitions = {}
+        # error of a failed upload, the rows of the batches written before it are lost with the file
+        self.upload_error = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, table: pa.Table) -> None:
+        with self.lock:
+            for values, partition_table in self.split_partitions(table.cast(self.schema)):
+                partition = self.get_partition(values)
+                if partition.opened_at is None:
+                    partition.opened_at = self.clock()
+                partition.pending.append(partition_table)
+                partition.pending_rows += partition_table.num_rows
+                partition.pending_bytes += partition_table.nbytes
+                if self.sort_by is not None:
+                    if partition.pending_bytes >= self.target_file_size:
+                        self.roll(partition)
+                    continue
+                if partition.pending_rows >= self.row_group_rows:
+                    self.write_row_groups(partition)
+                if partition.file is not None and partition.file["sink"].tell() >= self.target_file_size:
+                    self.roll(partition)
+            self.bound_buffered_rows()
+            if self.max_buffer_seconds is not None:
+                now = self.clock()
+                for partition in self.partitions.values():
+                    if partition.opened_at is not None and now - partition.opened_at >= self.max_buffer_seconds:
+                        self.roll(partition)
+
+    # the rows of the table grouped by the values of the partition columns, without the partition columns
+    def split_partitions(self, table: pa.Table):
+        fixed_values = {col: get_partition_value(value) for col, value in self.partition_values.items()}
+        if not self.row_partition_cols:
+            yield [fixed_values[col] for col in self.partition_cols], table.select(self.file_schema.names)
+            return
+        row_values = zip(*(table.column(col).to_pylist() for col in self.row_partition_cols))
+        indices = {}
+        for i, values in enumerate(row_values):
+            indices.setdefault(values, []).append(i)
+        for values, rows in indices.items():
+            partition = {**fixed_values, **{col: get_partition_value(value) for col, value in zip(self.row_partition_cols, values)}}
+            yield [partition[col] for col in self.partition_cols], table.take(rows).select(self.file_schema.names)
+
+    def get_partition(self, values: list) -> PartitionFile:
+        key = tuple(values)
+        if key not in self.partitions:
+            path = get_partition_path(self.prefix, self.partition_cols, values)
+            self.partitions[key] = PartitionFile(path, values)
+        return self.partitions[key]
+
+    # writes out the largest buffers while the rows buffered across the partitions are over max_buffered_rows
+    # a sorted file is rolled so it stays sorted as a whole. called with the lock held
+    def bound_buffered_rows(self) -> None:
+        while sum(partition.pending_rows for partition in self.partitions.values()) > self.max_buffered_rows:
+            partition = max(self.partitions.values(), key=lambda partition: partition.pending_rows)
+            if self.sort_by is not None:
+                self.roll(partition)
+            else:
+                self.write_row_groups(partition, rolling=True)
+
+    # writes the buffered rows to the local file as full row groups, the rest stays buffered unless
+    # the file is being rolled. the buffer is sorted before it is split in to row groups. called with the lock held
+    def write_row_groups(self, partition: PartitionFile, rolling: bool=False) -> None:
+        rows = partition.pending_rows if rolling else partition.pending_rows - partition.pending_rows % self.row_group_rows
+        if not rows:
+            return
+        if partition.file is None:
+            path = os.path.join(tempfile.gettempdir(), f"part-{self.writer_id}-{uuid.uuid4().hex}.parquet")
+            sink = pa.OSFile(path, "wb")
+            partition.file = {"path": path, "sink": sink, "writer": pq.ParquetWriter(sink, self.file_schema, compression=self.compression)}
+        table = pa.concat_tables(partition.pending)
+        if self.sort_by is not None:
+            table = table.sort_by(self.sort_by)
+        for start in range(0, rows, self.row_group_rows):
+            row_group = table.slice(start, min(self.row_group_rows, rows - start))
+            partition.file["writer"].write_table(row_group, row_group_size=self.row_group_rows)
+        partition.file_rows += rows
+        partition.pending = [table.slice(rows)] if rows < partition.pending_rows else []
+        partition.pending_rows -= rows
+        partition.pending_bytes = sum(pending.nbytes for pending in partition.pending)
+
+    # closes the local file of the partition and uploads it, called with the lock held
+    def roll(self, partition: PartitionFile) -> None:
+        self.write_row_groups(partition, rolling=True)
+        if partition.file is None:
+            return
+        partition.file["writer"].close()
+        partition.file["sink"].close()
+        key = f"{partition.path}/part-{self.writer_id}-{partition.file_index:05d}.parquet"
+        try:
+            logger.info(f"Writing {partition.file_rows} rows to s3://{self.bucket}/{key}")
+            self.s3_client.upload_file(partition.file["path"], self.bucket, key)
+        except Exception as err:
+            self.upload_error = err
+            raise
+        finally:
+            os.remove(partition.file["path"])
+            partition.file = None
+            partition.file_rows = 0
+            partition.opened_at = None
+        self.written_keys.append(key)
+        self.written_partitions[partition.path] = partition.values
+        partition.file_index += 1
+
+    def flush(self) -> None:
+        """
+        Uploads the buffered rows as files right away, for example before a time budget runs out
+        """
+        with self.lock:
+            for partition in self.partitions.values():
+                self.roll(partition)
+
+    def close(self) -> list:
+        """
+        Uploads the buffered rows and returns the keys of all the files written
+        """
+        self.flush()
+        return self.written_keys
+
+    def delete_written(self) -> None:
+        """
+        Deletes the files uploaded so far, before the messages whose rows they hold are all retried
+        """
+        with self.lock:
+            for start in range(0, len(self.written_keys), S3_DELETE_MAX_KEYS):
+                keys = self.written_keys[start:start + S3_DELETE_MAX_KEYS]
+                logger.info(f"Deleting {len(keys)} output files from s3://{self.bucket}")
+                self.s3_client.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True})
+            self.written_keys = []
+            self.written_partitions = {}
+
+    def register_partitions(self, database: str, table: str) -> None:
+        """
+        Adds the partitions written to the catalog table, partitions already in the catalog are left as they are
+        """
+        partitions_values = {f"s3://{self.bucket}/{path}/": values for path, values in self.written_partitions.items() if values}
+        if not partitions_values:
+            return
+        logger.info(f"Registering {len(partitions_values)} partitions in {database}.{table}")
+        wr.catalog.add_parquet_partitions(database, table, partitions_values, compression=self.compression, boto3_session=self.boto3_session)
+
+class MessageOutputBuffer:
+    """
+    Writes the output tables of a message once all its batch_counts[msg_id] batches are written
+    """
+    def __init__(self, writer: RollingParquetWriter, batch_counts: dict):
+        self.writer = writer
+        self.batch_counts = dict(batch_counts)
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def write(self, table: pa.Table) -> None:
+        msg_id = table.column("i_input_msg_id")[0].as_py()
+        with self.lock:
+            tables = self.tables.setdefault(msg_id, [])
+            tables.append(table)
+            if len(tables) < self.batch_counts.get(msg_id, 1):
+                return
+            del self.tables[msg_id]
+        self.writer.write(pa.concat_tables(tables))
+
+# writer of the output of a validator, configured by output_file_size_mb, output_row_group_rows,
+# output_max_buffer_seconds, output_partition_cols, output_sort_by and output_max_buffered_rows. files go under the s3_key of the configuration
+# the run_date partition is the UTC date the writer is built
+def build_output_writer(config: dict, boto3_session=None) -> RollingParquetWriter:
+    max_buffer_seconds = config.get("output_max_buffer_seconds")
+    partition_cols = config.get("output_partition_cols", [])
+    partition_values = {}
+    if RUN_DATE_PARTITION in partition_cols:
+        partition_values[RUN_DATE_PARTITION] = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    return RollingParquetWriter(
+        config["s3_bucket"],
+        config["s3_key"].replace(".", "-"),
+        float(config.get("output_file_size_mb", DEFAULT_TARGET_FILE_SIZE_MB)),
+        int(config.get("output_row_group_rows", DEFAULT_ROW_GROUP_ROWS)),
+        float(max_buffer_seconds) if max_buffer_seconds else None,
+        boto3_session,
+        partition_cols=partition_cols,
+        partition_values=partition_values,
+        sort_by=config.get("output_sort_by"),
+        max_buffered_rows=int(config.get("output_max_buffered_rows", DEFAULT_MAX_BUFFERED_ROWS))
+    )
+
+# adds the partitions of a closed writer to the output_database.output_table catalog table when it is configured
+# the files are already in S3, so a failure is logged rather than failing the batches. MSCK REPAIR TABLE recovers them
+def register_output_partitions(writer: RollingParquetWriter, config: dict) -> None:
+    if not config.get("output_database") or not config.get("output_table"):
+        return
+    try:
+        writer.register_partitions(config["output_database"], config["output_table"])
+    except Exception as err:
+        logger.error(f"Error registering the output partitions: {err}")
+
+# deletes the files of a writer with a failed upload, all its messages are retried. a failure is logged,
+# the retry then writes the rows of the files left again
+def delete_output_files(writer: RollingParquetWriter) -> None:
+    try:
+        writer.delete_written()
+    except Exception as err:
+        logger.error(f"Error deleting the output files: {err}")
@@ -0,0 +1,585 @@
+"""
+Address validation providers behind one batch contract
+validate_message_batch runs any provider with the shared result cache, deduplication and output writer
+"""
+import json
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError, EndpointConnectionError, ConnectionClosedError, ConnectTimeoutError, ReadTimeoutError
+try:
+    from util import rate_limiter, result_builder, result_cache, runtime_cache, address_dedup, address_template
+except ImportError:
+    import rate_limiter
+    import result_builder
+    import result_cache
+    import runtime_cache
+    import address_dedup
+    import address_template
+# the aws location and producer packages do not ship the smarty sdk
+try:
+    from smartystreets_python_sdk import StaticCredentials, exceptions as smarty_exceptions, Batch, ClientBuilder
+    from smartystreets_python_sdk.us_street import Lookup as StreetLookup
+except ImportError:
+    smarty_exceptions = None
+
+# set logging
+logger = logging.getLogger()
+
+# times a throttled call is sent again before it fails
+DEFAULT_MAX_THROTTLE_RETRIES = 5
+# times a call is sent again after a transient error before it fails, with exponential backoff
+DEFAULT_MAX_TRANSIENT_RETRIES = 3
+TRANSIENT_RETRY_BASE_SECONDS = 0.5
+
+# smarty street api limit of lookups per batch
+SMARTY_MAX_BATCH_SIZE = 100
+DEFAULT_SMARTY_CONCURRENCY = 4
+if smarty_exceptions is not None:
+    TRANSIENT_SMARTY_ERRORS = (
+        smarty_exceptions.InternalServerError,
+        smarty_exceptions.ServiceUnavailableError,
+        smarty_exceptions.GatewayTimeoutError,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout
+    )
+    # the api rejected the addresses of the batch, sending them again fails the same way
+    PERMANENT_SMARTY_ERRORS = (smarty_exceptions.BadRequestError, smarty_exceptions.UnprocessableEntityError)
+
+# aws location searches one address per call
+DEFAULT_LOOKUP_CONCURRENCY = 16
+THROTTLE_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException")
+TRANSIENT_ERROR_CODES = ("InternalServerException", "ServiceUnavailableException")
+TRANSIENT_CONNECTION_ERRORS = (EndpointConnectionError, ConnectionClosedError, ConnectTimeoutError, ReadTimeoutError)
+# the credentials of the session expired or were rejected, the session and its clients are built again
+AUTH_ERROR_CODES = ("ExpiredTokenException", "UnrecognizedClientException", "InvalidSignatureException")
+# the search rejected the text, or its result misses the fields of the output
+PERMANENT_ERROR_CODES = ("ValidationException",)
+PERMANENT_OUTPUT_ERRORS = (KeyError, TypeError, ValueError)
+
+DEFAULT_HTTP_BATCH_SIZE = 100
+DEFAULT_HTTP_CONCURRENCY = 4
+DEFAULT_HTTP_TIMEOUT_SECONDS = 10
+HTTP_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+HTTP_AUTH_STATUS_CODES = (401, 403)
+HTTP_PERMANENT_STATUS_CODES = (400, 422)
+
+class ProviderError(Exception):
+    """
+    Addresses a provider could not validate, error is the first error of the provider
+    """
+    def __init__(self, provider: str, error: Exception):
+        super().__init__(f"{provider} validation failed: {error}")
+        self.provider = provider
+        self.error = error
+
+class ValidationProvider:
+    """
+    Validates batches of address texts with one validation service
+    name is the provider part of the result cache keys, calls of validate can run on different threads
+    """
+    name = None
+    max_batch_size = 1
+    max_concurrency = 1
+
+    def validate(self, texts: list) -> list:
+        """
+        Returns the output fields of each text, or the error of a text that failed, in the order of the texts
+        Raises when the whole call failed
+        """
+        raise NotImplementedError
+
+    # the service rejected the credentials of the call
+    def is_auth_error(self, err: Exception) -> bool:
+        return False
+
+    # load the credentials again before the failed texts are sent once more
+    def on_auth_error(self) -> None:
+        pass
+
+    # the text can not be validated however often it is sent, it is written as an invalid address instead of failing the message
+    def is_permanent_error(self, err: Exception) -> bool:
+        return False
+
+# rate limiter of the calls of a provider in this container, None if no rate_limit_per_second(lookups) is configured
+def get_rate_limiter(name: str, config: dict):
+    if not config.get("rate_limit_per_second"):
+        return None
+    return rate_limiter.get_shared_rate_limiter(name, float(config["rate_limit_per_second"]))
+
+# output fields of the first candidate of a smarty lookup, only the valid flag for an invalid address
+# this assumes US address format
+def get_smarty_output(lookup) -> dict:
+    candidates = lookup.result
+    if len(candidates) == 0:
+        return {"o_valid": 0}
+    # logger.debug(vars(candidates[0]))
+    return {
+        "o_street_address1": f"{candidates[0].components.primary_number} {candidates[0].components.street_name} {candidates[0].components.street_suffix}",
+        "o_street_address2": f"{candidates[0].components.secondary_number} {candidates[0].components.secondary_designator} {candidates[0].components.extra_secondary_designator} {candidates[0].components.extra_secondary_number}",
+        "o_city": candidates[0].components.city_name,
+        "o_state_code": candidates[0].components.state_abbreviation,
+        "o_full_postal_code": f"{candidates[0].components.zipcode} {candidates[0].components.plus4_code}",
+        "o_country": "USA",
+        "o_external_addr_id": candidates[0].delivery_point_barcode,
+        "o_valid": 1
+    }
+
+# build the smarty us street api client with the secrets of the config
+# with a rate limiter the sdk does not retry, so throttling reaches the limiter instead of a fixed 10 second sleep
+def build_smarty_client(config: dict, no_retries: bool=False):
+    credentials = StaticCredentials(config['secrets']['auth_id'], config['secrets']['auth_token'])
+    client_builder = ClientBuilder(credentials).with_licenses([config['license_key']])
+    if no_retries:
+        client_builder = client_builder.retry_at_most(0)
+    return client_builder.build_us_street_api_client()
+
+# send the batch at the pace of the rate limiter, a throttled batch is sent again once the limiter slowed down
+# and transient errors are retried with backoff. without a limiter the sdk retries on its own
+def send_smarty_batch(client, batch, limiter=None, max_throttle_retries: int=DEFAULT_MAX_THROTTLE_RETRIES,
+                      max_transient_retries: int=DEFAULT_MAX_TRANSIENT_RETRIES):
+    if limiter is None:
+        client.send_batch(batch)
+        return
+    throttles = 0
+    transient_errors = 0
+    while True:
+        limiter.acquire(len(batch))
+        try:
+            client.send_batch(batch)
+        except smarty_exceptions.TooManyRequestsError:
+            limiter.on_throttle()
+            throttles += 1
+            if throttles > max_throttle_retries:
+                raise
+            logger.warning(f"batch throttled, retrying at {limiter.rate:.1f} lookups per second")
+            continue
+        except TRANSIENT_SMARTY_ERRORS as err:
+            transient_errors += 1
+            if transient_errors > max_transient_retries:
+                raise
+            logger.warning(f"retrying batch after transient error: {err}")
+            time.sleep(TRANSIENT_RETRY_BASE_SECONDS * 2 ** (transient_errors - 1))
+            continue
+        limiter.on_success()
+        return
+
+class SmartyProvider(ValidationProvider):
+    """
+    Smarty us street api through the smarty sdk, batches of up to 100 addresses
+    Each thread sends with its own client, built again after the secret was reloaded
+    """
+    name = "smarty"
+    max_batch_size = SMARTY_MAX_BATCH_SIZE
+
+    def __init__(self, config: dict, cli_profile: str=None):
+        self.config = config
+        self.cli_profile = cli_profile
+        self.max_concurrency = int(config.get("batch_concurrency", DEFAULT_SMARTY_CONCURRENCY))
+        self.limiter = get_rate_limiter(self.name, config)
+        self.max_throttle_retries = int(config.get("max_throttle_retries", DEFAULT_MAX_THROTTLE_RETRIES))
+        self.max_transient_retries = int(config.get("max_transient_retries", DEFAULT_MAX_TRANSIENT_RETRIES))
+        self.thread_resources = threading.local()
+
+    def get_client(self):
+        client_key = (self.config['secrets']['auth_id'], self.config['secrets']['auth_token'])
+        if getattr(self.thread_resources, "client_key", None) != client_key:
+            self.thread_resources.client = build_smarty_client(self.config, self.limiter is not None)
+            self.thread_resources.client_key = client_key
+        return self.thread_resources.client
+
+    def validate(self, texts: list) -> list:
+        batch = Batch()
+        for i, text in enumerate(texts):
+            batch.add(StreetLookup(street=text, input_id=str(i)))
+        send_smarty_batch(self.get_client(), batch, self.limiter, self.max_throttle_retries, self.max_transient_retries)
+        return [get_smarty_output(lookup) for lookup in batch]
+
+    def is_auth_error(self, err: Exception) -> bool:
+        return isinstance(err, smarty_exceptions.BadCredentialsError)
+
+    def is_permanent_error(self, err: Exception) -> bool:
+        return isinstance(err, PERMANENT_SMARTY_ERRORS)
+
+    def on_auth_error(self) -> None:
+        runtime_cache.refresh_secrets(self.config, self.cli_profile)
+
+def is_location_throttle_error(err: Exception) -> bool:
+    return isinstance(err, ClientError) and err.response.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES
+
+def is_location_transient_error(err: Exception) -> bool:
+    if isinstance(err, ClientError):
+        return err.response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES
+    return isinstance(err, TRANSIENT_CONNECTION_ERRORS)
+
+def is_location_auth_error(err: Exception) -> bool:
+    return isinstance(err, ClientError) and err.response.get("Error", {}).get("Code") in AUTH_ERROR_CODES
+
+def is_location_permanent_error(err: Exception) -> bool:
+    if isinstance(err, ClientError):
+        return err.response.get("Error", {}).get("Code") in PERMANENT_ERROR_CODES
+    return isinstance(err, PERMANENT_OUTPUT_ERRORS)
+
+# output fields of the best search result of an address, only the valid flag for an invalid address
+def get_awsloc_output(candidates: list) -> dict:
+    # with aws loc services if address is accurately identified relevance will be 1
+    # Here we are replicating what a STRICT validation looks like with smarty api
+    if len(candidates) == 0 or candidates[0]['Relevance'] < 1:
+        return { "o_valid": 0 }
+    # logger.debug(vars(candidates[0]))
+    # the output schema changes with the validation api
+    # below assumes an US address schema and the current venice attribute schema
+    try:
+        o_street_address2 = f'{candidates[0]["Place"]["UnitType"]} {candidates[0]["Place"]["UnitNumber"]}'
+    except KeyError:
+        o_street_address2 = None
+
+    try:
+        o_external_addr_id = candidates[0]["PlaceId"]
+    except KeyError:
+        o_external_addr_id = None
+
+    return {
+        "o_street_address1": f'{candidates[0]["Place"]["AddressNumber"]} {candidates[0]["Place"]["Street"]}',
+        "o_street_address2": o_street_address2,
+        "o_city": candidates[0]["Place"]["Municipality"],
+        "o_state_code": candidates[0]["Place"]["Region"],
+        "o_full_postal_code": candidates[0]["Place"]["PostalCode"],
+        "o_country": candidates[0]["Place"]["Country"],
+        "o_external_addr_id": o_external_addr_id,
+        "o_valid": 1
+    }
+
+# search the place index at the pace of the rate limiter, a throttled search is sent again once the limiter slowed down
+# and transient errors are retried with backoff
+def search_place_index(awsloc_client, place_index: str, text: str, limiter=None, max_throttle_retries: int=DEFAULT_MAX_THROTTLE_RETRIES,
+                       max_transient_retries: int=DEFAULT_MAX_TRANSIENT_RETRIES) -> dict:
+    throttles = 0
+    transient_errors = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = awsloc_client.search_place_index_for_text(
+                IndexName=place_index,
+                MaxResults=1,
+                Text=text
+            )
+        except Exception as err:
+            if is_location_throttle_error(err):
+                throttles += 1
+                if throttles > max_throttle_retries:
+                    raise
+                if limiter is not None:
+                    limiter.on_throttle()
+                else:
+                    time.sleep(0.1 * 2 ** throttles)
+                logger.warning("search throttled, retrying")
+                continue
+            if is_location_transient_error(err):
+                transient_errors += 1
+                if transient_errors > max_transient_retries:
+                    raise
+                logger.warning(f"retrying search after transient error: {err}")
+                time.sleep(TRANSIENT_RETRY_BASE_SECONDS * 2 ** (transient_errors - 1))
+                continue
+            raise
+        if limiter is not None:
+            limiter.on_success()
+        return response
+
+# location client of the container with a connection per concurrent search
+# with a rate limiter botocore does not retry so throttling reaches the limiter
+def get_location_client(cli_profile: str=None, concurrency: int=DEFAULT_LOOKUP_CONCURRENCY, limiter=None):
+    if limiter is not None:
+        client_config = Config(max_pool_connections=concurrency, retries={"mode": "standard", "max_attempts": 1})
+        return runtime_cache.get_client('location', cli_profile, client_config, name=f"location-{concurrency}-no-retries")
+    return runtime_cache.get_client('location', cli_profile, Config(max_pool_connections=concurrency), name=f"location-{concurrency}")
+
+class AWSLocationProvider(ValidationProvider):
+    """
+    Amazon Location Service place index, one address per search and lookup_concurrency searches at a time
+    get_client(cli_profile, concurrency, limiter) returns the location client, the cached client of the container by default
+    """
+    name = "awslocation"
+
+    def __init__(self, config: dict, cli_profile: str=None, get_client=None):
+        self.place_index = config["place_index"]
+        self.cli_profile = cli_profile
+        self.max_concurrency = int(config.get("lookup_concurrency", DEFAULT_LOOKUP_CONCURRENCY))
+        self.limiter = get_rate_limiter(self.name, config)
+        self.max_throttle_retries = int(config.get("max_throttle_retries", DEFAULT_MAX_THROTTLE_RETRIES))
+        self.max_transient_retries = int(config.get("max_transient_retries", DEFAULT_MAX_TRANSIENT_RETRIES))
+        self.get_client = get_client or get_location_client
+
+    def validate(self, texts: list) -> list:
+        client = self.get_client(self.cli_profile, self.max_concurrency, self.limiter)
+        outputs = []
+        for text in texts:
+            try:
+                response = search_place_index(client, self.place_index, text, self.limiter, self.max_throttle_retries, self.max_transient_retries)
+                outputs.append(get_awsloc_output(response["Results"]))
+            except Exception as err:
+                outputs.append(err)
+        return outputs
+
+    def is_auth_error(self, err: Exception) -> bool:
+        return is_location_auth_error(err)
+
+    def is_permanent_error(self, err: Exception) -> bool:
+        return is_location_permanent_error(err)
+
+    def on_auth_error(self) -> None:
+        runtime_cache.invalidate_clients(self.cli_profile)
+
+class HTTPProvider(ValidationProvider):
+    """
+    Validation service with a json batch api, for vendors without a python sdk
+    Posts [{"input_index": 0, "address": "..."}, ...] to http_url, http_output_fields maps the result fields to the output columns
+    """
+    name = "http"
+
+    def __init__(self, config: dict, cli_profile: str=None):
+        self.config = config
+        self.cli_profile = cli_profile
+        self.url = config["http_url"]
+        self.name = config.get("http_provider_name", self.name)
+        self.max_batch_size = int(config.get("http_batch_size", DEFAULT_HTTP_BATCH_SIZE))
+        self.max_concurrency = int(config.get("http_concurrency", DEFAULT_HTTP_CONCURRENCY))
+        self.timeout = float(config.get("http_timeout_seconds", DEFAULT_HTTP_TIMEOUT_SECONDS))
+        self.results_key = config.get("http_results_key")
+        self.output_fields = config.get("http_output_fields") or {name: name for name in result_builder.RESULT_SCHEMA.names if name.startswith("o_")}
+        self.limiter = get_rate_limiter(self.name, config)
+        self.max_throttle_retries = int(config.get("max_throttle_retries", DEFAULT_MAX_THROTTLE_RETRIES))
+        self.max_transient_retries = int(config.get("max_transient_retries", DEFAULT_MAX_TRANSIENT_RETRIES))
+        self.thread_resources = threading.local()
+
+    def get_headers(self) -> dict:
+        secrets = self.config.get("secrets", {})
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        headers.update({name: str(value).format_map(secrets) for name, value in self.config.get("http_headers", {}).items()})
+        return headers
+
+    # keep-alive session of the current thread, requests sessions are not thread safe
+    def get_session(self) -> requests.Session:
+        if getattr(self.thread_resources, "session", None) is None:
+            self.thread_resources.session = requests.Session()
+        return self.thread_resources.session
+
+    # post the payload of lookups addresses, throttling and transient errors are retried like the sdk providers
+    def post(self, payload: str, lookups: int) -> requests.Response:
+        throttles = 0
+        transient_errors = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire(lookups)
+            try:
+                response = self.get_session().post(self.url, data=payload, headers=self.get_headers(), timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                transient_errors += 1
+                if transient_errors > self.max_transient_retries:
+                    raise
+                logger.warning(f"retrying batch after transient error: {err}")
+                time.sleep(TRANSIENT_RETRY_BASE_SECONDS * 2 ** (transient_errors - 1))
+                continue
+            if response.status_code == 429:
+                throttles += 1
+                if self.limiter is not None:
+                    self.limiter.on_throttle()
+                if throttles <= self.max_throttle_retries:
+                    logger.warning("batch throttled, retrying")
+                    if self.limiter is None:
+                        time.sleep(0.1 * 2 ** throttles)
+                    continue
+            elif response.status_code in HTTP_RETRY_STATUS_CODES:
+                transient_errors += 1
+                if transient_errors <= self.max_transient_retries:
+                    logger.warning(f"retrying batch after status {response.status_code}")
+                    time.sleep(TRANSIENT_RETRY_BASE_SECONDS * 2 ** (transient_errors - 1))
+                    continue
+            elif response.ok and self.limiter is not None:
+                self.limiter.on_success()
+            response.raise_for_status()
+            return response
+
+    def get_output(self, result: dict) -> dict:
+        if result is None:
+            return {"o_valid": 0}
+        output = {column: result.get(field) for field, column in self.output_fields.items()}
+        output["o_valid"] = 1 if output.get("o_valid") is None else int(output["o_valid"])
+        return output
+
+    def validate(self, texts: list) -> list:
+        payload = json.dumps([{"input_index": i, "address": text} for i, text in enumerate(texts)])
+        results = self.post(payload, len(texts)).json()
+        if self.results_key:
+            results = results[self.results_key]
+        by_index = {int(result["input_index"]): result for result in results}
+        return [self.get_output(by_index.get(i)) for i in range(len(texts))]
+
+    def is_auth_error(self, err: Exception) -> bool:
+        return isinstance(err, requests.exceptions.HTTPError) and err.response is not None and err.response.status_code in HTTP_AUTH_STATUS_CODES
+
+    def on_auth_error(self) -> None:
+        if "secret_name" in self.config:
+            runtime_cache.refresh_secrets(self.config, self.cli_profile)
+
+    def is_permanent_error(self, err: Exception) -> bool:
+        return isinstance(err, requests.exceptions.HTTPError) and err.response is not None and err.response.status_code in HTTP_PERMANENT_STATUS_CODES
+
+class FakeProvider(ValidationProvider):
+    """
+    In memory provider for tests and benchmarks, addresses in invalid are invalid and addresses in failing fail
+    """
+    def __init__(self, name: str="fake", max_batch_size: int=100, max_concurrency: int=8, latency_seconds: float=0.0,
+                 invalid: tuple=(), failing: tuple=()):
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.latency_seconds = latency_seconds
+        self.invalid = set(invalid)
+        self.failing = set(failing)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def validate(self, texts: list) -> list:
+        with self.lock:
+            self.calls.append(list(texts))
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        outputs = []
+        for text in texts:
+            if text in self.failing:
+                outputs.append(RuntimeError(f"validation of {text} failed"))
+            elif text in self.invalid:
+                outputs.append({"o_valid": 0})
+            else:
+                outputs.append({"o_street_address1": text, "o_external_addr_id": text, "o_valid": 1})
+        return outputs
+
+def build_fake_provider(config: dict, cli_profile: str=None) -> FakeProvider:
+    return FakeProvider(
+        config.get("fake_provider_name", "fake"),
+        int(config.get("fake_batch_size", 100)),
+        int(config.get("fake_concurrency", 8)),
+        float(config.get("fake_latency_seconds", 0.0))
+    )
+
+# provider classes by the provider name of the configuration
+PROVIDERS = {
+    "smarty": SmartyProvider,
+    "awslocation": AWSLocationProvider,
+    "http": HTTPProvider,
+    "fake": build_fake_provider
+}
+
+# provider of the configuration, the configuration of smarty and http providers holds their secrets
+def build_provider(config: dict, cli_profile: str=None) -> ValidationProvider:
+    provider = config.get("provider")
+    if provider not in PROVIDERS:
+        raise ValueError(f"provider must be one of {tuple(PROVIDERS)}, got {provider}")
+    return PROVIDERS[provider](config, cli_profile)
+
+# thread pool of the calls of a provider, kept for the next invocations of a warm container
+# each provider has its own, so a provider calling another one does not wait on its own pool
+def get_provider_executor(name: str, concurrency: int) -> ThreadPoolExecutor:
+    return runtime_cache.runtime_cache.get(("provider_executor", name, concurrency), lambda: ThreadPoolExecutor(max_workers=concurrency))
+
+# the outputs or errors of a call, a call that raised fails all its texts
+# outputs are labelled with the provider that answered them, a hedged call keeps the label of the provider that won
+def call_provider(provider: ValidationProvider, texts: list) -> list:
+    try:
+        outputs = provider.validate(texts)
+    except Exception as err:
+        return [err] * len(texts)
+    return [output if isinstance(output, Exception) or "o_provider" in output else {**output, "o_provider": provider.name} for output in outputs]
+
+# the outputs looked up by the cache key of the provider that answered them, so a hedge answer is not cached as the primary
+def get_answer_cache_keys(looked_up: dict, key_texts: dict) -> dict:
+    return {result_cache.get_cache_key(output["o_provider"], key_texts[key]): output for key, output in looked_up.items()}
+
+# validate one provider batch, the texts rejected for their credentials are sent once more after the provider reloaded them
+def send_provider_batch(provider: ValidationProvider, texts: list) -> list:
+    outputs = call_provider(provider, texts)
+    rejected = [i for i, output in enumerate(outputs) if isinstance(output, Exception) and provider.is_auth_error(output)]
+    if rejected:
+        logger.warning(f"{provider.name} rejected the credentials, sending {len(rejected)} addresses again")
+        provider.on_auth_error()
+        for i, output in zip(rejected, call_provider(provider, [texts[i] for i in rejected])):
+            outputs[i] = output
+    return outputs
+
+def validate_texts(provider: ValidationProvider, texts: list) -> list:
+    """
+    Returns the output or the error of each text in the order of the texts
+    The texts are split in to batches of max_batch_size, up to max_concurrency batches are sent at the same time
+    """
+    batches = [texts[i:i + provider.max_batch_size] for i in range(0, len(texts), provider.max_batch_size)]
+    if len(batches) <= 1 or provider.max_concurrency <= 1:
+        results = [send_provider_batch(provider, batch) for batch in batches]
+    else:
+        results = get_provider_executor(provider.name, provider.max_concurrency).map(lambda batch: send_provider_batch(provider, batch), batches)
+    return [output for outputs in results for output in outputs]
+
+# validate the rows of a message with a provider and add them to the output files
+def validate_message_batch(provider: ValidationProvider, config: dict, message_batch: list, msg_id, writer, cache=None,
+                           dedup: address_dedup.AddressDeduplicator=None) -> dict:
+    """
+    Returns the number of addresses, cached, looked up and invalid addresses of the batch
+    Addresses the provider rejected for good are written as invalid, other errors raise a ProviderError so the message can be retried
+    """
+    texts = address_template.get_record_texts(message_batch, config["schema_map"])
+    keys = [result_cache.get_cache_key(provider.name, text) for text in texts]
+    cached = {key: {"o_provider": provider.name, **output} for key, output in (cache.get_many(keys) if cache is not None else {}).items()}
+    dedup = dedup or address_dedup.AddressDeduplicator()
+    misses = [key for key in keys if key not in cached]
+    lookup_keys = dedup.claim(misses, msg_id)
+    key_texts = dict(zip(reversed(keys), reversed(texts)))
+    outputs = validate_texts(provider, [key_texts[key] for key in lookup_keys])
+    rejected = {key: output for key, output in zip(lookup_keys, outputs) if isinstance(output, Exception) and provider.is_permanent_error(output)}
+    if rejected:
+        logger.warning(f"{len(rejected)} of {len(lookup_keys)} {provider.name} lookups were rejected, writing them as invalid: {next(iter(rejected.values()))}")
+    # rejected addresses are not cached, a later run sends them again
+    answered = {key: output for key, output in zip(lookup_keys, outputs) if not isinstance(output, Exception)}
+    looked_up = {**answered, **{key: {"o_valid": 0, "o_provider": provider.name} for key in rejected}}
+    dedup.resolve(looked_up, msg_id)
+    errors = {key: output for key, output in zip(lookup_keys, outputs) if isinstance(output, Exception) and key not in rejected}
+    if errors:
+        err = next(iter(errors.values()))
+        logger.error(f"{len(errors)} of {len(lookup_keys)} {provider.name} lookups failed: {err}")
+        provider_error = ProviderError(provider.name, err)
+        dedup.fail(list(errors), provider_error, msg_id)
+        if cache is not None:
+            cache.put_many(get_answer_cache_keys(answered, key_texts))
+        raise provider_error from err
+    # addresses looked up for an earlier batch, they fail with the error of the batch that claimed them
+    try:
+        waited = dedup.wait(set(misses).difference(lookup_keys), msg_id)
+    except ProviderError:
+        raise
+    except Exception as err:
+        raise ProviderError(provider.name, err) from err
+    outputs = {**cached, **looked_up, **waited}
+    builder = result_builder.ResultBuilder(capacity=len(message_batch))
+    invalid_addresses = 0
+    for i, (message, text, key) in enumerate(zip(message_batch, texts, keys)):
+        output = outputs[key]
+        if not output["o_valid"]:
+            invalid_addresses += 1
+        input = {
+            "i_input_msg_id": msg_id,
+            "i_batch_index": i,
+            # a row without an id is written with an empty id rather than failing the message
+            "i_input_id": message.get('source_id'),
+            "i_full_addr_txt": text
+        }
+        builder.append({**input, **output})
+    writer.write(builder.to_table())
+    if cache is not None:
+        cache.put_many(get_answer_cache_keys(answered, key_texts))
+    counts = {"addresses": len(builder), "cached": len(cached), "looked_up": len(looked_up), "invalid": invalid_addresses}
+    logger.info(f"Total/Cached/Looked up/Invalid addresses in this batch:{counts['addresses']}/{counts['cached']}/{counts['looked_up']}/{counts['invalid']}")
+    return counts
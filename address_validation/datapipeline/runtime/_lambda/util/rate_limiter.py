@@ -0,0 +1,112 @@
+"""
+Adaptive(AIMD) rate limiter for vendor api calls, shared by threads and asyncio tasks
+"""
+import asyncio
+import threading
+import time
+
+# the rate is multiplied by this on a throttle
+DEFAULT_DECREASE_FACTOR = 0.5
+# share of the ceiling added to the rate on each successful call
+DEFAULT_INCREASE_SHARE = 0.02
+# share of the ceiling the rate never goes below
+DEFAULT_MIN_SHARE = 0.05
+# throttles within this many seconds of a cut come from the same burst and do not cut the rate again
+DEFAULT_DECREASE_COOLDOWN_SECONDS = 1.0
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket of burst tokens refilled at rate tokens per second, rate stays between min_rate and max_rate
+    """
+    def __init__(self, max_rate: float, initial_rate: float=None, min_rate: float=None, burst: float=None, increase: float=None,
+                 decrease_factor: float=DEFAULT_DECREASE_FACTOR, decrease_cooldown: float=DEFAULT_DECREASE_COOLDOWN_SECONDS, clock=time.monotonic):
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate or self.max_rate * DEFAULT_MIN_SHARE)
+        self.rate = float(initial_rate or self.max_rate)
+        self.burst = float(burst or self.max_rate)
+        self.increase = float(increase or self.max_rate * DEFAULT_INCREASE_SHARE)
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated_at = clock()
+        self.last_decrease_at = None
+        self.throttle_count = 0
+        self.wait_seconds = 0.0
+        self.lock = threading.Lock()
+
+    # add the tokens refilled since the last update, called with the lock held
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, tokens: float=1) -> float:
+        """
+        Takes the tokens and returns the seconds to wait before using them
+        """
+        with self.lock:
+            self.refill(self.clock())
+            self.tokens -= tokens
+            wait = max(0.0, -self.tokens / self.rate)
+            self.wait_seconds += wait
+            return wait
+
+    def acquire(self, tokens: float=1) -> float:
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: float=1) -> float:
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_success(self) -> None:
+        with self.lock:
+            self.refill(self.clock())
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self) -> None:
+        """
+        Cuts the rate and empties the bucket so the callers waiting on it slow down right away
+        """
+        with self.lock:
+            now = self.clock()
+            self.throttle_count += 1
+            if self.last_decrease_at is not None and now - self.last_decrease_at < self.decrease_cooldown:
+                return
+            self.refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.tokens = min(self.tokens, 0.0)
+            self.last_decrease_at = now
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the current rate and the throttles and wait seconds since the last call
+        """
+        with self.lock:
+            metrics = {
+                "RateLimit": self.rate,
+                "RateLimitThrottles": self.throttle_count,
+                "RateLimitWaitSeconds": self.wait_seconds
+            }
+            self.throttle_count = 0
+            self.wait_seconds = 0.0
+            return metrics
+
+# limiters shared by the invocations of a warm container, so the learned rate is kept between them
+shared_rate_limiters = {}
+shared_rate_limiters_lock = threading.Lock()
+
+def get_shared_rate_limiter(name: str, max_rate: float) -> AdaptiveRateLimiter:
+    """
+    Returns the limiter of the name, a new one if there is none or its ceiling changed
+    """
+    with shared_rate_limiters_lock:
+        limiter = shared_rate_limiters.get(name)
+        if limiter is None or limiter.max_rate != float(max_rate):
+            limiter = AdaptiveRateLimiter(max_rate)
+            shared_rate_limiters[name] = limiter
+        return limiter
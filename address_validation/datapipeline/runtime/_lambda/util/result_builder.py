@@ -0,0 +1,67 @@
+"""
+Builds the validation output rows of a batch in to one arrow table with the output schema of all the validators
+"""
+import math
+import pyarrow as pa
+
+# output schema of all the validators, output fields of invalid addresses are null
+RESULT_SCHEMA = pa.schema([
+    ("i_input_msg_id", pa.string()),
+    ("i_batch_index", pa.int64()),
+    ("i_input_id", pa.string()),
+    ("i_full_addr_txt", pa.string()),
+    ("o_street_address1", pa.string()),
+    ("o_street_address2", pa.string()),
+    ("o_city", pa.string()),
+    ("o_state_code", pa.string()),
+    ("o_full_postal_code", pa.string()),
+    ("o_country", pa.string()),
+    ("o_external_addr_id", pa.string()),
+    ("o_valid", pa.int64()),
+    # the provider that answered, the hedge provider when it answered before the primary
+    ("o_provider", pa.string()),
+])
+
+# column values as the arrow type of the field, strings for ids read as numbers and None for NaN
+def to_column_value(value, is_string: bool):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if is_string and not isinstance(value, str):
+        return str(value)
+    return value
+
+class ResultBuilder:
+    """
+    Collects output rows column by column, missing columns are null and keys outside the schema are ignored
+    """
+    def __init__(self, capacity: int=0, schema: pa.Schema=RESULT_SCHEMA):
+        self.schema = schema
+        self.capacity = capacity
+        self.columns = {name: [None] * capacity for name in schema.names}
+        # (name, column, is_string) of the fields, resolved once instead of on every append
+        self.fields = [(field.name, self.columns[field.name], pa.types.is_string(field.type)) for field in schema]
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def grow(self) -> None:
+        extra = max(self.capacity, 16)
+        for column in self.columns.values():
+            column.extend([None] * extra)
+        self.capacity += extra
+
+    def append(self, row: dict) -> None:
+        if self.size == self.capacity:
+            self.grow()
+        for name, column, is_string in self.fields:
+            column[self.size] = to_column_value(row.get(name), is_string)
+        self.size += 1
+
+    def to_table(self) -> pa.Table:
+        arrays = [pa.array(self.columns[field.name][:self.size], type=field.type) for field in self.schema]
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    # dataframe of the table for the awswrangler writers
+    def to_pandas(self):
+        return self.to_table().to_pandas()
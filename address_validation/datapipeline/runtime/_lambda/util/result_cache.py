@@ -0,0 +1,150 @@
+"""
+Cache of address validation results, keyed by the provider and the normalized address text
+"""
+import json
+import re
+import time
+import hashlib
+import logging
+import threading
+import boto3
+
+# set logging
+logger = logging.getLogger()
+
+DEFAULT_TTL_DAYS = 30
+# batch limits of BatchGetItem and BatchWriteItem
+BATCH_GET_MAX_KEYS = 100
+BATCH_WRITE_MAX_ITEMS = 25
+# retries of unprocessed keys and items returned when the table is throttled
+MAX_UNPROCESSED_RETRIES = 5
+UNPROCESSED_RETRY_BASE_SECONDS = 0.05
+
+# upper case text without punctuation and repeated white space, so formatting differences share a cache entry
+def normalize_address(address_text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s#]", " ", str(address_text).upper()).split())
+
+def get_cache_key(provider: str, address_text: str) -> str:
+    return hashlib.sha256(f"{provider}|{normalize_address(address_text)}".encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """
+    Counts the cache hits and misses of the keys looked up
+    subclasses implement read_items(keys) -> dict and write_items(results: dict)
+    """
+    def __init__(self, ttl_days: float=DEFAULT_TTL_DAYS, clock=time.time):
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Returns the cached result of the keys found, a failed read counts all the keys as misses
+        """
+        try:
+            found = self.read_items(list(dict.fromkeys(keys))) if keys else {}
+        except Exception as err:
+            logger.error(f"Error reading the result cache: {err}")
+            found = {}
+        hits = sum(1 for key in keys if key in found)
+        with self.lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, results: dict) -> None:
+        """
+        Stores the results of the keys, a failed write is logged and the results are validated again next time
+        """
+        if not results:
+            return
+        try:
+            self.write_items(results)
+        except Exception as err:
+            logger.error(f"Error writing the result cache: {err}")
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the hits, misses and hit rate in percent since the last call
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            metrics = {
+                "CacheHits": self.hits,
+                "CacheMisses": self.misses,
+                "CacheHitRate": 100.0 * self.hits / lookups if lookups else 0.0
+            }
+            self.hits = 0
+            self.misses = 0
+            return metrics
+
+class InMemoryResultCache(ResultCache):
+    """
+    Result cache of the current process, for local runs and tests
+    """
+    def __init__(self, ttl_days: float=DEFAULT_TTL_DAYS, clock=time.time):
+        super().__init__(ttl_days, clock)
+        self.items = {}
+
+    def read_items(self, keys: list) -> dict:
+        now = self.clock()
+        return {key: self.items[key][0] for key in keys if key in self.items and self.items[key][1] > now}
+
+    def write_items(self, results: dict) -> None:
+        expires_at = self.clock() + self.ttl_seconds
+        self.items.update({key: (result, expires_at) for key, result in results.items()})
+
+class DynamoDBResultCache(ResultCache):
+    """
+    Result cache in a DynamoDB table with the string partition key cache_key and the TTL attribute expires_at
+    """
+    def __init__(self, table_name: str, ttl_days: float=DEFAULT_TTL_DAYS, boto3_session=None, clock=time.time):
+        super().__init__(ttl_days, clock)
+        self.table_name = table_name
+        self.dynamodb_client = (boto3_session or boto3.session.Session()).client("dynamodb")
+
+    def read_items(self, keys: list) -> dict:
+        now = self.clock()
+        found = {}
+        for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+            request = {self.table_name: {"Keys": [{"cache_key": {"S": key}} for key in keys[start:start + BATCH_GET_MAX_KEYS]]}}
+            for attempt in range(MAX_UNPROCESSED_RETRIES + 1):
+                response = self.dynamodb_client.batch_get_item(RequestItems=request)
+                for item in response.get("Responses", {}).get(self.table_name, []):
+                    if float(item["expires_at"]["N"]) > now:
+                        found[item["cache_key"]["S"]] = json.loads(item["result"]["S"])
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+                time.sleep(UNPROCESSED_RETRY_BASE_SECONDS * 2 ** attempt)
+            else:
+                logger.warning("result cache keys left unprocessed, they are counted as misses")
+        return found
+
+    def write_items(self, results: dict) -> None:
+        expires_at = str(int(self.clock() + self.ttl_seconds))
+        requests = [
+            {"PutRequest": {"Item": {
+                "cache_key": {"S": key},
+                "result": {"S": json.dumps(result)},
+                "expires_at": {"N": expires_at}
+            }}}
+            for key, result in results.items()
+        ]
+        for start in range(0, len(requests), BATCH_WRITE_MAX_ITEMS):
+            request = {self.table_name: requests[start:start + BATCH_WRITE_MAX_ITEMS]}
+            for attempt in range(MAX_UNPROCESSED_RETRIES + 1):
+                request = self.dynamodb_client.batch_write_item(RequestItems=request).get("UnprocessedItems")
+                if not request:
+                    break
+                time.sleep(UNPROCESSED_RETRY_BASE_SECONDS * 2 ** attempt)
+            else:
+                logger.warning("result cache items left unprocessed, they are validated again next time")
+
+# cache of the validators, None if no cache_table is configured
+def build_result_cache(config: dict, boto3_session=None):
+    if not config.get("cache_table"):
+        return None
+    return DynamoDBResultCache(config["cache_table"], float(config.get("cache_ttl_days", DEFAULT_TTL_DAYS)), boto3_session)
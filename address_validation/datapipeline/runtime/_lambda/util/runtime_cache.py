@@ -0,0 +1,145 @@
+"""
+Cache of the configuration, secrets and SDK clients of a warm lambda container or a long glue job
+"""
+import copy
+import time
+import logging
+import threading
+import boto3
+try:
+    from util import utils
+except ImportError:
+    import utils
+
+# set logging
+logger = logging.getLogger()
+
+DEFAULT_CONFIG_TTL_SECONDS = 300
+DEFAULT_SECRET_TTL_SECONDS = 3600
+# share of the ttl left when the background refresh starts
+DEFAULT_REFRESH_AHEAD_SHARE = 0.2
+# wait after a failed background refresh before the next one
+REFRESH_RETRY_SECONDS = 10
+
+class CacheEntry:
+    """
+    Value of one key and the loader that loads it again
+    """
+    def __init__(self, loader, ttl_seconds: float=None):
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self.value = None
+        self.loaded = False
+        self.expires_at = None
+        self.refresh_at = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+class RuntimeCache:
+    """
+    Values by key with a ttl in seconds, refreshed in the background before they expire
+    """
+    def __init__(self, refresh_ahead_share: float=DEFAULT_REFRESH_AHEAD_SHARE, clock=time.monotonic):
+        self.refresh_ahead_share = refresh_ahead_share
+        self.clock = clock
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, loader, ttl_seconds: float=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = CacheEntry(loader, ttl_seconds)
+        now = self.clock()
+        if not entry.loaded or (entry.expires_at is not None and now >= entry.expires_at):
+            with entry.lock:
+                # another caller may have loaded it while this one waited
+                if not entry.loaded or (entry.expires_at is not None and self.clock() >= entry.expires_at):
+                    self.load(entry)
+            return entry.value
+        value = entry.value
+        if entry.refresh_at is not None and now >= entry.refresh_at and not entry.refreshing:
+            entry.refreshing = True
+            threading.Thread(target=self.refresh, args=(key, entry), daemon=True).start()
+        return value
+
+    # loads the value of the entry, called with the entry lock held
+    def load(self, entry: CacheEntry) -> None:
+        value = entry.loader()
+        now = self.clock()
+        entry.value = value
+        entry.loaded = True
+        if entry.ttl_seconds is not None:
+            entry.expires_at = now + entry.ttl_seconds
+            entry.refresh_at = entry.expires_at - entry.ttl_seconds * self.refresh_ahead_share
+        entry.refreshing = False
+
+    # background refresh of a value before it expires
+    def refresh(self, key, entry: CacheEntry) -> None:
+        try:
+            with entry.lock:
+                self.load(entry)
+        except Exception as err:
+            logger.warning(f"Error refreshing {key}, the cached value is used until it expires: {err}")
+            entry.refresh_at = self.clock() + REFRESH_RETRY_SECONDS
+            entry.refreshing = False
+
+    def invalidate(self, key=None) -> None:
+        """
+        Drops the value of the key, or all the values when key is None. The next get loads it again
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+# values of the current container or job
+runtime_cache = RuntimeCache()
+# boto3 sessions are not thread safe, clients are built one at a time
+client_lock = threading.Lock()
+
+# application configuration from the SSM parameter, a copy the caller can change
+def get_app_configuration(param_name: str, cli_profile: str=None, ttl_seconds: float=DEFAULT_CONFIG_TTL_SECONDS) -> dict:
+    config = runtime_cache.get(("ssm", param_name, cli_profile), lambda: utils.get_app_configuration(param_name, cli_profile), ttl_seconds)
+    return copy.deepcopy(config)
+
+def get_secret_key(config: dict, cli_profile: str=None) -> tuple:
+    return ("secret", config["secret_name"], config["region_name"], cli_profile)
+
+# secret of the configuration from Secrets Manager
+def get_secret_credentials(config: dict, cli_profile: str=None, ttl_seconds: float=DEFAULT_SECRET_TTL_SECONDS) -> dict:
+    secret = runtime_cache.get(
+        get_secret_key(config, cli_profile),
+        lambda: utils.get_secret_credentials(config["secret_name"], config["region_name"], cli_profile),
+        ttl_seconds
+    )
+    return dict(secret)
+
+# add the cached secrets to the config, like utils.add_secrets_to_config
+def add_secrets_to_config(config: dict, cli_profile: str=None) -> dict:
+    config["secrets"] = get_secret_credentials(config, cli_profile)
+    return config
+
+# load the secrets of the config again, after the vendor rejected the cached credentials
+def refresh_secrets(config: dict, cli_profile: str=None) -> dict:
+    logger.warning(f"Reloading secret {config['secret_name']} after an authentication failure")
+    runtime_cache.invalidate(get_secret_key(config, cli_profile))
+    return add_secrets_to_config(config, cli_profile)
+
+def get_boto3_session(cli_profile: str=None):
+    return runtime_cache.get(("session", cli_profile), lambda: boto3.session.Session(profile_name=cli_profile))
+
+# boto3 client of the cached session, clients built with a botocore config need their own name
+def get_client(service_name: str, cli_profile: str=None, config=None, name: str=None):
+    def build_client():
+        with client_lock:
+            return get_boto3_session(cli_profile).client(service_name, config=config)
+    return runtime_cache.get(("client", name or service_name, cli_profile), build_client)
+
+# drop the session and clients of the profile, after AWS rejected their credentials
+def invalidate_clients(cli_profile: str=None) -> None:
+    with runtime_cache.lock:
+        keys = [key for key in runtime_cache.entries if key[0] in ("session", "client") and key[-1] == cli_profile]
+    for key in keys:
+        runtime_cache.invalidate(key)
@@ -0,0 +1,336 @@
+"""
+Streaming reader of the projected columns of csv data files on S3, built on the pyarrow streaming csv reader
+"""
+import boto3
+import csv
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# set logging
+logger = logging.getLogger()
+
+# bytes of csv parsed per record batch
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+# bytes read to find the header row
+HEADER_READ_SIZE = 64 * 1024
+# pandas default missing value markers plus the na_values=['null', 'none'] the awswrangler reader used
+DEFAULT_NULL_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null", "none"
+]
+# compression of the object inferred from the key suffix
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".gzip": "gzip", ".bz2": "bz2", ".zst": "zstd"}
+# bytes of each planned byte range of an uncompressed csv object
+DEFAULT_RANGE_SIZE = 128 * 1024 * 1024
+# bytes read at a time when looking for the end of the row a range boundary falls in
+BOUNDARY_READ_SIZE = 64 * 1024
+# number of byte ranges read at the same time
+DEFAULT_RANGE_CONCURRENCY = 4
+# bytes at the start of an object looked at for quoted values with newlines
+QUOTED_NEWLINE_SAMPLE_SIZE = 1024 * 1024
+
+# list the csv objects of the key, the key is either a single object or a prefix(folder) of part files
+def list_s3_csv_objects(bucket: str, key: str, boto3_session=None) -> list:
+    """
+    Returns the list of object keys to read, sorted by key
+    A key that is an object is returned as is, else all the non empty objects under the prefix
+    """
+    session = boto3_session or boto3.session.Session()
+    s3_client = session.client("s3")
+    paginator = s3_client.get_paginator("list_objects_v2")
+    keys = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=key):
+        for obj in page.get("Contents", []):
+            if obj["Key"] == key:
+                return [key]
+            # skip folder markers and empty objects like _SUCCESS files
+            if obj["Size"] > 0 and not obj["Key"].endswith("/"):
+                keys.append(obj["Key"])
+    return sorted(keys)
+
+def get_compression(key: str) -> str:
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if key.lower().endswith(suffix):
+            return compression
+    return None
+
+# schema map fields with few distinct values, read as dictionary encoded columns
+DICTIONARY_SCHEMA_FIELDS = ("state", "country")
+
+# input columns of the low cardinality schema map fields
+def get_dictionary_columns(schema_mapping: dict) -> list:
+    return [schema_mapping[field] for field in DICTIONARY_SCHEMA_FIELDS if field in schema_mapping]
+
+# column types for the projected columns, dictionary encoding for the low cardinality ones
+def get_column_types(columns: list, dictionary_columns: list=None) -> dict:
+    """
+    All projected columns are read as strings, which also keeps the leading zeros of postal codes
+    dictionary_columns (for example state and country) are dictionary encoded
+    """
+    dictionary_columns = set(dictionary_columns or [])
+    return {
+        column: pa.dictionary(pa.int32(), pa.string()) if column in dictionary_columns else pa.string()
+        for column in columns
+    }
+
+# open the s3 object as a pyarrow input stream
+def open_s3_input_stream(bucket: str, key: str, boto3_session=None, byte_range: str=None):
+    session = boto3_session or boto3.session.Session()
+    s3_client = session.client("s3")
+    request = {"Bucket": bucket, "Key": key}
+    if byte_range:
+        request["Range"] = byte_range
+    body = s3_client.get_object(**request)["Body"]
+    stream = pa.PythonFile(body, mode="r")
+    compression = get_compression(key)
+    if compression:
+        stream = pa.CompressedInputStream(stream, compression)
+    return stream
+
+# read the header row of a csv object
+def read_s3_csv_header(bucket: str, key: str, delimiter: str=",", encoding: str="utf-8", boto3_session=None, max_header_size: int=HEADER_READ_SIZE) -> list:
+    """
+    Returns the column names of the csv object from its first line
+    """
+    stream = open_s3_input_stream(bucket, key, boto3_session)
+    try:
+        head = stream.read(max_header_size)
+    finally:
+        stream.close()
+    first_line = head.split(b"\n", 1)[0].rstrip(b"\r").decode(encoding)
+    return next(csv.reader([first_line], delimiter=delimiter))
+
+# read a csv stream as an iterator of record batches
+def read_csv_batches(stream, columns: list, dictionary_columns: list=None, delimiter: str=",", encoding: str="utf-8", block_size: int=DEFAULT_BLOCK_SIZE, limit_rows: int=None, column_names: list=None,
+                     newlines_in_values: bool=False) -> iter:
+    """
+    Yields pyarrow record batches of the projected columns, newlines_in_values parses quoted values with newlines
+    """
+    read_options = pa_csv.ReadOptions(
+        block_size=block_size,
+        encoding=encoding,
+        column_names=column_names
+    )
+    parse_options = pa_csv.ParseOptions(delimiter=delimiter, newlines_in_values=newlines_in_values)
+    convert_options = pa_csv.ConvertOptions(
+        include_columns=columns,
+        include_missing_columns=True,
+        column_types=get_column_types(columns, dictionary_columns),
+        null_values=DEFAULT_NULL_VALUES,
+        strings_can_be_null=True,
+    )
+    reader = pa_csv.open_csv(stream, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+    rows_read = 0
+    for batch in reader:
+        if limit_rows is not None and rows_read + batch.num_rows >= limit_rows:
+            yield batch.slice(0, limit_rows - rows_read)
+            return
+        rows_read += batch.num_rows
+        yield batch
+
+# read all the csv objects of the key as record batches
+def read_s3_csv_batches(bucket: str, key: str, columns: list=None, dictionary_columns: list=None, delimiter: str=",", encoding: str="utf-8", limit_rows: int=None, block_size: int=DEFAULT_BLOCK_SIZE, cli_profile: str=None) -> iter:
+    """
+    Streams every csv object of the key(an object or a prefix of part files) and yields record batches
+    columns None reads all the columns of the header
+    """
+    session = boto3.session.Session(profile_name=cli_profile)
+    remaining = limit_rows
+    for object_key in list_s3_csv_objects(bucket, key, session):
+        logger.info(f"reading s3://{bucket}/{object_key}")
+        object_columns = columns or read_s3_csv_header(bucket, object_key, delimiter, encoding, session)
+        stream = open_s3_input_stream(bucket, object_key, session)
+        for batch in read_csv_batches(stream, object_columns, dictionary_columns, delimiter, encoding, block_size, remaining):
+            if remaining is not None:
+                remaining -= batch.num_rows
+            yield batch
+        if remaining is not None and remaining <= 0:
+            return
+
+# whether a quoted value of the csv data holds a newline, "" inside a quoted value flips the quote state twice
+def has_quoted_newline(data: bytes, quote_char: bytes=b'"') -> bool:
+    in_quotes = False
+    for part in data.split(quote_char):
+        if in_quotes and b"\n" in part:
+            return True
+        in_quotes = not in_quotes
+    return False
+
+# offset of the first newline at or after offset, the start of the next row unless the newline is inside a quoted value
+# the quote state at offset is not known, so files with quoted newlines are planned as one range
+def find_row_boundary(s3_client, bucket: str, key: str, offset: int, object_size: int) -> int:
+    """
+    Returns the offset of the first row starting at or after offset, object_size when there is none
+    """
+    position = offset - 1
+    while position < object_size:
+        last = min(position + BOUNDARY_READ_SIZE, object_size) - 1
+        data = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={position}-{last}")["Body"].read()
+        index = data.find(b"\n")
+        if index >= 0:
+            return position + index + 1
+        position = last + 1
+    return object_size
+
+# plan the csv objects of the key as newline aligned byte ranges
+def plan_s3_csv_ranges(bucket: str, key: str, range_size: int=DEFAULT_RANGE_SIZE, delimiter: str=",", encoding: str="utf-8", boto3_session=None,
+                       newlines_in_values: bool=None) -> list:
+    """
+    Returns a list of json serializable byte ranges {bucket, key, start, end, column_names} that cover every data row once
+    An object with quoted newlines is one range read with newlines_in_values, newlines_in_values None looks for them
+    in the first QUOTED_NEWLINE_SAMPLE_SIZE bytes, so set it to True for files with quoted newlines further in
+    """
+    session = boto3_session or boto3.session.Session()
+    s3_client = session.client("s3")
+    ranges = []
+    for object_key in list_s3_csv_objects(bucket, key, session):
+        if get_compression(object_key):
+            ranges.append({"bucket": bucket, "key": object_key, "start": 0, "end": None, "column_names": None})
+            continue
+        object_size = s3_client.head_object(Bucket=bucket, Key=object_key)["ContentLength"]
+        quoted_newlines = newlines_in_values
+        if quoted_newlines is None:
+            sample = s3_client.get_object(Bucket=bucket, Key=object_key, Range=f"bytes=0-{QUOTED_NEWLINE_SAMPLE_SIZE - 1}")["Body"].read()
+            quoted_newlines = has_quoted_newline(sample)
+        if quoted_newlines:
+            logger.info(f"s3://{bucket}/{object_key} has quoted newlines, reading it as one range")
+            ranges.append({"bucket": bucket, "key": object_key, "start": 0, "end": None, "column_names": None, "newlines_in_values": True})
+            continue
+        column_names = read_s3_csv_header(bucket, object_key, delimiter, encoding, session)
+        # the first range starts after the header row
+        start = find_row_boundary(s3_client, bucket, object_key, 1, object_size)
+        while start < object_size:
+            end = object_size
+            if start + range_size < object_size:
+                end = find_row_boundary(s3_client, bucket, object_key, start + range_size, object_size)
+            ranges.append({"bucket": bucket, "key": object_key, "start": start, "end": end, "column_names": column_names})
+            start = end
+    logger.info(f"planned {len(ranges)} byte ranges for s3://{bucket}/{key}")
+    return ranges
+
+# read one planned byte range as record batches
+def read_s3_csv_range_batches(byte_range: dict, columns: list=None, dictionary_columns: list=None, delimiter: str=",", encoding: str="utf-8", limit_rows: int=None, block_size: int=DEFAULT_BLOCK_SIZE, boto3_session=None) -> iter:
+    session = boto3_session or boto3.session.Session()
+    bucket, key = byte_range["bucket"], byte_range["key"]
+    http_range = None
+    if byte_range["end"] is not None:
+        http_range = f"bytes={byte_range['start']}-{byte_range['end'] - 1}"
+    column_names = byte_range["column_names"]
+    columns = columns or column_names or read_s3_csv_header(bucket, key, delimiter, encoding, session)
+    stream = open_s3_input_stream(bucket, key, session, http_range)
+    yield from read_csv_batches(stream, columns, dictionary_columns, delimiter, encoding, block_size, limit_rows, column_names,
+                                byte_range.get("newlines_in_values", False))
+
+# convert arrow data to the pandas chunk shape used by the producer and validators
+def to_pandas(table):
+    """
+    Returns a pandas dataframe with missing values as NaN in object columns,
+    the same shape as the chunks read by awswrangler
+    """
+    df = table.to_pandas()
+    return df.astype(object).where(df.notna(), float("nan"))
+
+# regroup record batches in to dataframes of chunk_size rows
+def iter_dataframe_chunks(batches: iter, chunk_size: int) -> iter:
+    pending = []
+    pending_rows = 0
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        if pending_rows < chunk_size:
+            continue
+        table = pa.Table.from_batches(pending)
+        offset = 0
+        while pending_rows - offset >= chunk_size:
+            yield to_pandas(table.slice(offset, chunk_size))
+            offset += chunk_size
+        pending = table.slice(offset).to_batches()
+        pending_rows -= offset
+    if pending_rows:
+        yield to_pandas(pa.Table.from_batches(pending))
+
+# drop in replacement of the awswrangler chunked reader
+def read_s3_file_projected(bucket: str, key: str, chunk_size: int=100, delimiter: str=",", encoding: str="utf-8", limit_rows: int=None, cli_profile: str=None, columns: list=None, dictionary_columns: list=None) -> iter:
+    """
+    Returns an iterator of dataframes of chunk_size rows with only the projected columns
+    """
+    batches = read_s3_csv_batches(bucket, key, columns, dictionary_columns, delimiter, encoding, limit_rows, cli_profile=cli_profile)
+    return iter_dataframe_chunks(batches, chunk_size)
+
+# dataframes of chunk_size rows of one planned byte range
+def read_s3_range_projected(byte_range: dict, chunk_size: int=100, delimiter: str=",", encoding: str="utf-8", limit_rows: int=None, cli_profile: str=None, columns: list=None, dictionary_columns: list=None) -> iter:
+    session = boto3.session.Session(profile_name=cli_profile)
+    batches = read_s3_csv_range_batches(byte_range, columns, dictionary_columns, delimiter, encoding, limit_rows, boto3_session=session)
+    return iter_dataframe_chunks(batches, chunk_size)
+
+# puts the item unless the reads were stopped, returns False if stopped
+def put_unless_stopped(chunk_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            chunk_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+# read the ranges with a pool of reader threads and yield their dataframes as they arrive
+def iter_ranges_parallel(ranges: list, read_range, concurrency: int=DEFAULT_RANGE_CONCURRENCY, limit_rows: int=None) -> iter:
+    """
+    read_range(byte_range) returns the iterator of dataframes of a range, the order of rows across ranges is not kept
+    """
+    chunk_queue = queue.Queue(maxsize=2 * concurrency)
+    stop = threading.Event()
+    range_done = object()
+
+    def reader(byte_range: dict) -> None:
+        try:
+            if stop.is_set():
+                return
+            for df_chunk in read_range(byte_range):
+                if not put_unless_stopped(chunk_queue, df_chunk, stop):
+                    return
+        except Exception as error:
+            logger.error(f"Error reading byte range {byte_range}: {error}")
+            put_unless_stopped(chunk_queue, error, stop)
+        finally:
+            put_unless_stopped(chunk_queue, range_done, stop)
+
+    rows_read = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for byte_range in ranges:
+            executor.submit(reader, byte_range)
+        try:
+            ranges_left = len(ranges)
+            while ranges_left:
+                item = chunk_queue.get()
+                if item is range_done:
+                    ranges_left -= 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                if limit_rows is not None and rows_read + len(item) >= limit_rows:
+                    yield item.iloc[:limit_rows - rows_read]
+                    return
+                rows_read += len(item)
+                yield item
+        finally:
+            # also runs when the consumer closes the iterator early
+            stop.set()
+
+# read the key with its byte ranges read in parallel
+def read_s3_file_parallel(bucket: str, key: str, chunk_size: int=100, delimiter: str=",", encoding: str="utf-8", limit_rows: int=None, cli_profile: str=None, columns: list=None, dictionary_columns: list=None, concurrency: int=DEFAULT_RANGE_CONCURRENCY, range_size: int=DEFAULT_RANGE_SIZE) -> iter:
+    """
+    Returns an iterator of dataframes of up to chunk_size rows, read concurrency byte ranges at a time
+    """
+    session = boto3.session.Session(profile_name=cli_profile)
+    ranges = plan_s3_csv_ranges(bucket, key, range_size, delimiter, encoding, session)
+    read_range = partial(read_s3_range_projected, chunk_size=chunk_size, delimiter=delimiter, encoding=encoding,
+                         cli_profile=cli_profile, columns=columns, dictionary_columns=dictionary_columns)
+    return iter_ranges_parallel(ranges, read_range, concurrency, limit_rows)
@@ -0,0 +1,108 @@
+"""
+Validation of the partitions of a spark glue job, mapInPandas runs validate_frames on the python workers of the executors
+"""
+import copy
+import json
+import logging
+import awswrangler as wr
+import pyarrow as pa
+try:
+    from util import result_builder, result_cache, runtime_cache, address_dedup, address_template, output_writer, providers, hedging
+except ImportError:
+    import result_builder
+    import result_cache
+    import runtime_cache
+    import address_dedup
+    import address_template
+    import output_writer
+    import providers
+    import hedging
+
+# set logging
+logger = logging.getLogger()
+
+# spark sql types of the arrow types of the output schema
+SPARK_TYPES = {
+    pa.string(): "string",
+    pa.int64(): "bigint"
+}
+# errors of a batch that are logged and skipped like in the python shell job, others fail the task so spark retries it
+# the skipped rows are counted so the job can fail once the other batches are validated
+SKIPPED_ERRORS = (providers.ProviderError,)
+
+# ddl schema of the output frames, like "i_input_msg_id string, i_batch_index bigint, ..."
+def get_spark_schema(schema: pa.Schema=result_builder.RESULT_SCHEMA) -> str:
+    return ", ".join(f"{field.name} {SPARK_TYPES[field.type]}" for field in schema)
+
+# tasks running at the same time, one per executor core up to the number of partitions
+def get_concurrent_tasks(partitions: int, parallelism: int) -> int:
+    return max(1, min(partitions, parallelism))
+
+def get_task_config(config: dict, concurrent_tasks: int) -> dict:
+    """
+    Returns the configuration of the tasks, with the rate limit of the job split across the concurrent tasks
+    """
+    task_config = copy.deepcopy(config)
+    if config.get("rate_limit_per_second"):
+        task_config["rate_limit_per_second"] = float(config["rate_limit_per_second"]) / concurrent_tasks
+    return task_config
+
+# provider of the python worker, built by its first task. the key leaves out the secrets
+def get_worker_provider(config: dict, cli_profile: str=None) -> providers.ValidationProvider:
+    settings = json.dumps({key: value for key, value in config.items() if key != "secrets"}, sort_keys=True, default=str)
+    return runtime_cache.runtime_cache.get(("spark_provider", settings, cli_profile), lambda: hedging.build_provider(config, cli_profile))
+
+class TableCollector:
+    """
+    Output writer that keeps the tables written in memory, the output of one record batch
+    """
+    def __init__(self):
+        self.tables = []
+
+    def write(self, table: pa.Table) -> None:
+        self.tables.append(table)
+
+    def to_frame(self):
+        return pa.concat_tables(self.tables).to_pandas() if self.tables else None
+
+def validate_frames(frames: iter, config: dict, task_id: str, cli_profile: str=None, provider: providers.ValidationProvider=None,
+                    skipped_rows=None) -> iter:
+    """
+    Yields the output frame of each pandas frame of a partition, the rows of a skipped frame are added to the skipped_rows accumulator
+    """
+    provider = provider or get_worker_provider(config, cli_profile)
+    cache = result_cache.build_result_cache(config, runtime_cache.get_boto3_session(cli_profile))
+    dedup = address_dedup.build_deduplicator(config)
+    for index, df in enumerate(frames):
+        if df.empty:
+            continue
+        msg_batch = address_template.add_address_text(df, config["schema_map"]).to_dict("records")
+        collector = TableCollector()
+        try:
+            providers.validate_message_batch(provider, config, msg_batch, f"{task_id}-{index}", collector, cache, dedup)
+        except SKIPPED_ERRORS as err:
+            logger.error(f"Validation failed for batch {index} of task {task_id}: {err}")
+            if skipped_rows is not None:
+                skipped_rows.add(len(df.index))
+            continue
+        frame = collector.to_frame()
+        if frame is not None:
+            yield frame
+
+# adds the partitions of the output written by spark to the output_database.output_table catalog table
+# partition_rows are the distinct values of the partition columns, failures are logged like register_output_partitions
+def register_dataset_partitions(config: dict, partition_rows: list, boto3_session=None) -> None:
+    if not config.get("output_database") or not config.get("output_table") or not partition_rows:
+        return
+    partition_cols = config.get("output_partition_cols", [])
+    prefix = config["s3_key"].replace(".", "-")
+    partitions_values = {}
+    for row in partition_rows:
+        values = [output_writer.get_partition_value(row[col]) for col in partition_cols]
+        partitions_values[f"s3://{config['s3_bucket']}/{output_writer.get_partition_path(prefix, partition_cols, values)}/"] = values
+    logger.info(f"Registering {len(partitions_values)} partitions in {config['output_database']}.{config['output_table']}")
+    try:
+        wr.catalog.add_parquet_partitions(config["output_database"], config["output_table"], partitions_values,
+                                          compression=output_writer.DEFAULT_COMPRESSION, boto3_session=boto3_session)
+    except Exception as err:
+        logger.error(f"Error registering the output partitions: {err}")
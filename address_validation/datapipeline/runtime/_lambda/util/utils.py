@@ -1,13 +1,35 @@
 import requests
 import json
 import os
+import uuid
+import gzip
+import base64
+import hashlib
+import time
+import threading
 import boto3
 import logging
+import awswrangler as wr
 from botocore.exceptions import ClientError
+try:
+    from util import address_template
+except ImportError:
+    import address_template
+# zstd compression of message envelopes is optional, gzip is always available
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # set logging
 logger = logging.getLogger()
 
+# version of the message envelope written by encode_message_envelope
+# version 1 is the plain json list of rows
+MESSAGE_ENVELOPE_VERSION = 2
+MESSAGE_LAYOUTS = ("columnar", "records")
+MESSAGE_COMPRESSIONS = ("none", "gzip", "zstd")
+
 # get sample configuration json
 def get_sample_configuration() -> dict:
     """
@@ -23,13 +45,22 @@ def get_sample_configuration() -> dict:
     }
     return config_dict
 
+# keep-alive session of each thread reused by make_http_post_request, requests sessions are not thread safe
+thread_resources = threading.local()
+DEFAULT_HTTP_TIMEOUT_SECONDS = 10
+
+def get_http_session() -> requests.Session:
+    if getattr(thread_resources, "http_session", None) is None:
+        thread_resources.http_session = requests.Session()
+    return thread_resources.http_session
+
 # make http post request to url with data, use this when your validation service do not have an python SDK
-def make_http_post_request(url, data):
+def make_http_post_request(url, data, timeout: float=DEFAULT_HTTP_TIMEOUT_SECONDS):
     """
-    Makes http post request to url with data
+    Makes http post request to url with data, over the keep-alive session of the thread
     """
     headers = {'Content-Type': 'application/json', 'charset': 'utf-8'}
-    response = requests.post(url, data=json.dumps(data), headers=headers)
+    response = get_http_session().post(url, data=json.dumps(data), headers=headers, timeout=timeout)
     logger.info(response.status_code)
     logger.info(response.text)
     return response
@@ -56,15 +87,9 @@ def sample_address_record_str():
 def get_address_data_string(address_data: dict, schema_mapping: dict) -> str:
     """
     Returns a concatenated string of address data
+    Formats one row, use util/address_template to format a chunk of rows
     """
-    address_data_string = ""
-    for key, value in schema_mapping.items():
-        if value in address_data.keys():
-            # print(key,value)
-            address_data_string += f"{address_data[value]} "
-    # print(address_data_string)
-    # TODO need a more elegant NaN cleanup solution
-    return address_data_string.replace("nan", "")
+    return address_template.get_address_template(schema_mapping).format(address_data)
 
 # return a sample address schema mapping
 def get_sample_address_schema_mapping() -> dict:
@@ -213,6 +238,181 @@ def split_msg_batch_into_batches(msg_batch: list, batch_size: int) -> list:
         batch_list.append(msg_batch[i:i+batch_size])
     return batch_list
 
+# write a batch of rows to the claim check staging prefix and return the pointer message body
+def write_claim_check_batch(df, bucket: str, prefix: str, boto3_session=None) -> str:
+    """
+    Writes the batch as a parquet object under the staging prefix and returns the
+    message body that points to it. Consumers use read_message_batch to load it back.
+    """
+    s3_uri = f"s3://{bucket}/{prefix.strip('/')}/{uuid.uuid4().hex}.parquet"
+    wr.s3.to_parquet(df, s3_uri, boto3_session=boto3_session)
+    logger.info(f"wrote claim check batch of {len(df.index)} rows to {s3_uri}")
+    return json.dumps({"claim_check": {"s3_uri": s3_uri, "row_count": len(df.index)}})
+
+# return the columns the producer ships: source_id and the columns named in the schema map
+def get_projected_columns(schema_mapping: dict) -> list:
+    """
+    Returns source_id followed by the input columns of the schema mapping, without duplicates
+    """
+    return list(dict.fromkeys(["source_id", *schema_mapping.values()]))
+
+# json values of a dataframe column with missing values as None
+def get_column_values(column) -> list:
+    return [None if missing else value for value, missing in zip(column.tolist(), column.isna().tolist())]
+
+# encode a batch of rows as a versioned message envelope
+def encode_message_envelope(df, layout: str="columnar", compression: str="none") -> str:
+    """
+    Returns the message body for the rows of the dataframe, in the columnar or records layout
+    """
+    if layout not in MESSAGE_LAYOUTS:
+        raise ValueError(f"invalid message layout {layout}. Valid values {'|'.join(MESSAGE_LAYOUTS)}")
+    columns = list(df.columns)
+    values = [get_column_values(df[column]) for column in columns]
+    if layout == "columnar":
+        payload = {"columns": columns, "data": values}
+    else:
+        payload = [dict(zip(columns, row)) for row in zip(*values)]
+
+    if compression != "none":
+        raw = json.dumps(payload, separators=(",", ":"), allow_nan=False).encode("utf-8")
+        payload = base64.b64encode(compress_payload(raw, compression)).decode("ascii")
+    envelope = {
+        "version": MESSAGE_ENVELOPE_VERSION,
+        "layout": layout,
+        "compression": compression,
+        "row_count": len(df.index),
+        "payload": payload
+    }
+    return json.dumps(envelope, separators=(",", ":"), allow_nan=False)
+
+def compress_payload(raw: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(raw)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd message compression needs the zstandard module")
+        return zstandard.ZstdCompressor().compress(raw)
+    raise ValueError(f"invalid message compression {compression}. Valid values {'|'.join(MESSAGE_COMPRESSIONS)}")
+
+def decompress_payload(raw: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(raw)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd message compression needs the zstandard module")
+        return zstandard.ZstdDecompressor().decompress(raw)
+    raise ValueError(f"invalid message compression {compression}. Valid values {'|'.join(MESSAGE_COMPRESSIONS)}")
+
+# decode a message envelope written by encode_message_envelope in to a list of row dicts
+def decode_message_envelope(envelope: dict) -> list:
+    """
+    Returns the rows of the envelope. Missing values are returned as NaN like the version 1 messages
+    """
+    version = envelope.get("version")
+    if version != MESSAGE_ENVELOPE_VERSION:
+        raise ValueError(f"unsupported message envelope version {version}")
+    payload = envelope["payload"]
+    compression = envelope.get("compression", "none")
+    if compression != "none":
+        payload = json.loads(decompress_payload(base64.b64decode(payload), compression))
+    if envelope["layout"] == "columnar":
+        rows = [dict(zip(payload["columns"], values)) for values in zip(*payload["data"])]
+    else:
+        rows = payload
+    nan = float("nan")
+    return [{key: nan if value is None else value for key, value in row.items()} for row in rows]
+
+# read the rows of an SQS message body, fetching the batch from S3 if the body is a claim check pointer
+def read_message_batch(message_body: str, boto3_session=None) -> list:
+    """
+    Returns the list of row dicts of a json list, claim check pointer or versioned envelope body
+    """
+    msg = json.loads(message_body)
+    if isinstance(msg, list):
+        return msg
+    if "claim_check" in msg:
+        s3_uri = msg["claim_check"]["s3_uri"]
+        logger.info(f"reading claim check batch from {s3_uri}")
+        df = wr.s3.read_parquet(s3_uri, boto3_session=boto3_session)
+        # missing values are NaN in the json message bodies, keep the same for parquet batches
+        df = df.astype(object).where(df.notna(), float("nan"))
+        return df.to_dict("records")
+    return decode_message_envelope(msg)
+
+# s3 uri of the producer checkpoint of an input key
+def get_checkpoint_uri(bucket: str, prefix: str, input_key: str) -> str:
+    key_hash = hashlib.sha256(input_key.encode("utf-8")).hexdigest()[:32]
+    return f"s3://{bucket}/{prefix.strip('/')}/{key_hash}.json"
+
+# version of the input objects under a key, changes when any of them is rewritten
+def get_s3_input_version(bucket: str, key: str, boto3_session=None) -> str:
+    """
+    Returns a hash of the keys and etags of the objects under the key(an object or a prefix)
+    A key that is an object is versioned by that object alone, like list_s3_csv_objects reads it, so foo.csv.bak does not change foo.csv
+    """
+    session = boto3_session or boto3.session.Session()
+    paginator = session.client("s3").get_paginator("list_objects_v2")
+    objects = [obj for page in paginator.paginate(Bucket=bucket, Prefix=key) for obj in page.get("Contents", [])]
+    objects = [obj for obj in objects if obj["Key"] == key] or objects
+    entries = sorted(f"{obj['Key']}:{obj['ETag']}" for obj in objects)
+    return hashlib.sha256("\n".join(entries).encode("utf-8")).hexdigest()
+
+# read a json checkpoint from s3, None if there is none
+def read_checkpoint(checkpoint_uri: str, boto3_session=None) -> dict:
+    session = boto3_session or boto3.session.Session()
+    bucket, key = checkpoint_uri[len("s3://"):].split("/", 1)
+    try:
+        body = session.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(body)
+
+# write a json checkpoint to s3
+def write_checkpoint(checkpoint_uri: str, checkpoint: dict, boto3_session=None) -> None:
+    session = boto3_session or boto3.session.Session()
+    bucket, key = checkpoint_uri[len("s3://"):].split("/", 1)
+    session.client("s3").put_object(Bucket=bucket, Key=key, Body=json.dumps(checkpoint).encode("utf-8"), ContentType="application/json")
+
+# partial batch response of an SQS triggered lambda, only the failed messages are retried
+def build_batch_item_failures(records: list, failed_msg_ids: set) -> dict:
+    """
+    Returns the batchItemFailures response for the failed message ids, in the order of the records
+    """
+    failures = [{"itemIdentifier": record['messageId']} for record in records if record['messageId'] in failed_msg_ids]
+    if failures:
+        logger.error(f"**{len(failures)} of {len(records)} messages failed and will be retried**")
+    return {"batchItemFailures": failures}
+
+# namespace of the pipeline metrics
+METRICS_NAMESPACE = "AddressValidation"
+
+# print metrics in the cloudwatch embedded metric format, cloudwatch logs turns the line in to metrics
+def log_emf_metrics(metrics: dict, dimensions: dict=None, units: dict=None, namespace: str=METRICS_NAMESPACE) -> str:
+    """
+    metrics maps metric names to values, units maps metric names to cloudwatch units(default None)
+    Printed to stdout as the line has to be plain json, returns the line
+    """
+    dimensions = dimensions or {}
+    units = units or {}
+    emf = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [list(dimensions.keys())],
+                "Metrics": [{"Name": name, "Unit": units.get(name, "None")} for name in metrics]
+            }]
+        },
+        **dimensions,
+        **metrics
+    }
+    line = json.dumps(emf)
+    print(line)
+    return line
+
 # take the s3 lambda file create event as input and return the s3 bucket and key
 def get_s3_bucket_and_key(event: dict) -> tuple:
     """
@@ -0,0 +1,78 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Compares the per row get_address_data_string the validators used with util/address_template
+Usage: python benchmarks/address_template_benchmark.py [--rows 100 10000 1000000]
+"""
+import argparse
+import pathlib
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import address_template, utils
+
+STREETS = ["Main St", "Nantucket Ave", "Fernando St", "Pine St", "Lake Nanette Rd"]
+
+# rows like the producer reads them, one in five without address2 and one in ten without a postal code
+def build_frame(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "source_id": [str(i) for i in range(rows)],
+        "address1": [f"{i} {STREETS[i % len(STREETS)]}" for i in range(rows)],
+        "address2": [None if i % 5 else f"Unit {i % 50}" for i in range(rows)],
+        "city": ["Seattle"] * rows,
+        "state_code": ["WA"] * rows,
+        "zip_code": [None if i % 10 == 0 else "98101" for i in range(rows)],
+        "country": ["US"] * rows,
+    })
+
+# the row function before the address template
+def legacy_address_data_string(address_data: dict, schema_mapping: dict) -> str:
+    address_data_string = ""
+    for key, value in schema_mapping.items():
+        if value in address_data.keys():
+            address_data_string += f"{address_data[value]} "
+    return address_data_string.replace("nan", "")
+
+def run_legacy(df: pd.DataFrame, schema_map: dict) -> list:
+    return [legacy_address_data_string(record, schema_map) for record in df.to_dict("records")]
+
+def run_template(df: pd.DataFrame, schema_map: dict) -> list:
+    return address_template.get_address_template(schema_map).apply_pandas(df)
+
+def time_it(function, df: pd.DataFrame, schema_map: dict) -> tuple:
+    start = time.perf_counter()
+    texts = function(df, schema_map)
+    return time.perf_counter() - start, texts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 10000, 1000000])
+    args = parser.parse_args()
+    schema_map = utils.get_sample_address_schema_mapping()
+
+    print(f"{'rows':>10} {'row s':>10} {'template s':>10} {'speedup':>8} {'corrupted':>10}")
+    for rows in args.rows:
+        df = build_frame(rows)
+        legacy_seconds, legacy_texts = time_it(run_legacy, df, schema_map)
+        template_seconds, texts = time_it(run_template, df, schema_map)
+        corrupted = sum(1 for legacy, text in zip(legacy_texts, texts) if " ".join(legacy.split()) != text)
+        print(f"{rows:>10} {legacy_seconds:>10.3f} {template_seconds:>10.3f} {legacy_seconds / template_seconds:>7.1f}x {corrupted:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Runs the shared provider engine of util/providers with in memory providers shaped like the real ones
+Usage: python benchmarks/provider_benchmark.py [--rows 1000] [--latency 0.05] [--duplicates 0.2]
+"""
+import argparse
+import pathlib
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import providers
+
+SCHEMA_MAP = {"address_line1": "address1"}
+
+# (name, max batch size, max concurrency) like the smarty sdk, aws location and http providers
+SHAPES = [
+    ("smarty", 100, 4),
+    ("awslocation", 1, 16),
+    ("http", 100, 4),
+    ("serial", 1, 1),
+]
+
+def build_rows(rows: int, duplicates: float) -> list:
+    unique = max(1, int(rows * (1 - duplicates)))
+    return [{"source_id": i, "address1": f"{i % unique} Main St"} for i in range(rows)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--duplicates", type=float, default=0.2)
+    args = parser.parse_args()
+    rows = build_rows(args.rows, args.duplicates)
+
+    print(f"{'provider':>12} {'batch':>6} {'workers':>8} {'calls':>6} {'seconds':>8} {'rows/s':>10}")
+    for name, max_batch_size, max_concurrency in SHAPES:
+        provider = providers.FakeProvider(name, max_batch_size, max_concurrency, args.latency)
+        start = time.perf_counter()
+        providers.validate_message_batch(provider, {"schema_map": SCHEMA_MAP}, rows, "benchmark", mock.Mock())
+        seconds = time.perf_counter() - start
+        print(f"{name:>12} {max_batch_size:>6} {max_concurrency:>8} {len(provider.calls):>6} {seconds:>8.2f} {args.rows / seconds:>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Compares the per row pd.concat output assembly the validators used with util/result_builder
+Usage: python benchmarks/result_builder_benchmark.py [--rows 100 10000 1000000] [--legacy-max-rows 1000]
+"""
+import argparse
+import pathlib
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import result_builder
+
+# one valid row and one invalid row out of every ten, like the smarty writer builds them
+def build_rows(rows: int):
+    for i in range(rows):
+        row = {
+            "i_input_msg_id": "msg-1",
+            "i_batch_index": i,
+            "i_input_id": str(i),
+            "i_full_addr_txt": f"{i} Main St Seattle WA 98101"
+        }
+        if i % 10 == 0:
+            row["o_valid"] = 0
+        else:
+            row.update({
+                "o_street_address1": f"{i} Main St",
+                "o_street_address2": "",
+                "o_city": "Seattle",
+                "o_state_code": "WA",
+                "o_full_postal_code": "98101 1234",
+                "o_country": "USA",
+                "o_external_addr_id": f"98101{i}",
+                "o_valid": 1
+            })
+        yield row
+
+def run_legacy(rows: int) -> pd.DataFrame:
+    df = pd.DataFrame()
+    for row in build_rows(rows):
+        df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
+    return df
+
+def run_builder(rows: int) -> pd.DataFrame:
+    builder = result_builder.ResultBuilder(capacity=rows)
+    for row in build_rows(rows):
+        builder.append(row)
+    return builder.to_pandas()
+
+def time_it(function, rows: int) -> float:
+    start = time.perf_counter()
+    function(rows)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 10000, 1000000])
+    parser.add_argument("--legacy-max-rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'concat s':>10} {'builder s':>10} {'speedup':>8}")
+    for rows in args.rows:
+        builder_seconds = time_it(run_builder, rows)
+        if rows <= args.legacy_max_rows:
+            legacy_seconds = time_it(run_legacy, rows)
+            print(f"{rows:>10} {legacy_seconds:>10.3f} {builder_seconds:>10.3f} {legacy_seconds / builder_seconds:>7.1f}x")
+        else:
+            print(f"{rows:>10} {'skipped':>10} {builder_seconds:>10.3f} {'':>8}")
+
+if __name__ == "__main__":
+    main()
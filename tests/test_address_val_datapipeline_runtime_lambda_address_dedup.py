@@ -0,0 +1,135 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import threading
+import unittest
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import address_dedup
+import awslocation_addr_val
+import smarty_addr_val
+
+
+class AddressDeduplicatorTestCase(unittest.TestCase):
+    def test_message_scope_shares_lookups_within_a_message(self) -> None:
+        dedup = address_dedup.AddressDeduplicator("message")
+
+        self.assertEqual(dedup.claim(["a", "b", "a"], "m0"), ["a", "b"])
+        self.assertEqual(dedup.claim(["a", "c"], "m0"), ["c"])
+        self.assertEqual(dedup.claim(["a"], "m1"), ["a"])
+        self.assertEqual(dedup.get_metrics(), {"DedupAddresses": 6, "DedupLookups": 4, "DedupSavedRatio": 100.0 / 3})
+
+    def test_invocation_scope_shares_lookups_between_messages(self) -> None:
+        dedup = address_dedup.AddressDeduplicator("invocation")
+        dedup.claim(["a"], "m0")
+        dedup.resolve({"a": {"o_valid": 1}}, "m0")
+
+        self.assertEqual(dedup.claim(["a"], "m1"), [])
+        self.assertEqual(dedup.wait(["a"], "m1"), {"a": {"o_valid": 1}})
+
+    def test_failed_lookups_fail_their_waiters_and_can_be_claimed_again(self) -> None:
+        dedup = address_dedup.AddressDeduplicator("invocation")
+        dedup.claim(["a", "b"], "m0")
+        dedup.resolve({"a": {"o_valid": 1}}, "m0")
+        errors = []
+
+        def wait():
+            try:
+                dedup.wait(["b"], "m1")
+            except RuntimeError as err:
+                errors.append(err)
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        dedup.fail(["a", "b"], RuntimeError("smarty unavailable"), "m0")
+        waiter.join(5)
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(dedup.claim(["a", "b"], "m2"), ["b"])
+
+    def test_unknown_scope_is_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            address_dedup.build_deduplicator({"dedup_scope": "global"})
+
+
+class SmartyDedupTestCase(unittest.TestCase):
+    config = {"schema_map": {"address_line1": "address1"}}
+
+    def test_duplicate_addresses_of_a_batch_are_sent_once(self) -> None:
+        message_batch = [{"source_id": i, "address1": address} for i, address in enumerate(["1 Main St", "1 MAIN ST.", "2 Main St"])]
+        sent = []
+
+        def send_batch(client, batch, limiter, max_throttle_retries, max_transient_retries):
+            sent.extend(lookup.street for lookup in batch)
+            for lookup in batch:
+                lookup.result = []
+
+        writer = mock.Mock()
+        provider = smarty_addr_val.providers.SmartyProvider(self.config)
+        with mock.patch.object(provider, "get_client"), \
+                mock.patch.object(smarty_addr_val.providers, "send_smarty_batch", side_effect=send_batch):
+            smarty_addr_val.providers.validate_message_batch(provider, self.config, message_batch, "msg", writer)
+
+        self.assertEqual(sent, ["1 Main St", "2 Main St"])
+        table = writer.write.call_args[0][0]
+        self.assertEqual(table.column("i_input_id").to_pylist(), ["0", "1", "2"])
+        self.assertEqual(table.column("o_valid").to_pylist(), [0, 0, 0])
+
+    def test_batches_of_a_message_share_lookups(self) -> None:
+        batches = [("msg", i, [{"source_id": i, "address1": "1 Main St"}]) for i in range(4)]
+        sends = []
+
+        def send_batch(client, batch, limiter, max_throttle_retries, max_transient_retries):
+            sends.append(len(batch))
+            for lookup in batch:
+                lookup.result = []
+
+        writer = mock.Mock()
+        dedup = address_dedup.AddressDeduplicator("message")
+        provider = smarty_addr_val.providers.SmartyProvider(self.config)
+        with mock.patch.object(provider, "get_client"), \
+                mock.patch.object(smarty_addr_val.providers, "send_smarty_batch", side_effect=send_batch):
+            failed = smarty_addr_val.run_provider_batches(provider, self.config, batches, writer, 2, None, dedup)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(sends, [1])
+        self.assertEqual(writer.write.call_count, 4)
+        self.assertEqual(dedup.get_metrics()["DedupSavedRatio"], 75.0)
+
+
+class AWSLocationDedupTestCase(unittest.TestCase):
+    def test_messages_of_an_invocation_share_searches(self) -> None:
+        config = {"place_index": "index", "schema_map": {"address_line1": "address1"}}
+        client = mock.Mock()
+        client.search_place_index_for_text.return_value = {"Results": []}
+        writer = mock.Mock()
+        dedup = address_dedup.AddressDeduplicator("invocation")
+
+        with mock.patch.object(awslocation_addr_val.runtime_cache, "get_client", return_value=client):
+            for msg_id in ("m0", "m1"):
+                message_batch = [{"source_id": 1, "address1": "1 Main St"}, {"source_id": 2, "address1": "1 main st"}]
+                awslocation_addr_val.run_awslocation_addr_lookup(config, message_batch, msg_id, writer, dedup=dedup)
+
+        self.assertEqual(client.search_place_index_for_text.call_count, 1)
+        self.assertEqual(writer.write.call_args[0][0].column("i_input_id").to_pylist(), ["1", "2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
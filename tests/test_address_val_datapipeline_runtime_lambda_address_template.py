@@ -0,0 +1,75 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import unittest
+
+import pandas as pd
+import pyarrow as pa
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import address_template, utils
+import produce_addr_val_batch_msgs
+
+
+SCHEMA_MAP = {"address_line1": "address1", "address_line2": "address2", "city": "city", "state": "state_code", "zip_code": "zip_code"}
+RECORDS = [
+    {"source_id": "1", "address1": "12 Nantucket  Ave", "address2": float("nan"), "city": "San Fernando", "state_code": "CA", "zip_code": "91340"},
+    {"source_id": "2", "address1": " 5 Main St ", "address2": "nan", "city": None, "state_code": "WA", "zip_code": ""},
+    {"source_id": "3"},
+]
+EXPECTED = ["12 Nantucket Ave San Fernando CA 91340", "5 Main St WA", ""]
+
+
+class AddressTemplateTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.template = address_template.get_address_template(SCHEMA_MAP)
+
+    def test_records_keep_nan_inside_words_and_skip_null_values(self) -> None:
+        self.assertEqual(self.template.apply_records(RECORDS), EXPECTED)
+
+    def test_dataframes_and_arrow_tables_match_records(self) -> None:
+        df = pd.DataFrame(RECORDS)
+        df["state_code"] = df["state_code"].astype("category")
+        self.assertEqual(self.template.apply_pandas(df), EXPECTED)
+        self.assertEqual(self.template.apply_arrow(pa.Table.from_pandas(df)).to_pylist(), EXPECTED)
+
+    def test_values_that_are_not_text_are_formatted(self) -> None:
+        self.assertEqual(self.template.format({"address1": "1 Main St", "zip_code": 98101}), "1 Main St 98101")
+
+    def test_single_row_helper_uses_the_template(self) -> None:
+        self.assertEqual(utils.get_address_data_string(RECORDS[0], SCHEMA_MAP), EXPECTED[0])
+
+    def test_text_added_by_the_producer_is_used(self) -> None:
+        records = [{"source_id": "1", "full_addr_txt": "1 Main St"}]
+        self.assertEqual(address_template.get_record_texts(records, SCHEMA_MAP), ["1 Main St"])
+        self.assertEqual(address_template.get_record_texts(RECORDS, SCHEMA_MAP), EXPECTED)
+
+
+class ProducerAddressTextTestCase(unittest.TestCase):
+    def test_messages_ship_the_address_text(self) -> None:
+        config = {"schema_map": SCHEMA_MAP}
+        chunks = list(produce_addr_val_batch_msgs.add_address_texts(iter([pd.DataFrame(RECORDS)]), config))
+
+        self.assertEqual(chunks[0]["full_addr_txt"].tolist(), EXPECTED)
+        self.assertEqual(produce_addr_val_batch_msgs.get_send_columns(config), ["source_id", "full_addr_txt"])
+        self.assertIsNone(produce_addr_val_batch_msgs.get_send_columns({}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import pathlib
+import sys
+import threading
+import unittest
+from unittest import mock
+
+import httpx
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import async_http, providers
+
+
+class SmartyApiStub:
+    """
+    Answers each lookup with one candidate, except the odd input indexes, and fails the first attempt of every batch
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = {}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        lookups = json.loads(request.content)
+        batch_id = lookups[0]["street"]
+        with self.lock:
+            self.attempts[batch_id] = self.attempts.get(batch_id, 0) + 1
+            if self.attempts[batch_id] == 1:
+                return httpx.Response(503)
+        candidates = [
+            {"input_index": index, "candidate_index": 0, "input_id": lookup["input_id"], "delivery_line_1": lookup["street"],
+             "components": {"city_name": "Boring", "state_abbreviation": "OR", "zipcode": "97009"}}
+            for index, lookup in enumerate(lookups) if index % 2 == 0
+        ]
+        return httpx.Response(200, json=candidates)
+
+
+class AsyncHTTPSmartyProviderTestCase(unittest.TestCase):
+    config = {"url": "https://smarty.test/street-address", "license_key": "us-core-cloud", "secret_name": "smarty", "region_name": "us-west-2",
+              "secrets": {"auth_id": "old", "auth_token": "t"}}
+
+    def test_batches_are_retried_and_filled_in_order(self) -> None:
+        stub = SmartyApiStub()
+        provider = async_http.AsyncHTTPSmartyProvider({**self.config, "batch_concurrency": 3}, transport=httpx.MockTransport(stub))
+        provider.max_batch_size = 5
+        texts = [f"{i} Main St, Boring, OR" for i in range(30)]
+
+        with mock.patch.object(async_http.asyncio, "sleep", new=mock.AsyncMock()):
+            outputs = providers.validate_texts(provider, texts)
+
+        self.assertEqual(stub.attempts, {texts[i]: 2 for i in range(0, 30, 5)})
+        self.assertEqual([output["o_valid"] for output in outputs], [1, 0, 1, 0, 1] * 6)
+        self.assertEqual(outputs[7]["o_city"], "Boring")
+        self.assertEqual(outputs[2]["o_full_postal_code"], "97009 None")
+
+    def test_retries_follow_the_configured_limits(self) -> None:
+        statuses = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            statuses.append(429 if len(statuses) < 3 else 503)
+            return httpx.Response(statuses[-1])
+
+        config = {**self.config, "max_throttle_retries": 3, "max_transient_retries": 1}
+        provider = async_http.AsyncHTTPSmartyProvider(config, transport=httpx.MockTransport(handler))
+        with mock.patch.object(async_http.asyncio, "sleep", new=mock.AsyncMock()):
+            outputs = providers.validate_texts(provider, ["1 Main St"])
+
+        self.assertIsInstance(outputs[0], httpx.HTTPStatusError)
+        self.assertEqual(statuses, [429, 429, 429, 503, 503])
+
+    def test_failed_batch_fails_only_its_texts(self) -> None:
+        def handler(request: httpx.Request) -> httpx.Response:
+            if json.loads(request.content)[0]["street"].startswith("bad"):
+                return httpx.Response(400)
+            return httpx.Response(200, json=[])
+
+        provider = async_http.AsyncHTTPSmartyProvider(dict(self.config), transport=httpx.MockTransport(handler))
+        provider.max_batch_size = 2
+        outputs = providers.validate_texts(provider, ["good 1", "good 2", "bad 1", "bad 2"])
+
+        self.assertEqual(outputs[:2], [{"o_valid": 0, "o_provider": "smarty"}] * 2)
+        self.assertIsInstance(outputs[2], httpx.HTTPStatusError)
+        self.assertIs(outputs[3], outputs[2])
+
+    def test_texts_are_validated_on_the_shared_client(self) -> None:
+        def handler(request: httpx.Request) -> httpx.Response:
+            lookups = json.loads(request.content)
+            return httpx.Response(200, json=[{"input_index": 0, "candidate_index": 0, "delivery_line_1": lookups[0]["street"],
+                                              "components": {"city_name": "Boring", "state_abbreviation": "OR"}}])
+
+        provider = async_http.AsyncHTTPSmartyProvider(dict(self.config), transport=httpx.MockTransport(handler))
+        outputs = providers.validate_texts(provider, ["1 Main St", "2 Main St"])
+
+        self.assertEqual([output["o_valid"] for output in outputs], [1, 0])
+        self.assertEqual(outputs[0]["o_city"], "Boring")
+
+    def test_rejected_texts_are_sent_again_with_the_reloaded_secret(self) -> None:
+        auth_ids = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            auth_ids.append(request.url.params["auth-id"])
+            return httpx.Response(401 if request.url.params["auth-id"] == "old" else 200, json=[])
+
+        provider = async_http.AsyncHTTPSmartyProvider(dict(self.config), transport=httpx.MockTransport(handler))
+        with mock.patch.object(providers.runtime_cache.utils, "get_secret_credentials", return_value={"auth_id": "new", "auth_token": "t"}):
+            outputs = providers.send_provider_batch(provider, ["1 Main St"])
+
+        self.assertEqual(outputs, [{"o_valid": 0, "o_provider": "smarty"}])
+        self.assertEqual(auth_ids, ["old", "new"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+import awslocation_addr_val
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "SearchPlaceIndexForText")
+
+
+class AWSLocationRetryTestCase(unittest.TestCase):
+    def test_transient_errors_are_retried(self) -> None:
+        client = mock.Mock()
+        client.search_place_index_for_text.side_effect = [client_error("InternalServerException"), client_error("ThrottlingException"), {"Results": []}]
+
+        with mock.patch.object(awslocation_addr_val.providers.time, "sleep"):
+            response = awslocation_addr_val.search_place_index(client, "index", "1 Main St")
+
+        self.assertEqual(response, {"Results": []})
+        self.assertEqual(client.search_place_index_for_text.call_count, 3)
+
+    def test_non_transient_errors_are_raised(self) -> None:
+        client = mock.Mock()
+        client.search_place_index_for_text.side_effect = client_error("ValidationException")
+
+        with self.assertRaises(ClientError):
+            awslocation_addr_val.search_place_index(client, "index", "1 Main St")
+        self.assertEqual(client.search_place_index_for_text.call_count, 1)
+
+
+class SlowLocationClient:
+    """
+    Answers each search after latency seconds with the text as the place id, fails the texts in failing with error_code
+    """
+    def __init__(self, latency: float, failing: tuple=(), error_code: str="InternalServerException") -> None:
+        self.latency = latency
+        self.failing = failing
+        self.error_code = error_code
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def search_place_index_for_text(self, IndexName, MaxResults, Text):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        if Text in self.failing:
+            raise client_error(self.error_code)
+        place = {"AddressNumber": "1", "Street": Text, "Municipality": "Seattle", "Region": "WA", "PostalCode": "98101", "Country": "USA"}
+        return {"Results": [{"Relevance": 1, "Place": place, "PlaceId": Text}]}
+
+
+class AWSLocationEngineTestCase(unittest.TestCase):
+    config = {"place_index": "index", "schema_map": {"address_line1": "address1"}, "lookup_concurrency": 16}
+
+    def test_searches_run_concurrently_in_input_order(self) -> None:
+        client = SlowLocationClient(0.05)
+        message_batch = [{"source_id": i, "address1": f"{i} Main St"} for i in range(100)]
+        writer = mock.Mock()
+
+        start = time.perf_counter()
+        with mock.patch.object(awslocation_addr_val, "get_location_client", return_value=client):
+            awslocation_addr_val.run_awslocation_addr_lookup(self.config, message_batch, "msg", writer)
+        elapsed = time.perf_counter() - start
+
+        # one search at a time would take 5 seconds
+        self.assertLess(elapsed, 2.5)
+        self.assertGreater(client.max_in_flight, 1)
+        self.assertLessEqual(client.max_in_flight, 16)
+        table = writer.write.call_args[0][0]
+        self.assertEqual(table.column("i_input_id").to_pylist(), [str(i) for i in range(100)])
+        self.assertEqual(table.column("o_external_addr_id").to_pylist(), [f"{i} Main St" for i in range(100)])
+
+    def test_failed_search_fails_the_message_and_keeps_the_others(self) -> None:
+        client = SlowLocationClient(0, failing=("2 Main St",))
+        message_batch = [{"source_id": i, "address1": f"{i} Main St"} for i in range(4)]
+        cache = awslocation_addr_val.result_cache.InMemoryResultCache()
+        writer = mock.Mock()
+
+        with mock.patch.object(awslocation_addr_val, "get_location_client", return_value=client), \
+                mock.patch.object(awslocation_addr_val.providers.time, "sleep"), \
+                self.assertRaises(awslocation_addr_val.providers.ProviderError) as raised:
+            awslocation_addr_val.run_awslocation_addr_lookup(self.config, message_batch, "msg", writer, cache=cache)
+
+        self.assertIsInstance(raised.exception.error, ClientError)
+        writer.write.assert_not_called()
+        keys = [awslocation_addr_val.result_cache.get_cache_key("awslocation", f"{i} Main St") for i in range(4)]
+        self.assertEqual(sorted(cache.get_many(keys)), sorted(keys[:2] + keys[3:]))
+
+    def test_rejected_searches_are_written_as_invalid(self) -> None:
+        client = SlowLocationClient(0, failing=("1 Main St",), error_code="ValidationException")
+        search = client.search_place_index_for_text
+
+        def search_place_index_for_text(IndexName, MaxResults, Text):
+            response = search(IndexName, MaxResults, Text)
+            if Text == "2 Main St":
+                del response["Results"][0]["Place"]["AddressNumber"]
+            return response
+
+        client.search_place_index_for_text = search_place_index_for_text
+        message_batch = [{"source_id": i, "address1": f"{i} Main St"} for i in range(3)] + [{"address1": "3 Main St"}]
+        cache = awslocation_addr_val.result_cache.InMemoryResultCache()
+        writer = mock.Mock()
+
+        with mock.patch.object(awslocation_addr_val, "get_location_client", return_value=client):
+            awslocation_addr_val.run_awslocation_addr_lookup(self.config, message_batch, "msg", writer, cache=cache)
+
+        table = writer.write.call_args[0][0]
+        self.assertEqual(table.column("o_valid").to_pylist(), [1, 0, 0, 1])
+        self.assertEqual(table.column("i_input_id").to_pylist(), ["0", "1", "2", None])
+        keys = [awslocation_addr_val.result_cache.get_cache_key("awslocation", f"{i} Main St") for i in range(4)]
+        self.assertEqual(sorted(cache.get_many(keys)), sorted([keys[0], keys[3]]))
+
+    def test_client_pool_is_sized_to_the_concurrency(self) -> None:
+        with mock.patch.object(awslocation_addr_val.runtime_cache, "get_client") as get_client:
+            awslocation_addr_val.get_location_client(None, 32)
+        self.assertEqual(get_client.call_args[0][2].max_pool_connections, 32)
+
+
+class AWSLocationPartialBatchTestCase(unittest.TestCase):
+    @mock.patch.dict("os.environ", {"SSM_PARAMETER": "addr-val-awslocation"})
+    def test_only_failed_messages_are_reported(self) -> None:
+        records = [{"messageId": f"m{i}", "body": f"body{i}"} for i in range(3)]
+
+        def run_lookup(config, message_batch, msg_id, writer, cli_profile=None, cache=None, dedup=None):
+            if msg_id == "m1":
+                raise client_error("InternalServerException")
+
+        with mock.patch.object(awslocation_addr_val.runtime_cache, "get_app_configuration", return_value={}), \
+                mock.patch.object(awslocation_addr_val.utils, "read_message_batch", return_value=[]), \
+                mock.patch.object(awslocation_addr_val.output_writer, "build_output_writer", return_value=mock.Mock(upload_error=None)), \
+                mock.patch.object(awslocation_addr_val.runtime_cache, "get_boto3_session"), \
+                mock.patch.object(awslocation_addr_val, "run_awslocation_addr_lookup", side_effect=run_lookup) as lookup:
+            response = awslocation_addr_val.lambda_handler({"Records": records}, None)
+
+        self.assertEqual([call.args[2] for call in lookup.call_args_list], ["m0", "m1", "m2"])
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m1"}]})
+
+
+if __name__ == "__main__":
+    unittest.main()
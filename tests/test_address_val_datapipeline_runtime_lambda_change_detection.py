@@ -0,0 +1,155 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+import pandas as pd
+from util import address_template, change_detection, providers
+
+SCHEMA_MAP = {"address_line1": "address1"}
+CONFIG = {"schema_map": SCHEMA_MAP}
+
+
+def build_chunk(rows: dict) -> pd.DataFrame:
+    df = pd.DataFrame({"source_id": list(rows), "address1": list(rows.values())})
+    return address_template.add_address_text(df, SCHEMA_MAP)
+
+
+# runs a chunk through the detector like the glue job, returns the detector and the tables written
+def run_chunk(detector: change_detection.ChangeDetector, provider: providers.FakeProvider, rows: dict, msg_id="0") -> list:
+    writer = mock.Mock()
+    df, carried = detector.split(build_chunk(rows))
+    writer.write(carried)
+    if not df.empty:
+        recording = change_detection.RecordingWriter(writer, detector)
+        try:
+            providers.validate_message_batch(provider, CONFIG, df.to_dict("records"), msg_id, recording)
+        except providers.ProviderError:
+            pass
+    return [call[0][0] for call in writer.write.call_args_list]
+
+
+class AddressHashTestCase(unittest.TestCase):
+    def test_hash_ignores_case_and_whitespace(self) -> None:
+        hashes = change_detection.get_address_hashes(["1 Main St", " 1  main st ", "2 Main St"])
+
+        self.assertEqual(hashes[0], hashes[1])
+        self.assertNotEqual(hashes[0], hashes[2])
+        self.assertEqual(hashes, change_detection.get_address_hashes(["1 Main St", " 1  main st ", "2 Main St"]))
+
+    def test_manifest_uri_is_stable_per_input_key(self) -> None:
+        uri = change_detection.get_manifest_uri("bucket", "dataset/manifests/", "dataset/input.csv")
+
+        self.assertTrue(uri.startswith("s3://bucket/dataset/manifests/"))
+        self.assertTrue(uri.endswith(".parquet"))
+        self.assertEqual(uri, change_detection.get_manifest_uri("bucket", "dataset/manifests", "dataset/input.csv"))
+        self.assertNotEqual(uri, change_detection.get_manifest_uri("bucket", "dataset/manifests", "dataset/other.csv"))
+
+
+class ChangeDetectorTestCase(unittest.TestCase):
+    def test_first_run_validates_every_row(self) -> None:
+        detector = change_detection.ChangeDetector()
+        provider = providers.FakeProvider()
+
+        run_chunk(detector, provider, {"1": "1 Main St", "2": "2 Main St"})
+
+        self.assertEqual(provider.calls, [["1 Main St", "2 Main St"]])
+        manifest = detector.to_table()
+        self.assertEqual(manifest.column("source_id").to_pylist(), ["1", "2"])
+        self.assertEqual(manifest.column("o_street_address1").to_pylist(), ["1 Main St", "2 Main St"])
+        self.assertEqual(detector.get_metrics()["RowsInserted"], 2)
+
+    def test_only_inserted_and_changed_rows_are_validated(self) -> None:
+        first = change_detection.ChangeDetector()
+        run_chunk(first, providers.FakeProvider(), {"1": "1 Main St", "2": "2 Main St", "3": "3 Main St"}, "first")
+        detector = change_detection.ChangeDetector(first.to_table())
+        provider = providers.FakeProvider()
+
+        tables = run_chunk(detector, provider, {"1": "1 MAIN ST", "2": "20 Main St", "4": "4 Main St"})
+
+        self.assertEqual(provider.calls, [["20 Main St", "4 Main St"]])
+        carried, validated = tables
+        self.assertEqual(carried.column("i_input_id").to_pylist(), ["1"])
+        # the row keeps the message id and batch index of the run that validated it
+        self.assertEqual(carried.column("i_input_msg_id").to_pylist(), ["first"])
+        self.assertEqual(carried.column("i_batch_index").to_pylist(), [0])
+        self.assertEqual(carried.column("o_street_address1").to_pylist(), ["1 Main St"])
+        self.assertEqual(validated.column("i_input_id").to_pylist(), ["2", "4"])
+        manifest = detector.to_table()
+        self.assertEqual(sorted(manifest.column("source_id").to_pylist()), ["1", "2", "4"])
+        self.assertEqual(detector.get_metrics(), {
+            "RowsInserted": 1,
+            "RowsChanged": 1,
+            "RowsUnchanged": 1,
+            "RowsDeleted": 1,
+            "ValidatedRatio": 100.0 * 2 / 3
+        })
+
+    def test_failed_rows_are_left_out_of_the_manifest(self) -> None:
+        detector = change_detection.ChangeDetector()
+
+        run_chunk(detector, providers.FakeProvider(failing=("2 Main St",)), {"1": "1 Main St", "2": "2 Main St"})
+
+        self.assertEqual(detector.to_table().num_rows, 0)
+        # the next run validates them again
+        provider = providers.FakeProvider()
+        run_chunk(change_detection.ChangeDetector(detector.to_table()), provider, {"1": "1 Main St", "2": "2 Main St"})
+        self.assertEqual(provider.calls, [["1 Main St", "2 Main St"]])
+
+    def test_rows_answered_by_another_provider_are_left_out_of_the_manifest(self) -> None:
+        detector = change_detection.ChangeDetector(provider="smarty")
+
+        run_chunk(detector, providers.FakeProvider("smarty"), {"1": "1 Main St"})
+        run_chunk(detector, providers.FakeProvider("awslocation"), {"2": "2 Main St"})
+
+        self.assertEqual(detector.to_table().column("source_id").to_pylist(), ["1"])
+        self.assertEqual(detector.to_table().column("o_provider").to_pylist(), ["smarty"])
+
+    def test_manifest_round_trip_keeps_the_provider(self) -> None:
+        detector = change_detection.ChangeDetector()
+        run_chunk(detector, providers.FakeProvider(), {"1": "1 Main St"})
+        session = mock.Mock()
+        s3_client = session.client.return_value
+        uri = change_detection.get_manifest_uri("bucket", "manifests", "input.csv")
+
+        change_detection.write_manifest(uri, detector.to_table(), "smarty", session)
+        body = s3_client.put_object.call_args.kwargs["Body"]
+        s3_client.get_object.return_value = {"Body": mock.Mock(read=mock.Mock(return_value=body))}
+
+        self.assertEqual(change_detection.read_manifest(uri, "smarty", session).column("source_id").to_pylist(), ["1"])
+        self.assertIsNone(change_detection.read_manifest(uri, "awslocation", session))
+
+    def test_manifest_without_the_message_ids_is_not_used(self) -> None:
+        manifest = change_detection.ChangeDetector().to_table().drop(["i_input_msg_id", "i_batch_index"])
+        session = mock.Mock()
+        uri = change_detection.get_manifest_uri("bucket", "manifests", "input.csv")
+        change_detection.write_manifest(uri, manifest, "smarty", session)
+        body = session.client.return_value.put_object.call_args.kwargs["Body"]
+        session.client.return_value.get_object.return_value = {"Body": mock.Mock(read=mock.Mock(return_value=body))}
+
+        self.assertIsNone(change_detection.read_manifest(uri, "smarty", session))
+
+    def test_build_change_detector_needs_a_manifest_prefix(self) -> None:
+        self.assertEqual(change_detection.build_change_detector(CONFIG, "bucket", "key", "smarty", None), (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
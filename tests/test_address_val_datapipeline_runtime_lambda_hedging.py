@@ -0,0 +1,165 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import hedging, providers
+
+TEXTS = ["1 Main St", "2 Main St"]
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def build_hedged(primary, secondary, clock=None, default_delay_seconds: float=0.05) -> hedging.HedgedProvider:
+    breaker = hedging.CircuitBreaker(failure_threshold=2, reset_seconds=30, clock=clock or time.monotonic)
+    return hedging.HedgedProvider(primary, secondary, breaker=breaker, default_delay_seconds=default_delay_seconds, min_delay_seconds=0.01)
+
+
+class HedgedProviderTestCase(unittest.TestCase):
+    def test_fast_primary_is_not_hedged(self) -> None:
+        secondary = providers.FakeProvider("secondary")
+        provider = build_hedged(providers.FakeProvider("primary"), secondary)
+
+        outputs = provider.validate(TEXTS)
+
+        self.assertEqual([output["o_street_address1"] for output in outputs], TEXTS)
+        self.assertEqual(secondary.calls, [])
+        self.assertEqual(provider.get_metrics()["HedgesSent"], 0)
+
+    def test_slow_primary_is_hedged_and_the_first_answer_wins(self) -> None:
+        primary = providers.FakeProvider("primary", latency_seconds=0.5)
+        secondary = providers.FakeProvider("secondary", invalid=("2 Main St",))
+        provider = build_hedged(primary, secondary)
+
+        start = time.perf_counter()
+        outputs = provider.validate(TEXTS)
+        elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 0.3)
+        # the output is labelled with the provider that answered
+        self.assertEqual(outputs[1], {"o_valid": 0, "o_provider": "secondary"})
+        # the primary answer arrives later and counts as latency saved
+        time.sleep(0.6)
+        metrics = provider.get_metrics()
+        self.assertEqual((metrics["HedgeCalls"], metrics["HedgesSent"], metrics["HedgeWins"], metrics["HedgeRate"]), (1, 1, 1, 100.0))
+        self.assertGreater(metrics["TailLatencySavedSeconds"], 0.2)
+        self.assertGreater(metrics["PrimaryLatencyP99Seconds"], metrics["ServedLatencyP99Seconds"])
+
+    def test_primary_answer_is_kept_when_the_hedge_fails(self) -> None:
+        primary = providers.FakeProvider("primary", latency_seconds=0.1)
+        secondary = providers.FakeProvider("secondary", failing=("1 Main St",))
+        provider = build_hedged(primary, secondary)
+
+        outputs = provider.validate(TEXTS)
+
+        self.assertEqual([output["o_street_address1"] for output in outputs], TEXTS)
+        self.assertEqual(provider.get_metrics()["HedgeWins"], 0)
+
+    def test_failed_primary_fails_over_at_once(self) -> None:
+        primary = providers.FakeProvider("primary", failing=("1 Main St",))
+        secondary = providers.FakeProvider("secondary")
+        provider = build_hedged(primary, secondary, default_delay_seconds=5)
+
+        start = time.perf_counter()
+        outputs = provider.validate(TEXTS)
+
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(outputs[0]["o_street_address1"], "1 Main St")
+        self.assertEqual(len(secondary.calls), 1)
+
+    def test_open_circuit_sends_every_batch_to_the_secondary(self) -> None:
+        clock = FakeClock()
+        primary = providers.FakeProvider("primary", failing=("1 Main St",))
+        secondary = providers.FakeProvider("secondary")
+        provider = build_hedged(primary, secondary, clock)
+
+        for _ in range(4):
+            provider.validate(TEXTS)
+        self.assertEqual(len(primary.calls), 2)
+        self.assertEqual(provider.get_metrics()["Failovers"], 2)
+        self.assertEqual(provider.get_metrics()["CircuitOpens"], 1)
+
+        # after reset_seconds the primary gets one trial call, it closes the circuit once it answers
+        primary.failing.clear()
+        clock.now = 31
+        provider.validate(TEXTS)
+        provider.validate(TEXTS)
+        self.assertEqual(len(primary.calls), 4)
+        self.assertFalse(provider.breaker.is_open)
+
+    def test_hedged_results_are_cached_under_the_provider_that_answered(self) -> None:
+        provider = build_hedged(providers.FakeProvider("smarty", latency_seconds=0.5), providers.FakeProvider("awslocation"))
+        cache = providers.result_cache.InMemoryResultCache()
+        rows = [{"source_id": i, "address1": text} for i, text in enumerate(TEXTS)]
+        writer = mock.Mock()
+
+        providers.validate_message_batch(provider, {"schema_map": {"address_line1": "address1"}}, rows, "msg", writer, cache)
+
+        self.assertEqual(cache.get_many([providers.result_cache.get_cache_key("smarty", text) for text in TEXTS]), {})
+        keys = [providers.result_cache.get_cache_key("awslocation", text) for text in TEXTS]
+        self.assertEqual(sorted(cache.get_many(keys)), sorted(keys))
+        self.assertEqual(writer.write.call_args[0][0].column("o_provider").to_pylist(), ["awslocation"] * len(TEXTS))
+
+    def test_hedges_run_on_a_bounded_executor(self) -> None:
+        secondary = providers.FakeProvider("secondary")
+        provider = build_hedged(providers.FakeProvider("primary", max_concurrency=2, latency_seconds=0.3), secondary)
+        hedge_threads = set()
+        validate = secondary.validate
+
+        def record_thread(texts):
+            hedge_threads.add(threading.current_thread().name)
+            return validate(texts)
+
+        secondary.validate = record_thread
+        with ThreadPoolExecutor(max_workers=6) as callers:
+            list(callers.map(provider.validate, [TEXTS] * 6))
+
+        self.assertEqual(provider.get_metrics()["HedgesSent"], 6)
+        self.assertLessEqual(len(hedge_threads), 2)
+
+
+class LatencyTrackerTestCase(unittest.TestCase):
+    def test_percentile_needs_min_samples(self) -> None:
+        tracker = hedging.LatencyTracker(window=100, min_samples=10)
+        for i in range(9):
+            tracker.observe(i / 10)
+        self.assertEqual(tracker.get_percentile(95, 1.0), 1.0)
+        for i in range(9, 100):
+            tracker.observe(i / 10)
+        self.assertAlmostEqual(tracker.get_percentile(95, 1.0), 9.5)
+
+    def test_primary_hedge_sends_to_the_same_provider(self) -> None:
+        provider = hedging.build_provider({"provider": "fake", "hedge": {"provider": "primary", "percentile": 90}})
+        self.assertIs(provider.secondary, provider.primary)
+        self.assertEqual(provider.hedge_percentile, 90)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import io
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+import pyarrow.parquet as pq
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import output_writer, result_builder
+
+
+class FakeS3Client:
+    def __init__(self, error=None):
+        self.objects = {}
+        self.error = error
+
+    def upload_file(self, path, bucket, key):
+        if self.error is not None:
+            raise self.error
+        with open(path, "rb") as file:
+            self.objects[key] = file.read()
+
+    def delete_objects(self, Bucket, Delete):
+        for entry in Delete["Objects"]:
+            self.objects.pop(entry["Key"])
+
+
+def build_table(rows: int, start: int=0, msg_id: str="msg"):
+    builder = result_builder.ResultBuilder(capacity=rows)
+    for i in range(start, start + rows):
+        builder.append({"i_input_msg_id": msg_id, "i_batch_index": i, "i_input_id": str(i), "o_city": "Seattle", "o_valid": 1})
+    return builder.to_table()
+
+
+def build_writer(s3_client, **kwargs):
+    session = mock.Mock()
+    session.client.return_value = s3_client
+    return output_writer.RollingParquetWriter("bucket", "out/validated", boto3_session=session, writer_id="w", **kwargs)
+
+
+class RollingParquetWriterTestCase(unittest.TestCase):
+
+    def test_batches_are_coalesced_in_to_one_file_with_row_groups(self):
+        s3_client = FakeS3Client()
+        with build_writer(s3_client, row_group_rows=250) as writer:
+            for i in range(10):
+                writer.write(build_table(100, i * 100))
+
+        self.assertEqual(list(s3_client.objects), ["out/validated/part-w-00000.parquet"])
+        parquet_file = pq.ParquetFile(io.BytesIO(s3_client.objects["out/validated/part-w-00000.parquet"]))
+        self.assertEqual(parquet_file.metadata.num_rows, 1000)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 4)
+        self.assertEqual(parquet_file.read().column("i_batch_index").to_pylist(), list(range(1000)))
+
+    def test_files_roll_at_the_target_size(self):
+        s3_client = FakeS3Client()
+        writer = build_writer(s3_client, target_file_size_mb=0.001, row_group_rows=100)
+        for i in range(5):
+            writer.write(build_table(100, i * 100))
+        keys = writer.close()
+
+        self.assertEqual(keys, [f"out/validated/part-w-{i:05d}.parquet" for i in range(5)])
+        rows = sum(pq.ParquetFile(io.BytesIO(body)).metadata.num_rows for body in s3_client.objects.values())
+        self.assertEqual(rows, 500)
+
+    def test_files_roll_when_the_buffer_time_runs_out(self):
+        s3_client = FakeS3Client()
+        now = [0.0]
+        writer = build_writer(s3_client, max_buffer_seconds=60, clock=lambda: now[0])
+        writer.write(build_table(10))
+        self.assertEqual(s3_client.objects, {})
+        now[0] = 61.0
+        writer.write(build_table(10, 10))
+
+        self.assertEqual(list(s3_client.objects), ["out/validated/part-w-00000.parquet"])
+        self.assertEqual(writer.close(), ["out/validated/part-w-00000.parquet"])
+
+    def test_failed_upload_is_recorded(self):
+        writer = build_writer(FakeS3Client(error=OSError("access denied")))
+        writer.write(build_table(10))
+
+        with self.assertRaises(OSError):
+            writer.close()
+        self.assertIsInstance(writer.upload_error, OSError)
+
+    def test_close_without_rows_writes_nothing(self):
+        s3_client = FakeS3Client()
+        self.assertEqual(build_writer(s3_client).close(), [])
+        self.assertEqual(s3_client.objects, {})
+
+    def test_written_files_are_deleted(self):
+        s3_client = FakeS3Client()
+        writer = build_writer(s3_client, target_file_size_mb=0.001, row_group_rows=100)
+        for i in range(3):
+            writer.write(build_table(100, i * 100))
+        writer.delete_written()
+
+        self.assertEqual(s3_client.objects, {})
+        self.assertEqual(writer.close(), [])
+
+
+class MessageOutputBufferTestCase(unittest.TestCase):
+
+    def test_rows_of_a_message_are_written_once_all_its_batches_are(self):
+        writer = mock.Mock()
+        buffer = output_writer.MessageOutputBuffer(writer, {"m0": 2, "m1": 2})
+
+        buffer.write(build_table(10, msg_id="m0"))
+        buffer.write(build_table(10, msg_id="m1"))
+        self.assertEqual(writer.write.call_count, 0)
+        buffer.write(build_table(10, 10, msg_id="m0"))
+
+        # m1 has a failed batch, none of its rows are written
+        self.assertEqual(writer.write.call_count, 1)
+        table = writer.write.call_args[0][0]
+        self.assertEqual(table.column("i_input_msg_id").to_pylist(), ["m0"] * 20)
+        self.assertEqual(table.column("i_batch_index").to_pylist(), list(range(20)))
+
+
+
+class PartitionedOutputTestCase(unittest.TestCase):
+
+    def write_partitioned(self, s3_client):
+        builder = result_builder.ResultBuilder()
+        for i, (state, postal_code) in enumerate([("WA", "98103"), ("OR", "97201"), ("WA", "98101"), (None, None)]):
+            builder.append({"i_batch_index": i, "o_state_code": state, "o_full_postal_code": postal_code, "o_valid": int(state is not None)})
+        writer = build_writer(s3_client, partition_cols=["run_date", "o_valid", "o_state_code"],
+                              partition_values={"run_date": "2024-05-01"}, sort_by="o_full_postal_code")
+        writer.write(builder.to_table())
+        writer.close()
+        return writer
+
+    def test_rows_are_written_to_hive_partitions_sorted_by_postal_code(self):
+        s3_client = FakeS3Client()
+        self.write_partitioned(s3_client)
+
+        prefix = "out/validated/run_date=2024-05-01"
+        self.assertEqual(sorted(s3_client.objects), [
+            f"{prefix}/o_valid=0/o_state_code=__HIVE_DEFAULT_PARTITION__/part-w-00000.parquet",
+            f"{prefix}/o_valid=1/o_state_code=OR/part-w-00000.parquet",
+            f"{prefix}/o_valid=1/o_state_code=WA/part-w-00000.parquet",
+        ])
+        table = pq.ParquetFile(io.BytesIO(s3_client.objects[f"{prefix}/o_valid=1/o_state_code=WA/part-w-00000.parquet"])).read()
+        self.assertNotIn("o_state_code", table.column_names)
+        self.assertNotIn("o_valid", table.column_names)
+        self.assertEqual(table.column("o_full_postal_code").to_pylist(), ["98101", "98103"])
+
+    def test_sorted_files_are_sorted_across_row_groups(self):
+        s3_client = FakeS3Client()
+        with build_writer(s3_client, row_group_rows=100, sort_by="o_full_postal_code") as writer:
+            for i in range(5):
+                builder = result_builder.ResultBuilder()
+                for j in range(100):
+                    builder.append({"i_batch_index": j, "o_full_postal_code": f"{(j * 7 + i) % 500:05d}", "o_valid": 1})
+                writer.write(builder.to_table())
+
+        parquet_file = pq.ParquetFile(io.BytesIO(s3_client.objects["out/validated/part-w-00000.parquet"]))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 5)
+        postal_codes = parquet_file.read().column("o_full_postal_code").to_pylist()
+        self.assertEqual(postal_codes, sorted(postal_codes))
+
+    def test_largest_buffer_is_written_out_over_the_buffered_rows_bound(self):
+        s3_client = FakeS3Client()
+        writer = build_writer(s3_client, row_group_rows=1000, partition_cols=["o_valid"], max_buffered_rows=150)
+        writer.write(build_table(100))
+        builder = result_builder.ResultBuilder()
+        for i in range(60):
+            builder.append({"i_batch_index": i, "o_valid": 0})
+        writer.write(builder.to_table())
+
+        self.assertEqual({key[0]: partition.pending_rows for key, partition in writer.partitions.items()}, {"1": 0, "0": 60})
+        self.assertEqual(writer.partitions[("1",)].file_rows, 100)
+        writer.close()
+        self.assertEqual(len(s3_client.objects), 2)
+
+    def test_written_partitions_are_registered_in_the_catalog(self):
+        writer = self.write_partitioned(FakeS3Client())
+
+        with mock.patch.object(output_writer.wr.catalog, "add_parquet_partitions") as add_partitions:
+            output_writer.register_output_partitions(writer, {"output_database": "db", "output_table": "validated"})
+
+        partitions_values = add_partitions.call_args.args[2]
+        self.assertEqual(add_partitions.call_args.args[:2], ("db", "validated"))
+        self.assertEqual(partitions_values["s3://bucket/out/validated/run_date=2024-05-01/o_valid=1/o_state_code=WA/"], ["2024-05-01", "1", "WA"])
+        self.assertEqual(len(partitions_values), 3)
+
+    def test_writer_is_built_from_the_configuration(self):
+        config = {
+            "s3_bucket": "bucket",
+            "s3_key": "data/file.csv-validated",
+            "output_partition_cols": ["run_date", "o_valid"],
+            "output_sort_by": "o_full_postal_code",
+        }
+        writer = output_writer.build_output_writer(config, mock.Mock())
+
+        self.assertEqual(writer.prefix, "data/file-csv-validated")
+        self.assertEqual(writer.row_partition_cols, ["o_valid"])
+        self.assertRegex(writer.partition_values["run_date"], r"^\d{4}-\d{2}-\d{2}$")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,9 +14,16 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import json
+import pathlib
+import sys
 import unittest
 from unittest import mock
 
+import pandas as pd
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
 from address_validation.datapipeline.runtime._lambda import produce_addr_val_batch_msgs
 
 # TODO build test cases for the Application code
@@ -41,5 +48,238 @@ class AppTestCase(unittest.TestCase):
         self.assertEqual(json.loads(response["body"]), user)
 
 
+class SendMessageBatchTestCase(unittest.TestCase):
+    def test_build_send_batches_limits_entries_and_size(self) -> None:
+        batches = produce_addr_val_batch_msgs.build_send_batches(["a" * 10] * 25, max_entries=10, max_payload_size=1000)
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+
+        batches = produce_addr_val_batch_msgs.build_send_batches(["a" * 400] * 5, max_entries=10, max_payload_size=1000)
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+
+    def test_build_send_batches_rejects_oversized_message(self) -> None:
+        with self.assertRaises(ValueError):
+            produce_addr_val_batch_msgs.build_send_batches(["a" * 1001], max_payload_size=1000)
+
+    @mock.patch.object(produce_addr_val_batch_msgs.time, "sleep")
+    def test_send_message_batch_retries_only_failed_entries(self, mock_sleep: mock.Mock) -> None:
+        queue = mock.Mock()
+        queue.send_messages.side_effect = [
+            {
+                "Successful": [{"Id": "0"}],
+                "Failed": [
+                    {"Id": "1", "SenderFault": False, "Code": "InternalError"},
+                    {"Id": "2", "SenderFault": True, "Code": "InvalidMessageContents"},
+                ],
+            },
+            {"Successful": [{"Id": "1"}]},
+        ]
+        failed = produce_addr_val_batch_msgs.send_message_batch(queue, ["m0", "m1", "m2"])
+
+        self.assertEqual([entry["Id"] for entry in failed], ["2"])
+        retry_entries = queue.send_messages.call_args_list[1].kwargs["Entries"]
+        self.assertEqual(retry_entries, [{"Id": "1", "MessageBody": "m1"}])
+
+
+class MaxSizeBatcherTestCase(unittest.TestCase):
+    def test_packs_every_row_within_max_size(self) -> None:
+        batcher = produce_addr_val_batch_msgs.MaxSizeBatcher(max_msg_size=1000)
+        messages = []
+        for i in range(0, 300, 30):
+            chunk = pd.DataFrame({"source_id": range(i, i + 30), "city": ["Zürich"] * 30})
+            messages.extend(batcher.add(chunk))
+        messages.extend(batcher.flush())
+
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(len(message.encode("utf-8")), 1000)
+        # all but the last message are filled to within one row of the limit
+        row_size = len(json.dumps({"source_id": 100, "city": "Zürich"}).encode("utf-8")) + 1
+        for message in messages[:-1]:
+            self.assertGreater(len(message.encode("utf-8")), 1000 - row_size)
+        source_ids = [row["source_id"] for message in messages for row in json.loads(message)]
+        self.assertEqual(source_ids, list(range(300)))
+
+
+class ClaimCheckBatcherTestCase(unittest.TestCase):
+    def test_batches_are_staged_with_the_producer_session(self) -> None:
+        session = mock.Mock()
+        batcher = produce_addr_val_batch_msgs.ClaimCheckBatcher({"bucket": "bucket", "prefix": "staging", "rows": 10}, session)
+
+        with mock.patch.object(produce_addr_val_batch_msgs.utils, "write_claim_check_batch", return_value="pointer") as write:
+            self.assertEqual(batcher.add(pd.DataFrame({"source_id": range(15)})), ["pointer"])
+        self.assertIs(write.call_args.args[3], session)
+
+
+class ProducerPipelineTestCase(unittest.TestCase):
+    def test_pipeline_sends_every_chunk_once(self) -> None:
+        sent_entries = []
+
+        def send_messages(Entries):
+            sent_entries.extend(Entries)
+            return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+        chunks = [pd.DataFrame({"source_id": range(i, i + 5)}) for i in range(0, 500, 5)]
+        with mock.patch.object(produce_addr_val_batch_msgs.boto3.session, "Session") as mock_session:
+            mock_session.return_value.resource.return_value.Queue.return_value.send_messages.side_effect = send_messages
+            totals = produce_addr_val_batch_msgs.read_and_produce_df_chunk(iter(chunks), "queue-url", concurrency=3, queue_depth=2)
+
+        self.assertEqual(totals, {"sent": 100, "failed": []})
+        source_ids = sorted(row["source_id"] for entry in sent_entries for row in json.loads(entry["MessageBody"]))
+        self.assertEqual(source_ids, list(range(500)))
+
+
+class ProducerPrefixTestCase(unittest.TestCase):
+    @mock.patch.dict("os.environ", {"AWS_LAMBDA_FUNCTION_NAME": "producer"})
+    def test_prefix_files_are_produced_and_aggregated(self) -> None:
+        keys = [f"prefix/part-0000{i}.csv.gz" for i in range(5)]
+        results = {key: {"sent": i + 1, "failed": [{"Id": key}] if i == 3 else []} for i, key in enumerate(keys)}
+        config = {"file_concurrency": 3}
+
+        with mock.patch.object(produce_addr_val_batch_msgs.s3_csv_reader, "list_s3_csv_objects", return_value=keys), \
+                mock.patch.object(produce_addr_val_batch_msgs.boto3.session, "Session"), \
+                mock.patch.object(produce_addr_val_batch_msgs, "produce_s3_object", side_effect=lambda config, bucket, key, cli_profile: results[key]) as produce:
+            totals = produce_addr_val_batch_msgs.produce_s3_prefix(config, "bucket", "prefix")
+
+        self.assertEqual(sorted(call.args[2] for call in produce.call_args_list), keys)
+        self.assertEqual(totals, {"sent": 15, "failed": [{"Id": keys[3]}]})
+
+    def test_single_file_runs_in_process(self) -> None:
+        with mock.patch.object(produce_addr_val_batch_msgs.s3_csv_reader, "list_s3_csv_objects", return_value=["prefix/part-00000.csv"]), \
+                mock.patch.object(produce_addr_val_batch_msgs.boto3.session, "Session"), \
+                mock.patch.object(produce_addr_val_batch_msgs, "produce_s3_object", return_value={"sent": 1, "failed": []}) as produce:
+            totals = produce_addr_val_batch_msgs.produce_s3_prefix({"file_concurrency": 4}, "bucket", "prefix")
+
+        produce.assert_called_once_with({"file_concurrency": 4}, "bucket", "prefix", None)
+        self.assertEqual(totals, {"sent": 1, "failed": []})
+
+
+class FakeLambdaContext:
+    """
+    Remaining time drops by a second each time it is checked
+    """
+    def __init__(self, remaining_seconds: int):
+        self.remaining_ms = remaining_seconds * 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        self.remaining_ms -= 1000
+        return self.remaining_ms
+
+
+class ResumableProducerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.checkpoints = {}
+        self.sent_entries = []
+        # source id whose message is rejected, and number of send calls before the run is cut off
+        self.failing_source_id = None
+        self.send_calls_left = None
+        self.config = {
+            "chunk_size": 10, "delimiter": ",", "encoding": "utf-8", "limit_rows": 1000, "sqs_queue": "queue-url",
+            "batch_mode": "chunk_size", "send_concurrency": 2, "checkpoint_prefix": "checkpoints", "checkpoint_rows": 30,
+            "stop_margin_seconds": 1
+        }
+
+        def send_messages(Entries):
+            if self.send_calls_left is not None:
+                if self.send_calls_left == 0:
+                    raise RuntimeError("lambda timed out")
+                self.send_calls_left -= 1
+            failed = [entry for entry in Entries if self.failing_source_id in [row["source_id"] for row in json.loads(entry["MessageBody"])]]
+            sent = [entry for entry in Entries if entry not in failed]
+            self.sent_entries.extend(sent)
+            return {
+                "Successful": [{"Id": entry["Id"]} for entry in sent],
+                "Failed": [{"Id": entry["Id"], "Code": "InvalidMessageContents", "SenderFault": True} for entry in failed]
+            }
+
+        utils = produce_addr_val_batch_msgs.utils
+        session = mock.patch.object(produce_addr_val_batch_msgs.boto3.session, "Session")
+        patches = [
+            session,
+            mock.patch.object(utils, "get_s3_input_version", return_value="v1"),
+            mock.patch.object(utils, "read_checkpoint", side_effect=lambda uri, boto3_session=None: self.checkpoints.get(uri)),
+            mock.patch.object(utils, "write_checkpoint", side_effect=lambda uri, checkpoint, boto3_session=None: self.checkpoints.update({uri: dict(checkpoint)})),
+            mock.patch.object(produce_addr_val_batch_msgs, "read_s3_file_chunked",
+                              side_effect=lambda *args, **kwargs: iter([pd.DataFrame({"source_id": range(i, i + 10)}) for i in range(0, 250, 10)])),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        session.target.Session.return_value.resource.return_value.Queue.return_value.send_messages.side_effect = send_messages
+
+    def sent_source_ids(self) -> list:
+        return [row["source_id"] for entry in self.sent_entries for row in json.loads(entry["MessageBody"])]
+
+    def test_resumes_without_sending_rows_twice(self) -> None:
+        first = produce_addr_val_batch_msgs.produce_resumable(self.config, "bucket", "key", None, FakeLambdaContext(8))
+        self.assertFalse(first["done"])
+        self.assertLess(len(self.sent_source_ids()), 250)
+
+        runs = 1
+        while True:
+            totals = produce_addr_val_batch_msgs.produce_resumable(self.config, "bucket", "key", None, FakeLambdaContext(8))
+            runs += 1
+            if totals["done"]:
+                break
+        self.assertGreater(runs, 2)
+        self.assertEqual(sorted(self.sent_source_ids()), list(range(250)))
+        checkpoint = list(self.checkpoints.values())[0]
+        self.assertEqual((checkpoint["rows_done"], checkpoint["messages_sent"]), (250, 25))
+
+        # a retry of a finished input sends nothing
+        retry = produce_addr_val_batch_msgs.produce_resumable(self.config, "bucket", "key", None, FakeLambdaContext(8))
+        self.assertTrue(retry["done"])
+        self.assertEqual(len(self.sent_source_ids()), 250)
+
+    def test_failed_message_is_sent_again_on_resume(self) -> None:
+        self.failing_source_id = 100
+
+        first = produce_addr_val_batch_msgs.produce_resumable(self.config, "bucket", "key", None, FakeLambdaContext(1000))
+
+        self.assertFalse(first["done"])
+        self.assertEqual(len(first["failed"]), 1)
+        checkpoint = list(self.checkpoints.values())[0]
+        self.assertLessEqual(checkpoint["rows_done"], 100)
+        self.assertFalse(checkpoint["done"])
+        self.assertNotIn(100, self.sent_source_ids())
+
+        self.failing_source_id = None
+        retry = produce_addr_val_batch_msgs.produce_resumable(self.config, "bucket", "key", None, FakeLambdaContext(1000))
+
+        self.assertTrue(retry["done"])
+        self.assertEqual(sorted(set(self.sent_source_ids())), list(range(250)))
+
+    def test_checkpoint_follows_the_send_groups(self) -> None:
+        self.config.update({"send_concurrency": 1, "checkpoint_rows": 1000})
+        self.send_calls_left = 2
+
+        with self.assertRaises(RuntimeError):
+            produce_addr_val_batch_msgs.produce_resumable(self.config, "bucket", "key", None, FakeLambdaContext(1000))
+
+        # the rows of the two groups sent before the cut off are not sent again
+        checkpoint = list(self.checkpoints.values())[0]
+        self.assertEqual(checkpoint["rows_done"], 200)
+        self.send_calls_left = None
+        produce_addr_val_batch_msgs.produce_resumable(self.config, "bucket", "key", None, FakeLambdaContext(1000))
+        self.assertEqual(sorted(self.sent_source_ids()), list(range(250)))
+
+    def test_send_progress_stops_at_the_first_failed_chunk(self) -> None:
+        saved = []
+        progress = produce_addr_val_batch_msgs.SendProgress(10, lambda rows_done, sent: saved.append(rows_done))
+        chunks = [progress.add_chunk(5) for _ in range(4)]
+
+        progress.on_sent([chunks[1]], [chunks[1]], 1, 0)
+        progress.on_sent([], [chunks[2]], 0, 1)
+        progress.on_sent([chunks[0]], [chunks[0]], 1, 0)
+        progress.on_sent([chunks[2], chunks[3]], [chunks[2], chunks[3]], 2, 0)
+
+        self.assertEqual(saved, [20])
+        self.assertTrue(progress.failed)
+
+    def test_skip_rows_inside_a_chunk(self) -> None:
+        chunks = [pd.DataFrame({"source_id": range(i, i + 10)}) for i in range(0, 30, 10)]
+        rest = list(produce_addr_val_batch_msgs.skip_rows(iter(chunks), 15))
+        self.assertEqual([list(chunk["source_id"]) for chunk in rest], [list(range(15, 20)), list(range(20, 30))])
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,190 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+import requests
+from smartystreets_python_sdk import exceptions
+from util import providers, result_cache
+
+SCHEMA_MAP = {"address_line1": "address1"}
+CONFIG = {"schema_map": SCHEMA_MAP}
+
+
+class CountingProvider(providers.FakeProvider):
+    """
+    Fake provider that counts the calls running at the same time
+    """
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def validate(self, texts: list) -> list:
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return super().validate(texts)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def build_rows(count: int) -> list:
+    return [{"source_id": i, "address1": f"{i} Main St"} for i in range(count)]
+
+
+class ProviderEngineTestCase(unittest.TestCase):
+    def test_batches_are_split_and_sent_concurrently_in_order(self) -> None:
+        provider = CountingProvider(max_batch_size=10, max_concurrency=4, latency_seconds=0.05)
+        writer = mock.Mock()
+
+        counts = providers.validate_message_batch(provider, CONFIG, build_rows(95), "msg", writer)
+
+        self.assertEqual(sorted(len(call) for call in provider.calls), [5] + [10] * 9)
+        self.assertGreater(provider.max_in_flight, 1)
+        self.assertLessEqual(provider.max_in_flight, 4)
+        table = writer.write.call_args[0][0]
+        self.assertEqual(table.column("i_input_id").to_pylist(), [str(i) for i in range(95)])
+        self.assertEqual(table.column("o_street_address1").to_pylist(), [f"{i} Main St" for i in range(95)])
+        self.assertEqual(counts, {"addresses": 95, "cached": 0, "looked_up": 95, "invalid": 0})
+
+    def test_cached_and_duplicate_addresses_are_not_sent(self) -> None:
+        provider = providers.FakeProvider(invalid=("2 Main St",))
+        cache = result_cache.InMemoryResultCache()
+        cache.put_many({result_cache.get_cache_key("fake", "0 Main St"): {"o_valid": 1, "o_city": "Seattle"}})
+        rows = build_rows(3) + build_rows(3)
+        writer = mock.Mock()
+
+        counts = providers.validate_message_batch(provider, CONFIG, rows, "msg", writer, cache)
+
+        self.assertEqual(provider.calls, [["1 Main St", "2 Main St"]])
+        # cached and looked up count unique addresses
+        self.assertEqual(counts, {"addresses": 6, "cached": 1, "looked_up": 2, "invalid": 2})
+        self.assertEqual(writer.write.call_args[0][0].column("o_city").to_pylist()[3], "Seattle")
+        key = result_cache.get_cache_key("fake", "2 Main St")
+        self.assertEqual(cache.get_many([key]), {key: {"o_valid": 0, "o_provider": "fake"}})
+        self.assertEqual(writer.write.call_args[0][0].column("o_provider").to_pylist(), ["fake"] * 6)
+
+    def test_failed_address_fails_the_batch_and_caches_the_others(self) -> None:
+        provider = providers.FakeProvider(max_batch_size=2, failing=("1 Main St",))
+        cache = result_cache.InMemoryResultCache()
+        writer = mock.Mock()
+
+        with self.assertRaises(providers.ProviderError) as raised:
+            providers.validate_message_batch(provider, CONFIG, build_rows(4), "msg", writer, cache)
+
+        self.assertEqual(raised.exception.provider, "fake")
+        self.assertIsInstance(raised.exception.error, RuntimeError)
+        writer.write.assert_not_called()
+        keys = [result_cache.get_cache_key("fake", f"{i} Main St") for i in range(4)]
+        self.assertEqual(sorted(cache.get_many(keys)), sorted([keys[0], keys[2], keys[3]]))
+
+    def test_rejected_credentials_are_reloaded_once(self) -> None:
+        provider = providers.FakeProvider()
+        auth_error = PermissionError("expired")
+        provider.is_auth_error = lambda err: err is auth_error
+        provider.on_auth_error = mock.Mock()
+        validate = provider.validate
+        provider.validate = mock.Mock(side_effect=[auth_error, validate(["1 Main St"])])
+
+        self.assertEqual(providers.validate_texts(provider, ["1 Main St"]),
+                         [{"o_street_address1": "1 Main St", "o_external_addr_id": "1 Main St", "o_valid": 1, "o_provider": "fake"}])
+        provider.on_auth_error.assert_called_once()
+
+    def test_unknown_provider_is_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            providers.build_provider({"provider": "postal"})
+        self.assertIsInstance(providers.build_provider({"provider": "fake", "fake_batch_size": 5}), providers.FakeProvider)
+
+
+class SmartyProviderTestCase(unittest.TestCase):
+    config = {"secrets": {"auth_id": "id", "auth_token": "token"}, "license_key": "us-core-cloud", "batch_concurrency": 2}
+
+    def test_rejected_credentials_reload_the_secret(self) -> None:
+        provider = providers.SmartyProvider(dict(self.config))
+        clients = [mock.Mock(), mock.Mock()]
+        clients[0].send_batch.side_effect = exceptions.BadCredentialsError("rotated")
+
+        def refresh_secrets(config, cli_profile=None):
+            config["secrets"] = {"auth_id": "id", "auth_token": "new token"}
+            return config
+
+        with mock.patch.object(providers, "build_smarty_client", side_effect=clients), \
+                mock.patch.object(providers.runtime_cache, "refresh_secrets", side_effect=refresh_secrets) as refresh:
+            outputs = providers.validate_texts(provider, ["1 Main St", "2 Main St"])
+
+        refresh.assert_called_once()
+        self.assertEqual(outputs, [{"o_valid": 0, "o_provider": "smarty"}, {"o_valid": 0, "o_provider": "smarty"}])
+        self.assertEqual(clients[1].send_batch.call_count, 1)
+
+
+class HTTPProviderTestCase(unittest.TestCase):
+    config = {
+        "http_url": "https://validation.example.com/batch",
+        "http_batch_size": 2,
+        "http_results_key": "results",
+        "http_output_fields": {"street": "o_street_address1", "id": "o_external_addr_id", "valid": "o_valid"},
+        "http_headers": {"x-api-key": "{api_key}"},
+        "secrets": {"api_key": "secret"},
+        "max_transient_retries": 1
+    }
+
+    def response(self, status_code: int, body: dict=None) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body or {}).encode()
+        return response
+
+    def test_results_are_mapped_to_the_output_columns(self) -> None:
+        provider = providers.HTTPProvider(self.config)
+        results = {"results": [{"input_index": 1, "street": "2 MAIN ST", "id": "b", "valid": 1}]}
+
+        with mock.patch.object(requests.Session, "post", side_effect=[self.response(503), self.response(200, results)]) as post, \
+                mock.patch.object(providers.time, "sleep"):
+            outputs = provider.validate(["1 Main St", "2 Main St"])
+
+        self.assertEqual(outputs, [{"o_valid": 0}, {"o_street_address1": "2 MAIN ST", "o_external_addr_id": "b", "o_valid": 1}])
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(json.loads(post.call_args.kwargs["data"]), [{"input_index": 0, "address": "1 Main St"}, {"input_index": 1, "address": "2 Main St"}])
+        self.assertEqual(post.call_args.kwargs["headers"]["x-api-key"], "secret")
+
+    def test_rejected_request_is_an_auth_error(self) -> None:
+        provider = providers.HTTPProvider(self.config)
+
+        with mock.patch.object(requests.Session, "post", return_value=self.response(401)), \
+                self.assertRaises(requests.exceptions.HTTPError) as raised:
+            provider.validate(["1 Main St"])
+        self.assertTrue(provider.is_auth_error(raised.exception))
+
+    def test_rejected_addresses_are_a_permanent_error(self) -> None:
+        provider = providers.HTTPProvider(self.config)
+
+        with mock.patch.object(requests.Session, "post", return_value=self.response(422)):
+            outputs = providers.validate_texts(provider, ["1 Main St"])
+        self.assertTrue(provider.is_permanent_error(outputs[0]))
+        self.assertFalse(provider.is_auth_error(outputs[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import json
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import rate_limiter, utils
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class AdaptiveRateLimiterTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.limiter = rate_limiter.AdaptiveRateLimiter(max_rate=100, burst=100, increase=10, clock=self.clock)
+
+    def test_waits_once_the_burst_is_used(self) -> None:
+        self.assertEqual(self.limiter.reserve(100), 0.0)
+        # the next 50 tokens are refilled in half a second at 100 per second
+        self.assertAlmostEqual(self.limiter.reserve(50), 0.5)
+        # reservations queue behind each other
+        self.assertAlmostEqual(self.limiter.reserve(50), 1.0)
+        self.clock.now = 1.0
+        self.assertAlmostEqual(self.limiter.reserve(100), 1.0)
+
+    def test_aimd(self) -> None:
+        self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 50)
+        # throttles of the same burst do not cut again
+        self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 50)
+        self.clock.now = 2.0
+        self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 25)
+        for _ in range(3):
+            self.limiter.on_success()
+        self.assertEqual(self.limiter.rate, 55)
+        for _ in range(10):
+            self.limiter.on_success()
+        self.assertEqual(self.limiter.rate, 100)
+        for _ in range(10):
+            self.clock.now += 2.0
+            self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 5)
+
+        metrics = self.limiter.get_metrics()
+        self.assertEqual((metrics["RateLimit"], metrics["RateLimitThrottles"]), (5, 13))
+        self.assertEqual(self.limiter.get_metrics()["RateLimitThrottles"], 0)
+
+    def test_throttle_empties_the_bucket(self) -> None:
+        self.limiter.on_throttle()
+        self.assertAlmostEqual(self.limiter.reserve(10), 0.2)
+
+    def test_async_acquire(self) -> None:
+        self.limiter.reserve(100)
+        with mock.patch.object(rate_limiter.asyncio, "sleep", new=mock.AsyncMock()) as sleep:
+            waited = asyncio.run(self.limiter.acquire_async(10))
+        self.assertAlmostEqual(waited, 0.1)
+        sleep.assert_awaited_once()
+
+    def test_shared_limiter_per_name_and_ceiling(self) -> None:
+        limiter = rate_limiter.get_shared_rate_limiter("test", 10)
+        self.assertIs(rate_limiter.get_shared_rate_limiter("test", 10), limiter)
+        self.assertIsNot(rate_limiter.get_shared_rate_limiter("test", 20), limiter)
+
+
+class EmfMetricsTestCase(unittest.TestCase):
+    def test_emf_line(self) -> None:
+        with mock.patch("builtins.print"):
+            line = utils.log_emf_metrics({"RateLimit": 40.0, "RateLimitWaitSeconds": 1.5}, {"Service": "smarty"}, {"RateLimitWaitSeconds": "Seconds"})
+        emf = json.loads(line)
+        definition = emf["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(definition["Dimensions"], [["Service"]])
+        self.assertEqual(definition["Metrics"], [{"Name": "RateLimit", "Unit": "None"}, {"Name": "RateLimitWaitSeconds", "Unit": "Seconds"}])
+        self.assertEqual((emf["Service"], emf["RateLimit"]), ("smarty", 40.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
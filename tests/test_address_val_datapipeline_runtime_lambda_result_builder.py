@@ -0,0 +1,64 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import unittest
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import result_builder
+
+
+class ResultBuilderTestCase(unittest.TestCase):
+
+    def test_valid_and_invalid_rows_share_the_schema(self):
+        builder = result_builder.ResultBuilder(capacity=2)
+        builder.append({"i_batch_index": 0, "i_input_id": "1", "o_city": "Seattle", "o_valid": 1})
+        builder.append({"i_batch_index": 1, "i_input_id": "2", "o_valid": 0})
+
+        table = builder.to_table()
+        self.assertEqual(table.schema, result_builder.RESULT_SCHEMA)
+        rows = table.to_pylist()
+        self.assertEqual(rows[0]["o_city"], "Seattle")
+        self.assertIsNone(rows[1]["o_city"])
+        self.assertEqual([row["o_valid"] for row in rows], [1, 0])
+
+    def test_grows_past_capacity_and_keeps_order(self):
+        builder = result_builder.ResultBuilder()
+        for i in range(40):
+            builder.append({"i_batch_index": i})
+
+        self.assertEqual(len(builder), 40)
+        self.assertEqual(builder.to_table().column("i_batch_index").to_pylist(), list(range(40)))
+
+    def test_coerces_values_to_the_column_type(self):
+        builder = result_builder.ResultBuilder(capacity=1)
+        builder.append({"i_input_id": 123, "o_street_address2": float("nan"), "unknown": "dropped"})
+
+        row = builder.to_table().to_pylist()[0]
+        self.assertEqual(row["i_input_id"], "123")
+        self.assertIsNone(row["o_street_address2"])
+        self.assertNotIn("unknown", row)
+
+    def test_empty_builder(self):
+        df = result_builder.ResultBuilder(capacity=5).to_pandas()
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), result_builder.RESULT_SCHEMA.names)
+
+
+if __name__ == '__main__':
+    unittest.main()
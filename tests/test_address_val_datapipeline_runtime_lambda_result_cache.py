@@ -0,0 +1,155 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import result_cache
+import smarty_addr_val
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeDynamoDBClient:
+    """
+    Keeps the items in a dict and leaves the first request of each kind partly unprocessed
+    """
+    def __init__(self) -> None:
+        self.items = {}
+        self.get_requests = []
+        self.write_requests = []
+
+    def batch_get_item(self, RequestItems):
+        table, request = next(iter(RequestItems.items()))
+        self.get_requests.append(len(request["Keys"]))
+        keys = request["Keys"]
+        unprocessed = {}
+        if len(self.get_requests) == 1 and len(keys) > 1:
+            keys, unprocessed = keys[:1], {table: {"Keys": keys[1:]}}
+        found = [self.items[key["cache_key"]["S"]] for key in keys if key["cache_key"]["S"] in self.items]
+        return {"Responses": {table: found}, "UnprocessedKeys": unprocessed}
+
+    def batch_write_item(self, RequestItems):
+        table, requests = next(iter(RequestItems.items()))
+        self.write_requests.append(len(requests))
+        unprocessed = {}
+        if len(self.write_requests) == 1 and len(requests) > 1:
+            requests, unprocessed = requests[:1], {table: requests[1:]}
+        for request in requests:
+            item = request["PutRequest"]["Item"]
+            self.items[item["cache_key"]["S"]] = item
+        return {"UnprocessedItems": unprocessed}
+
+
+class CacheKeyTestCase(unittest.TestCase):
+    def test_formatting_differences_share_a_key(self) -> None:
+        self.assertEqual(
+            result_cache.get_cache_key("smarty", "123 Main St., San Francisco  CA"),
+            result_cache.get_cache_key("smarty", " 123 main st san francisco ca ")
+        )
+
+    def test_keys_differ_by_provider_and_unit(self) -> None:
+        self.assertNotEqual(result_cache.get_cache_key("smarty", "1 Main St"), result_cache.get_cache_key("awslocation", "1 Main St"))
+        self.assertNotEqual(result_cache.get_cache_key("smarty", "1 Main St #2"), result_cache.get_cache_key("smarty", "1 Main St #3"))
+
+
+class InMemoryResultCacheTestCase(unittest.TestCase):
+    def test_hits_misses_and_expiry(self) -> None:
+        clock = FakeClock()
+        cache = result_cache.InMemoryResultCache(ttl_days=1, clock=clock)
+        cache.put_many({"a": {"o_valid": 1}})
+
+        self.assertEqual(cache.get_many(["a", "b"]), {"a": {"o_valid": 1}})
+        clock.now += 2 * 24 * 3600
+        self.assertEqual(cache.get_many(["a"]), {})
+
+        self.assertEqual(cache.get_metrics(), {"CacheHits": 1, "CacheMisses": 2, "CacheHitRate": 100.0 / 3})
+        self.assertEqual(cache.get_metrics()["CacheHits"], 0)
+
+    def test_read_errors_count_as_misses(self) -> None:
+        cache = result_cache.InMemoryResultCache()
+        with mock.patch.object(cache, "read_items", side_effect=RuntimeError("unavailable")):
+            self.assertEqual(cache.get_many(["a", "b"]), {})
+        self.assertEqual(cache.get_metrics()["CacheMisses"], 2)
+
+
+class DynamoDBResultCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = FakeDynamoDBClient()
+        session = mock.Mock()
+        session.client.return_value = self.client
+        self.clock = FakeClock()
+        self.cache = result_cache.DynamoDBResultCache("cache", ttl_days=1, boto3_session=session, clock=self.clock)
+
+    def test_batches_are_chunked_and_unprocessed_requests_retried(self) -> None:
+        results = {f"key-{i}": {"o_valid": i % 2} for i in range(120)}
+        with mock.patch.object(result_cache.time, "sleep"):
+            self.cache.put_many(results)
+            found = self.cache.get_many(list(results))
+
+        self.assertEqual(found, results)
+        self.assertEqual(self.client.write_requests, [25, 24, 25, 25, 25, 20])
+        self.assertEqual(self.client.get_requests, [100, 99, 20])
+        self.assertEqual(json.loads(self.client.items["key-1"]["result"]["S"]), {"o_valid": 1})
+
+    def test_expired_items_are_misses(self) -> None:
+        self.cache.put_many({"a": {"o_valid": 1}})
+        self.clock.now += 2 * 24 * 3600
+
+        self.assertEqual(self.cache.get_many(["a"]), {})
+        self.assertEqual(self.cache.get_metrics()["CacheMisses"], 1)
+
+
+class SmartyCacheTestCase(unittest.TestCase):
+    def test_only_cache_misses_are_sent_to_smarty(self) -> None:
+        config = {"schema_map": {"address_line1": "address1"}}
+        message_batch = [{"source_id": 1, "address1": "1 Main St"}, {"source_id": 2, "address1": "2 Main St"}]
+        cache = result_cache.InMemoryResultCache()
+        cache.put_many({result_cache.get_cache_key("smarty", "1 main st"): {"o_valid": 1, "o_city": "SEATTLE"}})
+        sent = []
+
+        def send_batch(client, batch, limiter, max_throttle_retries, max_transient_retries):
+            sent.extend(lookup.street for lookup in batch)
+            for lookup in batch:
+                lookup.result = []
+
+        writer = mock.Mock()
+        provider = smarty_addr_val.providers.SmartyProvider(config)
+        with mock.patch.object(provider, "get_client"), \
+                mock.patch.object(smarty_addr_val.providers, "send_smarty_batch", side_effect=send_batch):
+            smarty_addr_val.providers.validate_message_batch(provider, config, message_batch, "msg", writer, cache)
+
+        self.assertEqual(sent, ["2 Main St"])
+        table = writer.write.call_args[0][0]
+        self.assertEqual(table.column("o_valid").to_pylist(), [1, 0])
+        self.assertEqual(table.column("o_city").to_pylist(), ["SEATTLE", None])
+        # the new output is cached for the next run
+        self.assertEqual(len(cache.get_many([result_cache.get_cache_key("smarty", "2 Main St")])), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
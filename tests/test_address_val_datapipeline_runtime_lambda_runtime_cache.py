@@ -0,0 +1,124 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import threading
+import unittest
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from smartystreets_python_sdk import exceptions
+from util import runtime_cache
+import smarty_addr_val
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RuntimeCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.cache = runtime_cache.RuntimeCache(refresh_ahead_share=0.2, clock=self.clock)
+        self.loads = 0
+
+    def loader(self) -> int:
+        self.loads += 1
+        return self.loads
+
+    def test_value_is_loaded_once_until_it_expires(self) -> None:
+        self.assertEqual(self.cache.get("config", self.loader, 100), 1)
+        self.clock.now += 50
+        self.assertEqual(self.cache.get("config", self.loader, 100), 1)
+        self.clock.now += 100
+        self.assertEqual(self.cache.get("config", self.loader, 100), 2)
+
+    def test_value_is_refreshed_in_the_background_before_it_expires(self) -> None:
+        self.cache.get("config", self.loader, 100)
+        self.clock.now += 85
+        refreshed = threading.Event()
+        original_load = self.cache.load
+
+        def load(entry):
+            original_load(entry)
+            refreshed.set()
+
+        with mock.patch.object(self.cache, "load", side_effect=load):
+            # the cached value is returned while the refresh runs
+            self.assertEqual(self.cache.get("config", self.loader, 100), 1)
+            self.assertTrue(refreshed.wait(5))
+        self.assertEqual(self.cache.get("config", self.loader, 100), 2)
+        self.assertEqual(self.loads, 2)
+
+    def test_failed_refresh_keeps_the_value(self) -> None:
+        self.cache.get("config", self.loader, 100)
+        self.clock.now += 85
+        entry = self.cache.entries["config"]
+        entry.loader = mock.Mock(side_effect=RuntimeError("ssm unavailable"))
+
+        self.cache.refresh("config", entry)
+
+        self.assertEqual(self.cache.get("config", self.loader, 100), 1)
+        self.assertFalse(entry.refreshing)
+
+    def test_invalidate_forces_a_reload(self) -> None:
+        self.cache.get("client", self.loader)
+        self.cache.invalidate("client")
+        self.assertEqual(self.cache.get("client", self.loader), 2)
+
+
+class SecretRefreshTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        runtime_cache.runtime_cache.invalidate()
+        self.addCleanup(runtime_cache.runtime_cache.invalidate)
+
+    def test_secrets_are_cached_until_refreshed(self) -> None:
+        config = {"secret_name": "smarty", "region_name": "us-west-2"}
+        secrets = [{"auth_id": "old"}, {"auth_id": "new"}]
+        with mock.patch.object(runtime_cache.utils, "get_secret_credentials", side_effect=secrets) as get_secret:
+            self.assertEqual(runtime_cache.add_secrets_to_config(dict(config))["secrets"], {"auth_id": "old"})
+            self.assertEqual(runtime_cache.add_secrets_to_config(dict(config))["secrets"], {"auth_id": "old"})
+            self.assertEqual(runtime_cache.refresh_secrets(dict(config))["secrets"], {"auth_id": "new"})
+        self.assertEqual(get_secret.call_count, 2)
+
+    def test_smarty_batch_is_sent_again_with_rotated_credentials(self) -> None:
+        config = {"secret_name": "smarty", "region_name": "us-west-2", "license_key": "us-core-cloud", "secrets": {"auth_id": "old", "auth_token": "t"}}
+        clients = []
+
+        def send_batch(client, batch, limiter, max_throttle_retries, max_transient_retries):
+            clients.append(client)
+            if len(clients) == 1:
+                raise exceptions.BadCredentialsError("rejected")
+            for lookup in batch:
+                lookup.result = []
+
+        provider = smarty_addr_val.providers.SmartyProvider(config)
+        with mock.patch.object(runtime_cache.utils, "get_secret_credentials", return_value={"auth_id": "new", "auth_token": "t"}), \
+                mock.patch.object(smarty_addr_val.providers, "build_smarty_client", side_effect=lambda config, no_retries: config["secrets"]["auth_id"]), \
+                mock.patch.object(smarty_addr_val.providers, "send_smarty_batch", side_effect=send_batch):
+            smarty_addr_val.providers.send_provider_batch(provider, ["1 Main St"])
+
+        self.assertEqual(clients, ["old", "new"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import gzip
+import io
+import math
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+import pyarrow as pa
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import s3_csv_reader
+
+SAMPLE_CSV = "source_id,last_name,address1,address2,city,state_code,zip_code\n" + "".join(
+    f"id{i},Davis,{i} Main St,{'unit 2' if i % 2 else ''},Nantucket,MA,0255{i % 10}\n" for i in range(250)
+)
+
+
+def open_sample_stream(bucket, key, boto3_session=None, byte_range=None):
+    data = SAMPLE_CSV.encode("utf-8")
+    if key.endswith(".gz"):
+        return pa.CompressedInputStream(pa.PythonFile(io.BytesIO(gzip.compress(data)), mode="r"), "gzip")
+    return pa.PythonFile(io.BytesIO(data), mode="r")
+
+
+class FakeS3Client:
+    """
+    Serves the sample csv with ranged get_object requests
+    """
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.data)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.data
+        if Range:
+            first, last = Range[len("bytes="):].split("-")
+            data = data[int(first):int(last) + 1]
+        return {"Body": io.BytesIO(data)}
+
+
+class S3CsvReaderTestCase(unittest.TestCase):
+    def read_chunks(self, keys, **kwargs) -> list:
+        with mock.patch.object(s3_csv_reader, "list_s3_csv_objects", return_value=keys), \
+                mock.patch.object(s3_csv_reader, "open_s3_input_stream", side_effect=open_sample_stream), \
+                mock.patch.object(s3_csv_reader.boto3.session, "Session"):
+            return list(s3_csv_reader.read_s3_file_projected("bucket", "prefix", **kwargs))
+
+    def test_projected_columns_and_chunks(self) -> None:
+        columns = ["source_id", "address1", "address2", "state_code", "zip_code"]
+        chunks = self.read_chunks(["prefix/part-0.csv.gz"], chunk_size=100, columns=columns)
+
+        self.assertEqual([len(chunk.index) for chunk in chunks], [100, 100, 50])
+        self.assertEqual(list(chunks[0].columns), columns)
+        row = chunks[0].to_dict("records")[0]
+        # postal codes keep their leading zeros and missing values are NaN
+        self.assertEqual(row["zip_code"], "02550")
+        self.assertTrue(math.isnan(row["address2"]))
+
+    def test_limit_rows_across_objects(self) -> None:
+        chunks = self.read_chunks(["prefix/part-0.csv", "prefix/part-1.csv"], chunk_size=100, limit_rows=300, columns=["source_id"])
+        self.assertEqual(sum(len(chunk.index) for chunk in chunks), 300)
+        self.assertEqual(chunks[-1]["source_id"].iloc[-1], "id49")
+
+    def test_all_columns_from_header(self) -> None:
+        with mock.patch.object(s3_csv_reader, "open_s3_input_stream", side_effect=open_sample_stream):
+            header = s3_csv_reader.read_s3_csv_header("bucket", "prefix/part-0.csv")
+        self.assertEqual(header, ["source_id", "last_name", "address1", "address2", "city", "state_code", "zip_code"])
+
+
+
+class S3CsvByteRangeTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        session = mock.Mock()
+        session.client.return_value = FakeS3Client(SAMPLE_CSV.encode("utf-8"))
+        patches = [
+            mock.patch.object(s3_csv_reader, "list_s3_csv_objects", return_value=["prefix/part-0.csv"]),
+            mock.patch.object(s3_csv_reader.boto3.session, "Session", return_value=session),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_ranges_are_newline_aligned_and_contiguous(self) -> None:
+        data = SAMPLE_CSV.encode("utf-8")
+        ranges = s3_csv_reader.plan_s3_csv_ranges("bucket", "prefix", range_size=1000)
+
+        self.assertGreater(len(ranges), 5)
+        self.assertEqual(ranges[0]["start"], data.index(b"\n") + 1)
+        self.assertEqual(ranges[-1]["end"], len(data))
+        for previous, current in zip(ranges, ranges[1:]):
+            self.assertEqual(previous["end"], current["start"])
+        for byte_range in ranges:
+            self.assertEqual(data[byte_range["start"] - 1:byte_range["start"]], b"\n")
+            self.assertEqual(byte_range["column_names"][0], "source_id")
+
+    def test_ranges_cover_every_row_once(self) -> None:
+        ranges = s3_csv_reader.plan_s3_csv_ranges("bucket", "prefix", range_size=777)
+        source_ids = []
+        for byte_range in ranges:
+            for df_chunk in s3_csv_reader.read_s3_range_projected(byte_range, chunk_size=40, columns=["source_id", "zip_code"]):
+                source_ids.extend(df_chunk["source_id"])
+                self.assertTrue(df_chunk["zip_code"].str.startswith("0255").all())
+
+        self.assertEqual(source_ids, [f"id{i}" for i in range(250)])
+
+    def test_file_with_quoted_newlines_is_one_range(self) -> None:
+        data = ('source_id,address1\nid0,"1 Main St\nunit 2"\n' + "".join(f'id{i},"{i} Main St"\n' for i in range(1, 100))).encode("utf-8")
+        session = mock.Mock()
+        session.client.return_value = FakeS3Client(data)
+
+        ranges = s3_csv_reader.plan_s3_csv_ranges("bucket", "prefix", range_size=100, boto3_session=session)
+
+        self.assertEqual(ranges, [{"bucket": "bucket", "key": "prefix/part-0.csv", "start": 0, "end": None, "column_names": None, "newlines_in_values": True}])
+        with mock.patch.object(s3_csv_reader, "open_s3_input_stream", return_value=pa.PythonFile(io.BytesIO(data), mode="r")):
+            chunks = list(s3_csv_reader.read_s3_range_projected(ranges[0], chunk_size=40, columns=["source_id", "address1"]))
+        self.assertEqual(sum(len(chunk.index) for chunk in chunks), 100)
+        self.assertEqual(chunks[0]["address1"].iloc[0], "1 Main St\nunit 2")
+
+    def test_quoted_newlines_are_detected(self) -> None:
+        self.assertTrue(s3_csv_reader.has_quoted_newline(b'a,"b\nc"\n'))
+        self.assertFalse(s3_csv_reader.has_quoted_newline(b'a,"b ""c"""\nd,e\n'))
+        self.assertFalse(s3_csv_reader.has_quoted_newline(SAMPLE_CSV.encode("utf-8")))
+
+    def test_parallel_read(self) -> None:
+        chunks = list(s3_csv_reader.read_s3_file_parallel("bucket", "prefix", chunk_size=40, columns=["source_id"], concurrency=3, range_size=500))
+        self.assertEqual(sorted(source_id for chunk in chunks for source_id in chunk["source_id"]), sorted(f"id{i}" for i in range(250)))
+        self.assertTrue(all(len(chunk.index) <= 40 for chunk in chunks))
+
+        limited = list(s3_csv_reader.read_s3_file_parallel("bucket", "prefix", chunk_size=40, limit_rows=90, columns=["source_id"], concurrency=3, range_size=500))
+        self.assertEqual(sum(len(chunk.index) for chunk in limited), 90)
+
+    def test_parallel_read_raises_range_error(self) -> None:
+        def read_range(byte_range):
+            raise ValueError("bad range")
+            yield
+
+        with self.assertRaises(ValueError):
+            list(s3_csv_reader.iter_ranges_parallel([{"start": 0}, {"start": 1}], read_range, concurrency=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import threading
+import unittest
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from smartystreets_python_sdk import exceptions
+from util import rate_limiter
+import smarty_addr_val
+
+
+class SmartyBatchesTestCase(unittest.TestCase):
+    def test_batches_run_concurrently_with_isolated_errors(self) -> None:
+        batches = [("msg", i, [{"source_id": i}]) for i in range(8)]
+        barrier = threading.Barrier(4, timeout=5)
+        completed = []
+
+        def validate_batch(provider, config, message_batch, msg_id, writer, cache=None, dedup=None):
+            list_index = message_batch[0]["source_id"]
+            if list_index < 4:
+                # the first four batches only pass the barrier if they run at the same time
+                barrier.wait()
+            if list_index == 5:
+                raise RuntimeError("smarty unavailable")
+            completed.append(list_index)
+
+        with mock.patch.object(smarty_addr_val.providers, "validate_message_batch", side_effect=validate_batch):
+            failed = smarty_addr_val.run_provider_batches(mock.Mock(), {}, batches, mock.Mock(), concurrency=4)
+
+        self.assertEqual(failed, [("msg", 5)])
+        self.assertEqual(sorted(completed), [0, 1, 2, 3, 4, 6, 7])
+
+
+class SmartyThrottleTestCase(unittest.TestCase):
+    def test_throttled_batch_is_retried_through_the_limiter(self) -> None:
+        client = mock.Mock()
+        client.send_batch.side_effect = [exceptions.TooManyRequestsError("slow down"), None]
+        limiter = rate_limiter.AdaptiveRateLimiter(max_rate=1000)
+
+        with mock.patch.object(rate_limiter.time, "sleep"):
+            smarty_addr_val.send_smarty_batch(client, [{}] * 100, limiter)
+
+        self.assertEqual(client.send_batch.call_count, 2)
+        self.assertEqual(limiter.get_metrics()["RateLimitThrottles"], 1)
+
+    def test_batch_fails_when_throttled_after_retries(self) -> None:
+        client = mock.Mock()
+        client.send_batch.side_effect = exceptions.TooManyRequestsError("slow down")
+        config = {"rate_limit_per_second": 1000, "max_throttle_retries": 1, "schema_map": {"address_line1": "address1"}}
+        provider = smarty_addr_val.providers.SmartyProvider(config)
+
+        with mock.patch.object(provider, "get_client", return_value=client), \
+                mock.patch.object(rate_limiter.time, "sleep"), \
+                self.assertRaises(smarty_addr_val.providers.ProviderError) as raised:
+            smarty_addr_val.providers.validate_message_batch(provider, config, [{"source_id": 1, "address1": "1 Main St"}], "msg", mock.Mock())
+        self.assertIsInstance(raised.exception.error, exceptions.TooManyRequestsError)
+        self.assertEqual(client.send_batch.call_count, 2)
+
+
+class SmartyPartialBatchTestCase(unittest.TestCase):
+    @mock.patch.dict("os.environ", {"SSM_PARAMETER": "addr-val-smarty"})
+    def test_only_failed_messages_are_reported(self) -> None:
+        records = [{"messageId": f"m{i}", "body": f"body{i}"} for i in range(4)]
+
+        def read_message_batch(body):
+            if body == "body3":
+                raise ValueError("claim check batch not found")
+            return [{"source_id": n} for n in range(150)]
+
+        def run_batches(provider, config, batches, writer, concurrency, cache=None, dedup=None):
+            self.assertEqual(sorted({msg_id for msg_id, _, _ in batches}), ["m0", "m1", "m2"])
+            self.assertEqual([index for msg_id, index, _ in batches if msg_id == "m1"], [0, 1])
+            return [("m1", 1)]
+
+        with mock.patch.object(smarty_addr_val.runtime_cache, "get_app_configuration", return_value={}), \
+                mock.patch.object(smarty_addr_val.runtime_cache, "add_secrets_to_config", side_effect=lambda config, cli_profile=None: config), \
+                mock.patch.object(smarty_addr_val.utils, "read_message_batch", side_effect=read_message_batch), \
+                mock.patch.object(smarty_addr_val.output_writer, "build_output_writer", return_value=mock.Mock(upload_error=None)), \
+                mock.patch.object(smarty_addr_val.runtime_cache, "get_boto3_session"), \
+                mock.patch.object(smarty_addr_val, "get_smarty_provider"), \
+                mock.patch.object(smarty_addr_val, "run_provider_batches", side_effect=run_batches):
+            response = smarty_addr_val.lambda_handler({"Records": records}, None)
+
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m1"}, {"itemIdentifier": "m3"}]})
+
+    @mock.patch.dict("os.environ", {"SSM_PARAMETER": "addr-val-smarty"})
+    def test_all_messages_are_retried_when_an_output_file_is_lost(self) -> None:
+        records = [{"messageId": f"m{i}", "body": f"body{i}"} for i in range(2)]
+        writer = mock.Mock(upload_error=None)
+
+        def close():
+            writer.upload_error = OSError("upload failed")
+            raise writer.upload_error
+
+        writer.close.side_effect = close
+        with mock.patch.object(smarty_addr_val.runtime_cache, "get_app_configuration", return_value={}), \
+                mock.patch.object(smarty_addr_val.runtime_cache, "add_secrets_to_config", side_effect=lambda config, cli_profile=None: config), \
+                mock.patch.object(smarty_addr_val.utils, "read_message_batch", return_value=[{"source_id": 1}]), \
+                mock.patch.object(smarty_addr_val.output_writer, "build_output_writer", return_value=writer), \
+                mock.patch.object(smarty_addr_val.runtime_cache, "get_boto3_session"), \
+                mock.patch.object(smarty_addr_val, "get_smarty_provider"), \
+                mock.patch.object(smarty_addr_val, "run_provider_batches", return_value=[]):
+            response = smarty_addr_val.lambda_handler({"Records": records}, None)
+
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m0"}, {"itemIdentifier": "m1"}]})
+        writer.delete_written.assert_called_once()
+
+
+class SmartyProviderTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        smarty_addr_val.runtime_cache.runtime_cache.invalidate()
+        self.addCleanup(smarty_addr_val.runtime_cache.runtime_cache.invalidate)
+
+    def test_engine_selects_the_smarty_provider(self) -> None:
+        config = {"license_key": "us-core-cloud", "secrets": {"auth_id": "id", "auth_token": "t"}}
+
+        self.assertIs(type(smarty_addr_val.get_smarty_provider(config)), smarty_addr_val.providers.SmartyProvider)
+        self.assertIs(type(smarty_addr_val.get_smarty_provider({**config, "engine": "async_http"})), smarty_addr_val.async_http.AsyncHTTPSmartyProvider)
+        # the provider is kept while the configuration does not change
+        self.assertIs(smarty_addr_val.get_smarty_provider(config), smarty_addr_val.get_smarty_provider(config))
+
+    def test_hedge_settings_wrap_the_smarty_provider(self) -> None:
+        config = {"hedge": {"provider": "fake"}, "secrets": {}}
+
+        provider = smarty_addr_val.get_smarty_provider(config)
+
+        self.assertIsInstance(provider, smarty_addr_val.hedging.HedgedProvider)
+        self.assertIsInstance(provider.primary, smarty_addr_val.providers.SmartyProvider)
+
+    @mock.patch.dict("os.environ", {"SSM_PARAMETER": "addr-val-smarty"})
+    def test_batches_run_on_the_provider_of_the_configuration(self) -> None:
+        records = [{"messageId": "m0", "body": "body0"}]
+        provider = mock.Mock(spec=smarty_addr_val.hedging.HedgedProvider)
+        provider.get_metrics.return_value = {"HedgeRate": 5.0}
+
+        with mock.patch.object(smarty_addr_val.runtime_cache, "get_app_configuration", return_value={"hedge": {}}), \
+                mock.patch.object(smarty_addr_val.runtime_cache, "add_secrets_to_config", side_effect=lambda config, cli_profile=None: config), \
+                mock.patch.object(smarty_addr_val.utils, "read_message_batch", return_value=[{"source_id": 1}]), \
+                mock.patch.object(smarty_addr_val.output_writer, "build_output_writer", return_value=mock.Mock(upload_error=None)), \
+                mock.patch.object(smarty_addr_val.runtime_cache, "get_boto3_session"), \
+                mock.patch.object(smarty_addr_val, "get_smarty_provider", return_value=provider), \
+                mock.patch.object(smarty_addr_val, "run_provider_batches", return_value=[("m0", 0)]) as run_provider_batches:
+            response = smarty_addr_val.lambda_handler({"Records": records}, None)
+
+        self.assertIs(run_provider_batches.call_args[0][0], provider)
+        provider.get_metrics.assert_called_once()
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m0"}]})
+
+
+if __name__ == "__main__":
+    unittest.main()
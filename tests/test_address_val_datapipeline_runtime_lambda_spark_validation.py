@@ -0,0 +1,97 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+import pandas as pd
+from util import providers, result_builder, spark_validation
+
+SCHEMA_MAP = {"address_line1": "address1"}
+CONFIG = {"schema_map": SCHEMA_MAP, "rate_limit_per_second": 1000}
+
+
+def build_frame(start: int, count: int) -> pd.DataFrame:
+    return pd.DataFrame({"source_id": [str(i) for i in range(start, start + count)], "address1": [f"{i} Main St" for i in range(start, start + count)]})
+
+
+class SparkValidationTestCase(unittest.TestCase):
+    def test_spark_schema_matches_the_output_schema(self) -> None:
+        schema = spark_validation.get_spark_schema()
+
+        self.assertTrue(schema.startswith("i_input_msg_id string, i_batch_index bigint, i_input_id string"))
+        self.assertEqual(schema.count(","), len(result_builder.RESULT_SCHEMA) - 1)
+
+    def test_rate_limit_is_split_across_concurrent_tasks(self) -> None:
+        concurrent_tasks = spark_validation.get_concurrent_tasks(80, 40)
+        task_config = spark_validation.get_task_config(CONFIG, concurrent_tasks)
+
+        self.assertEqual(concurrent_tasks, 40)
+        self.assertEqual(task_config["rate_limit_per_second"], 25)
+        self.assertEqual(CONFIG["rate_limit_per_second"], 1000)
+        self.assertEqual(spark_validation.get_concurrent_tasks(4, 40), 4)
+        self.assertNotIn("rate_limit_per_second", spark_validation.get_task_config({"schema_map": SCHEMA_MAP}, 4))
+
+    def test_frames_are_validated_in_provider_batches(self) -> None:
+        provider = providers.FakeProvider(max_batch_size=10, invalid=("3 Main St",))
+
+        frames = list(spark_validation.validate_frames(iter([build_frame(0, 25), build_frame(25, 0), build_frame(25, 5)]), CONFIG, "task", provider=provider))
+
+        self.assertEqual([len(frame.index) for frame in frames], [25, 5])
+        self.assertEqual(sorted(len(call) for call in provider.calls), [5, 5, 10, 10])
+        self.assertEqual(list(frames[0].columns), result_builder.RESULT_SCHEMA.names)
+        self.assertEqual(frames[1]["i_input_id"].tolist(), [str(i) for i in range(25, 30)])
+        self.assertEqual(frames[1]["i_input_msg_id"].unique().tolist(), ["task-2"])
+        self.assertEqual(frames[0]["o_valid"].sum(), 24)
+
+    def test_error_outside_the_provider_fails_the_task(self) -> None:
+        cache = mock.Mock()
+        cache.get_many.side_effect = ConnectionError("cache unavailable")
+
+        with mock.patch.object(spark_validation.result_cache, "build_result_cache", return_value=cache), \
+                self.assertRaises(ConnectionError):
+            list(spark_validation.validate_frames(iter([build_frame(0, 5)]), CONFIG, "task", provider=providers.FakeProvider()))
+
+    def test_rows_of_skipped_frames_are_counted(self) -> None:
+        provider = providers.FakeProvider(failing=("1 Main St",))
+        skipped_rows = mock.Mock()
+
+        frames = list(spark_validation.validate_frames(iter([build_frame(0, 5), build_frame(5, 3)]), CONFIG, "task", provider=provider,
+                                                       skipped_rows=skipped_rows))
+
+        self.assertEqual([len(frame.index) for frame in frames], [3])
+        skipped_rows.add.assert_called_once_with(5)
+
+    def test_partitions_are_registered_with_hive_paths(self) -> None:
+        config = {"s3_bucket": "bucket", "s3_key": "data/out.csv", "output_database": "db", "output_table": "table",
+                  "output_partition_cols": ["run_date", "o_valid"]}
+
+        with mock.patch.object(spark_validation.wr.catalog, "add_parquet_partitions") as add_partitions:
+            spark_validation.register_dataset_partitions(config, [{"run_date": "2024-01-01", "o_valid": 1}, {"run_date": "2024-01-01", "o_valid": None}])
+
+        partitions = add_partitions.call_args[0][2]
+        self.assertEqual(partitions, {
+            "s3://bucket/data/out-csv/run_date=2024-01-01/o_valid=1/": ["2024-01-01", "1"],
+            "s3://bucket/data/out-csv/run_date=2024-01-01/o_valid=__HIVE_DEFAULT_PARTITION__/": ["2024-01-01", "__HIVE_DEFAULT_PARTITION__"]
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()
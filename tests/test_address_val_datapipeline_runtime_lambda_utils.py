@@ -0,0 +1,112 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import math
+import pathlib
+import sys
+import threading
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+# the lambda runtime imports its helpers as a top level util package
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.joinpath("address_validation/datapipeline/runtime/_lambda")))
+
+from util import utils
+
+
+class ClaimCheckTestCase(unittest.TestCase):
+    def test_read_message_batch_inline_rows(self) -> None:
+        rows = utils.read_message_batch('[{"source_id": "a", "address2": NaN}]')
+        self.assertEqual(rows[0]["source_id"], "a")
+        self.assertTrue(math.isnan(rows[0]["address2"]))
+
+    def test_claim_check_round_trip(self) -> None:
+        df = pd.DataFrame({"source_id": ["a", "b"], "address2": ["unit 2", None]})
+        with mock.patch.object(utils.wr.s3, "to_parquet") as mock_to_parquet, \
+                mock.patch.object(utils.wr.s3, "read_parquet", return_value=df) as mock_read_parquet:
+            body = utils.write_claim_check_batch(df, "data-bucket", "sample-data/staging/")
+            rows = utils.read_message_batch(body)
+
+        s3_uri = json.loads(body)["claim_check"]["s3_uri"]
+        self.assertTrue(s3_uri.startswith("s3://data-bucket/sample-data/staging/"))
+        self.assertEqual(mock_to_parquet.call_args.args[1], s3_uri)
+        self.assertEqual(mock_read_parquet.call_args.args[0], s3_uri)
+        self.assertEqual([row["source_id"] for row in rows], ["a", "b"])
+        self.assertTrue(math.isnan(rows[1]["address2"]))
+
+
+class InputVersionTestCase(unittest.TestCase):
+    def test_object_key_is_versioned_by_that_object_alone(self) -> None:
+        session = mock.Mock()
+        paginator = session.client.return_value.get_paginator.return_value
+        paginator.paginate.return_value = [{"Contents": [{"Key": "in/foo.csv", "ETag": "a"}, {"Key": "in/foo.csv.bak", "ETag": "b"}]}]
+        version = utils.get_s3_input_version("bucket", "in/foo.csv", session)
+
+        paginator.paginate.return_value = [{"Contents": [{"Key": "in/foo.csv", "ETag": "a"}, {"Key": "in/foo.csv.bak", "ETag": "c"}]}]
+        self.assertEqual(utils.get_s3_input_version("bucket", "in/foo.csv", session), version)
+
+        paginator.paginate.return_value = [{"Contents": [{"Key": "in/part-0.csv", "ETag": "a"}, {"Key": "in/part-1.csv", "ETag": "c"}]}]
+        self.assertNotEqual(utils.get_s3_input_version("bucket", "in/", session), version)
+
+
+class MessageEnvelopeTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.df = pd.DataFrame({
+            "source_id": ["a", "b", "c"],
+            "address1": ["123 Main St", "9 Elm St", "1 Nantucket Ave"],
+            "address2": ["unit 2", None, None],
+            "zip_code": [94105, 64720, 2554],
+        })
+
+    def test_envelope_round_trip(self) -> None:
+        for layout in utils.MESSAGE_LAYOUTS:
+            for compression in ("none", "gzip"):
+                body = utils.encode_message_envelope(self.df, layout, compression)
+                envelope = json.loads(body)
+                self.assertEqual(envelope["version"], utils.MESSAGE_ENVELOPE_VERSION)
+                self.assertEqual(envelope["row_count"], 3)
+                self.assertNotIn("NaN", body)
+
+                rows = utils.read_message_batch(body)
+                self.assertEqual([row["source_id"] for row in rows], ["a", "b", "c"])
+                self.assertEqual(rows[2]["zip_code"], 2554)
+                self.assertEqual(rows[0]["address2"], "unit 2")
+                self.assertTrue(math.isnan(rows[1]["address2"]))
+
+    def test_unsupported_envelope_version(self) -> None:
+        with self.assertRaises(ValueError):
+            utils.read_message_batch(json.dumps({"version": 99, "layout": "columnar", "payload": {}}))
+
+    def test_projected_columns(self) -> None:
+        columns = utils.get_projected_columns(utils.get_sample_address_schema_mapping())
+        self.assertEqual(columns, ["source_id", "address1", "address2", "city", "state_code", "zip_code", "country"])
+
+
+class HttpSessionTestCase(unittest.TestCase):
+    def test_each_thread_has_its_own_session(self) -> None:
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(utils.get_http_session()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(utils.get_http_session(), utils.get_http_session())
+        self.assertIsNot(sessions[0], utils.get_http_session())
+
+
+if __name__ == "__main__":
+    unittest.main()